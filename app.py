@@ -1,18 +1,42 @@
 import streamlit as st
 import streamlit.components.v1 as components
-from openai import OpenAI
-import json
-import random
-import PyPDF2
-import docx
-import re
-import base64
-from pdf2image import convert_from_bytes
 import io
-from PIL import Image
 import logging
-import httpx
 import os
+import time
+import uuid
+from image_pipeline import MAX_IMAGE_SIDE, prepare_image_payload
+from ingestion_cache import DOCX_MIME_TYPE, PDF_MIME_TYPE, get_ingestion_cache
+from inline_fib_parser import InlineFibParser
+from llm_client import prompt_cache_stats
+from olat_generator import (
+    MAX_CONCURRENT_REQUESTS,
+    MESSAGE_TYPES,
+    build_generation_requests,
+    build_page_requests,
+    collect_type_responses,
+    fetch_responses_concurrently,
+    fib_items_to_olat,
+    inline_fib_items_to_olat,
+    order_message_types,
+    parse_fib_items,
+    render_structured_responses,
+    repair_questions,
+    replace_german_sharp_s,
+    split_chunk_key,
+    split_page_results
+)
+from ocr_tools import ocr_available, split_by_confidence
+from openai_clients import get_openai_client
+from pdf_tools import parse_page_selection
+from qti_export import write_qti_package
+from request_scheduler import get_request_scheduler
+from response_cache import get_response_cache
+from telemetry import get_metrics_store, set_session
+
+# Modes of the image upload: one shared form for all pages or one form per page
+ALL_PAGES_MODE = "Generate for all pages"
+SINGLE_PAGE_MODE = "One page at a time"
 
 # Set page title and icon
 st.set_page_config(page_title="OLAT Fragen Generator", page_icon="📝", layout="wide", initial_sidebar_state="expanded")
@@ -48,286 +72,254 @@ os.environ.pop('HTTPS_PROXY', None)
 os.environ.pop('http_proxy', None)
 os.environ.pop('https_proxy', None)
 
-# Initialize a custom httpx client without proxies
-http_client = httpx.Client()
-
-# Initialize OpenAI client with Streamlit Secrets
+# Initialize OpenAI client with Streamlit Secrets (shared pooled client, created once per process)
 try:
-    client = OpenAI(
-        api_key=st.secrets["openai"]["api_key"],  # API key from Streamlit Secrets
-        http_client=http_client
-    )
+    client = get_openai_client(st.secrets["openai"]["api_key"])  # API key from Streamlit Secrets
     st.success("OpenAI client initialized successfully.")
 except Exception as e:
     st.error(f"Error initializing OpenAI client: {e}")
     st.stop()
 
-# List of available message types
-MESSAGE_TYPES = [
-    "single_choice",
-    "multiple_choice1",
-    "multiple_choice2",
-    "multiple_choice3",
-    "kprim",
-    "truefalse",
-    "draganddrop",
-    "inline_fib"
-]
-
-@st.cache_data
-def read_prompt_from_md(filename):
-    """Read the prompt from a markdown file and cache the result."""
-    with open(f"{filename}.md", "r", encoding="utf-8") as file:
-        return file.read()
-
 def process_image(_image):
-    """Process and resize an image to reduce memory footprint."""
-    if isinstance(_image, (str, bytes)):
-        img = Image.open(io.BytesIO(base64.b64decode(_image) if isinstance(_image, str) else _image))
-    elif isinstance(_image, Image.Image):
-        img = _image
-    else:
-        img = Image.open(_image)
-
-    # Convert to RGB mode if it's not
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-
-    # Resize if the image is too large
-    max_size = 1000  # Reduced max size to reduce memory consumption
-    if max(img.size) > max_size:
-        img.thumbnail((max_size, max_size))
-
-    # Save to bytes
-    img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='JPEG')
-    img_byte_arr = img_byte_arr.getvalue()
-
-    return base64.b64encode(img_byte_arr).decode('utf-8')
-
-def replace_german_sharp_s(text):
-    """Replace all occurrences of 'ß' with 'ss'."""
-    return text.replace('ß', 'ss')
-
-def clean_json_string(s):
-    # Remove all markdown code blocks and surrounding whitespace
-    s = re.sub(r'^\s*```(json)?\s*', '', s, flags=re.IGNORECASE | re.MULTILINE)
-    s = re.sub(r'\s*```\s*$', '', s, flags=re.IGNORECASE | re.MULTILINE)
-    
-    # Remove any remaining triple backticks in the content
-    s = re.sub(r'```', '', s)
-    
-    # Additional cleaning
-    s = s.strip()
-    s = re.sub(r'\s+', ' ', s)
-    s = re.sub(r'(?<=text": ")(.+?)(?=")', lambda m: m.group(1).replace('\n', '\\n'), s)
-    s = ''.join(char for char in s if ord(char) >= 32 or char == '\n')
-    
-    # Handle potential incomplete JSON
-    if not s.startswith('['):
-        s = '[' + s
-    if not s.endswith(']'):
-        s += ']'
-    
-    return s
-
-def convert_json_to_text_format(json_input):
-    if isinstance(json_input, str):
-        data = json.loads(json_input)
-    else:
-        data = json_input
-
-    fib_output = []
-    ic_output = []
-
-    for item in data:
-        text = item.get('text', '')
-        blanks = item.get('blanks', [])
-        wrong_substitutes = item.get('wrong_substitutes', [])
-
-        num_blanks = len(blanks)
-
-        fib_lines = [
-            "Type\tFIB",
-            "Title\t✏✏Vervollständigen Sie die Lücken mit dem korrekten Begriff.✏✏",
-            f"Points\t{num_blanks}"
-        ]
-
-        for blank in blanks:
-            text = text.replace(blank, "{blank}", 1)
-
-        parts = text.split("{blank}")
-        for index, part in enumerate(parts):
-            fib_lines.append(f"Text\t{part.strip()}")
-            if index < len(blanks):
-                fib_lines.append(f"1\t{blanks[index]}\t20")
-
-        fib_output.append('\n'.join(fib_lines))
-
-        ic_lines = [
-            "Type\tInlinechoice",
-            "Title\tWörter einordnen",
-            "Question\t✏✏Wählen Sie die richtigen Wörter.✏✏",
-            f"Points\t{num_blanks}"
-        ]
-
-        all_options = blanks + wrong_substitutes
-        random.shuffle(all_options)
-
-        for index, part in enumerate(parts):
-            ic_lines.append(f"Text\t{part.strip()}")
-            if index < len(blanks):
-                options_str = '|'.join(all_options)
-                ic_lines.append(f"1\t{options_str}\t{blanks[index]}\t|")
-
-        ic_output.append('\n'.join(ic_lines))
-
-    return '\n\n'.join(fib_output), '\n\n'.join(ic_output)
+    """Downscale and encode an image once; repeated calls for the same image reuse the payload."""
+    return prepare_image_payload(_image, max_side=MAX_IMAGE_SIDE)
 
 def transform_output(json_string):
+    """Convert the inline_fib JSON response into (OLAT text, FibItems), showing parse errors in the page."""
     try:
-        cleaned_json_string = clean_json_string(json_string)
-        json_data = json.loads(cleaned_json_string)
-        fib_output, ic_output = convert_json_to_text_format(json_data)
-        
-        # Apply the cleaning function here
-        fib_output = replace_german_sharp_s(fib_output)
-        ic_output = replace_german_sharp_s(ic_output)
-
-        return f"{ic_output}\n---\n{fib_output}"
-    except json.JSONDecodeError as e:
+        fib_items = parse_fib_items(json_string)
+        for fib_item in fib_items:
+            if fib_item.unmatched:
+                st.warning(f"Blanks not found in the question text and left out: {', '.join(fib_item.unmatched)}")
+        return fib_items_to_olat(fib_items), fib_items
+    except ValueError as e:
         st.error(f"Error parsing JSON: {e}")
-        st.text("Cleaned input:")
-        st.code(cleaned_json_string, language='json')
         st.text("Original input:")
         st.code(json_string)
-        
-        try:
-            if not cleaned_json_string.strip().endswith(']'):
-                cleaned_json_string += ']'
-            partial_json = json.loads(cleaned_json_string)
-            st.warning("Attempted to salvage partial JSON. Results may be incomplete.")
-            fib_output, ic_output = convert_json_to_text_format(partial_json)
-            return f"{ic_output}\n---\n{fib_output}"
-        except Exception as e_partial:
-            st.error(f"Unable to salvage partial JSON: {e_partial}")
-            return "Error: Invalid JSON format"
+        return "Error: Invalid JSON format", []
     except Exception as e:
         st.error(f"Error processing input: {str(e)}")
         st.text("Original input:")
         st.code(json_string)
-        return "Error: Unable to process input"
+        return "Error: Unable to process input", []
 
-def get_chatgpt_response(prompt, image=None, selected_language="English"):
-    """Fetch response from OpenAI GPT with error handling."""
-    try:
-        # Auto-select model based on input type
-        model = "gpt-5.2" if image else "gpt-5.2"
-        
-        # Create a system prompt that includes language instruction
-        system_prompt = (
-            """
-            You are an expert educator specializing in generating test questions and answers across all topics, following Bloom’s Taxonomy. Your role is to create high-quality Q&A sets based on the material provided by the user, ensuring each question aligns with a specific level of Bloom’s Taxonomy: Remember, Understand, Apply, Analyze, Evaluate, and Create.
+def page_question_form(image, idx, selected_language, max_concurrency=MAX_CONCURRENT_REQUESTS, use_cache=True, stream=False, structured=False, validate=True):
+    """Show one page with its own instructions, question types and generate button."""
+    st.image(image, caption=f'Page {idx+1}', use_column_width=True)
 
-            The user will provide input by either uploading a text or an image. Your tasks are as follows:
+    # Text area for user input and learning goals
+    user_input = st.text_area(f"Enter your question or instructions for Page {idx+1}:", key=f"text_area_{idx}")
+    learning_goals = st.text_area(f"Learning Goals for Page {idx+1} (Optional):", key=f"learning_goals_{idx}")
+    selected_types = st.multiselect(f"Select question types for Page {idx+1}:", MESSAGE_TYPES, key=f"selected_types_{idx}")
 
-            Input Analysis:
-            - Carefully analyze the content to understand the key concepts and important information.
-            - For Images: Analyze diagrams, charts, or infographics to derive educational content.
-
-            Question Generation by Bloom Level:
-            Based on the analyzed material (from text or image), generate questions across all six levels of Bloom’s Taxonomy:
-            - Remember: Simple recall-based questions.
-            - Understand: Questions that assess comprehension of the material.
-            - Apply: Questions requiring the use of knowledge in practical situations.
-            """
-        )
-        
-        if image:
-            base64_image = process_image(image)
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user", 
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "low"
-                            }
-                        }
-                    ]
-                }
-            ]
+    # Button to generate questions for the page
+    if st.button(f"Generate Questions for Page {idx+1}", key=f"generate_button_{idx}"):
+        if user_input and selected_types:
+            generate_questions_with_image(user_input, learning_goals, selected_types, image, selected_language, max_concurrency, use_cache, stream, structured, validate)
         else:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ]
-
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_completion_tokens=16000,
-            temperature=0.6
-        )
-        
-        return response.choices[0].message.content
+            st.warning(f"Please enter text and select question types for Page {idx+1}.")
+
+def process_images(images, selected_language, max_concurrency=MAX_CONCURRENT_REQUESTS, use_cache=True, stream=False, structured=False, validate=True):
+    """Process uploaded images and generate questions, for all pages at once or page by page."""
+    mode = st.radio("Mode:", [ALL_PAGES_MODE, SINGLE_PAGE_MODE], key="image_mode", horizontal=True)
+    if mode == SINGLE_PAGE_MODE:
+        for idx, image in enumerate(images):
+            page_question_form(image, idx, selected_language, max_concurrency, use_cache, stream, structured, validate)
+        return
+
+    for idx, (column, image) in enumerate(zip(st.columns(len(images)), images)):
+        column.image(image, caption=f'Page {idx+1}', use_column_width=True)
+    user_input = st.text_area("Enter your question or instructions for all pages:", key="text_area_all_pages")
+    learning_goals = st.text_area("Learning Goals for all pages (Optional):", key="learning_goals_all_pages")
+    selected_types = st.multiselect("Select question types for all pages:", MESSAGE_TYPES, key="selected_types_all_pages")
+
+    if st.button(f"Generate Questions for All {len(images)} Pages", key="generate_button_all_pages"):
+        if user_input and selected_types:
+            generate_questions_for_all_pages(user_input, learning_goals, selected_types, images, selected_language, max_concurrency, use_cache, structured, validate)
+        else:
+            st.warning("Please enter text and select question types for all pages.")
+
+def process_pdf_pages(pdf_pages, selected_language, max_concurrency=MAX_CONCURRENT_REQUESTS, use_cache=True, stream=False, structured=False, validate=True):
+    """Show one PDF page at a time; a page is only rasterised when the user opens it."""
+    page_number = st.selectbox(
+        f"Seite auswählen ({len(pdf_pages.pages)} Seiten):",
+        pdf_pages.pages,
+        key="pdf_page_number"
+    )
+    try:
+        with st.spinner(f"Rendering page {page_number}..."):
+            page_image = pdf_pages.page_path(page_number).read_bytes()
     except Exception as e:
-        st.error(f"Error communicating with OpenAI API: {e}")
-        logging.error(f"Error communicating with OpenAI API: {e}")
-        return None
+        st.error(f"Error converting page {page_number} to an image: {e}")
+        return
+    page_question_form(page_image, page_number - 1, selected_language, max_concurrency, use_cache, stream, structured, validate)
 
-def process_images(images, selected_language):
-    """Process uploaded images and generate questions."""
-    for idx, image in enumerate(images):
-        st.image(image, caption=f'Page {idx+1}', use_column_width=True)
+def generate_questions_with_image(user_input, learning_goals, selected_types, image, selected_language, max_concurrency=MAX_CONCURRENT_REQUESTS, use_cache=True, stream=False, structured=False, validate=True):
+    """Generate questions for the image and handle errors."""
+    # Keep the output order stable regardless of selection or completion order
+    ordered_types = order_message_types(selected_types)
 
-        # Text area for user input and learning goals
-        user_input = st.text_area(f"Enter your question or instructions for Page {idx+1}:", key=f"text_area_{idx}")
-        learning_goals = st.text_area(f"Learning Goals for Page {idx+1} (Optional):", key=f"learning_goals_{idx}")
-        selected_types = st.multiselect(f"Select question types for Page {idx+1}:", MESSAGE_TYPES, key=f"selected_types_{idx}")
+    try:
+        # Encode the image once so all parallel requests share the same payload
+        base64_image = process_image(image) if image else None
+    except Exception as e:
+        st.error(f"Error processing image: {str(e)}")
+        return
+
+    # Long inputs are split into chunks that fit the token budget; chunks run in parallel
+    requests = build_generation_requests(ordered_types, user_input, learning_goals, base64_image, structured=structured)
+    if len(requests) > len(ordered_types):
+        chunk_count = len(requests) // len(ordered_types)
+        st.info(f"Der Text ist lang und wird in {chunk_count} Abschnitten verarbeitet; die Fragen werden danach zusammengeführt.")
+
+    on_delta = None
+    if stream:
+        # One live view per question type, filled while the tokens arrive
+        st.subheader("Live Output:")
+        live_views = {}
+        for msg_type in ordered_types:
+            with st.expander(msg_type.replace('_', ' ').title(), expanded=True):
+                live_views[msg_type] = (st.empty(), st.empty())
+        buffers = {msg_type: {} for msg_type in ordered_types}
+        # inline_fib questions are converted to OLAT blocks as soon as each JSON object is complete
+        fib_parsers = {}
+        live_fib_items = {}
+        first_token_seconds = {}
+        started = time.perf_counter()
+
+        def show_delta(key, text):
+            msg_type, chunk_index = split_chunk_key(key)
+            first_token_seconds.setdefault(msg_type, time.perf_counter() - started)
+            chunks = buffers[msg_type]
+            chunks[chunk_index] = chunks.get(chunk_index, "") + text
+            live_text = "\n\n".join(chunks[index] for index in sorted(chunks))
+            status, output = live_views[msg_type]
+            status.caption(f"⏱ First token after {first_token_seconds[msg_type]:.1f} s · {len(live_text)} characters")
+            if msg_type == "inline_fib" and not structured:
+                parser = fib_parsers.setdefault(key, InlineFibParser())
+                live_fib_items.setdefault(key, []).extend(parser.feed(text))
+                items = [item for item_key in sorted(live_fib_items) for item in live_fib_items[item_key]]
+                if items:
+                    output.code(inline_fib_items_to_olat(items), language="text")
+                    return
+            output.code(live_text, language="text")
+
+        on_delta = show_delta
+
+    with st.spinner(f"Generating {len(ordered_types)} question type(s)..."):
+        chunk_responses, chunk_errors = fetch_responses_concurrently(client, requests, max_concurrency, use_cache, on_delta)
+    if structured:
+        chunk_responses, chunk_errors = render_structured_responses(chunk_responses, chunk_errors)
+    responses, errors = collect_type_responses(chunk_responses, chunk_errors)
+
+    if validate:
+        responses = check_and_repair(responses, user_input, learning_goals, base64_image, use_cache, structured, max_concurrency)
+
+    all_responses, qti_text, fib_items, generated_content = assemble_output(responses, errors, ordered_types)
 
-        # Button to generate questions for the page
-        if st.button(f"Generate Questions for Page {idx+1}", key=f"generate_button_{idx}"):
-            if user_input and selected_types:
-                generate_questions_with_image(user_input, learning_goals, selected_types, image, selected_language)
-            else:
-                st.warning(f"Please enter text and select question types for Page {idx+1}.")
+    # Display generated content with checkmarks
+    st.subheader("Generated Content:")
+    for title in generated_content.keys():
+        st.write(f"✔ {title}")
 
-def generate_questions_with_image(user_input, learning_goals, selected_types, image, selected_language):
-    """Generate questions for the image and handle errors."""
+    show_downloads(all_responses, qti_text, fib_items)
+
+def generate_questions_for_all_pages(user_input, learning_goals, selected_types, images, selected_language, max_concurrency=MAX_CONCURRENT_REQUESTS, use_cache=True, structured=False, validate=True):
+    """Generate the selected question types for every page with shared instructions.
+
+    All (page, type) requests run on one pool bounded by max_concurrency; progress is
+    shown per page and the output of all pages is combined in page order. Responses
+    are not streamed in this mode.
+    """
+    ordered_types = order_message_types(selected_types)
+    try:
+        base64_images = [process_image(image) for image in images]
+    except Exception as e:
+        st.error(f"Error processing image: {str(e)}")
+        return
+
+    requests = build_page_requests(base64_images, ordered_types, user_input, learning_goals, structured=structured)
+    totals = {}
+    for page_index, _ in requests:
+        totals[page_index] = totals.get(page_index, 0) + 1
+    finished = dict.fromkeys(totals, 0)
+    progress_bars = {
+        page_index: st.progress(0.0, text=f"Page {page_index+1}: 0/{total} requests")
+        for page_index, total in totals.items()
+    }
+
+    def show_progress(key):
+        page_index = key[0]
+        finished[page_index] += 1
+        progress_bars[page_index].progress(
+            finished[page_index] / totals[page_index],
+            text=f"Page {page_index+1}: {finished[page_index]}/{totals[page_index]} requests"
+        )
+
+    with st.spinner(f"Generating {len(ordered_types)} question type(s) for {len(images)} pages..."):
+        page_responses, page_errors = fetch_responses_concurrently(client, requests, max_concurrency, use_cache, on_done=show_progress)
+
+    all_responses = ""
+    qti_text = ""
+    fib_items = []
+    st.subheader("Generated Content:")
+    for page_index, (chunk_responses, chunk_errors) in split_page_results(page_responses, page_errors).items():
+        page_label = f"Page {page_index+1}"
+        if structured:
+            chunk_responses, chunk_errors = render_structured_responses(chunk_responses, chunk_errors)
+        responses, errors = collect_type_responses(chunk_responses, chunk_errors)
+        if validate:
+            responses = check_and_repair(responses, user_input, learning_goals, base64_images[page_index], use_cache, structured, max_concurrency, page_label)
+        page_responses_text, page_qti_text, page_fib_items, generated_content = assemble_output(responses, errors, ordered_types, page_label)
+        all_responses += page_responses_text
+        qti_text += page_qti_text
+        fib_items.extend(page_fib_items)
+        for title in generated_content.keys():
+            st.write(f"✔ {page_label}: {title}")
+
+    show_downloads(all_responses, qti_text, fib_items)
+
+def check_and_repair(responses, user_input, learning_goals, base64_image, use_cache, structured, max_concurrency, page_label=""):
+    """Regenerate only the questions that break the import rules and report what is still broken."""
+    prefix = f"{page_label}, " if page_label else ""
+    with st.spinner(f"Checking the generated questions{' of ' + page_label if page_label else ''}..."):
+        responses, unresolved = repair_questions(client, responses, user_input, learning_goals, base64_image, use_cache, structured, max_concurrency)
+    for msg_type, problems in unresolved.items():
+        problem_list = "\n".join(f"- {problem}" for problem in problems)
+        st.warning(f"{prefix}{msg_type}: these questions still break the OLAT import rules:\n\n{problem_list}")
+    return responses
+
+def assemble_output(responses, errors, ordered_types, page_label=""):
+    """Return (all responses, tab-format text for QTI, parsed gap texts, {title: content}) in type order."""
+    prefix = f"{page_label}, " if page_label else ""
     all_responses = ""
+    # Question text of the tab-format types and the parsed gap texts, for the QTI export
+    qti_text = ""
+    fib_items = []
     generated_content = {}
-    for msg_type in selected_types:
-        prompt_template = read_prompt_from_md(msg_type)
-        full_prompt = f"{prompt_template}\n\nUser Input: {user_input}\n\nLearning Goals: {learning_goals}"
-        try:
-            response = get_chatgpt_response(full_prompt, image=image, selected_language=selected_language)
-            if response:
-                if msg_type == "inline_fib":
-                    processed_response = transform_output(response)
-                    generated_content[f"{msg_type.replace('_', ' ').title()} (Processed)"] = processed_response
-                    all_responses += f"{processed_response}\n\n"
-                else:
-                    generated_content[msg_type.replace('_', ' ').title()] = response
-                    all_responses += f"{response}\n\n"
+    for msg_type in ordered_types:
+        if msg_type in errors:
+            st.error(f"An error occurred for {prefix}{msg_type}: {str(errors[msg_type])}")
+            continue
+        response = responses.get(msg_type)
+        if response:
+            if msg_type == "inline_fib":
+                processed_response, type_fib_items = transform_output(response)
+                fib_items.extend(type_fib_items)
+                generated_content[f"{msg_type.replace('_', ' ').title()} (Processed)"] = processed_response
+                all_responses += f"{processed_response}\n\n"
             else:
-                st.error(f"Failed to generate a response for {msg_type}.")
-        except Exception as e:
-            st.error(f"An error occurred for {msg_type}: {str(e)}")
-    
+                generated_content[msg_type.replace('_', ' ').title()] = response
+                all_responses += f"{response}\n\n"
+                qti_text += f"{response}\n\n"
+        else:
+            st.error(f"Failed to generate a response for {prefix}{msg_type}.")
+    return all_responses, qti_text, fib_items, generated_content
+
+def show_downloads(all_responses, qti_text, fib_items):
+    """Offer the OLAT text and the QTI package of all responses for download."""
     # Apply cleaning function to all responses
     all_responses = replace_german_sharp_s(all_responses)
-
-    # Display generated content with checkmarks
-    st.subheader("Generated Content:")
-    for title in generated_content.keys():
-        st.write(f"✔ {title}")
-
-    # Download button for all responses
     if all_responses:
         st.download_button(
             label="Download All Responses",
@@ -335,48 +327,75 @@ def generate_questions_with_image(user_input, learning_goals, selected_types, im
             file_name="all_responses.txt",
             mime="text/plain"
         )
+        qti_package = io.BytesIO()
+        write_qti_package(qti_package, replace_german_sharp_s(qti_text), fib_items)
+        st.download_button(
+            label="Download QTI 2.1 (ZIP)",
+            data=qti_package.getvalue(),
+            file_name="olat_questions_qti.zip",
+            mime="application/zip"
+        )
 
-@st.cache_data
-def convert_pdf_to_images(file):
-    """Convert PDF pages to images."""
-    images = convert_from_bytes(file.read())
-    return images
-
-@st.cache_data
-def extract_text_from_pdf(file):
-    """Extract text from PDF using PyPDF2."""
-    pdf_reader = PyPDF2.PdfReader(file)
-    text = ""
-    for page in pdf_reader.pages:
-        page_text = page.extract_text()
-        if page_text:
-            text += page_text
-    return text.strip()
-
-@st.cache_data
-def extract_text_from_docx(file):
-    """Extract text from DOCX file."""
-    doc = docx.Document(file)
-    text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-    return text.strip()
+def convert_pdf_to_images(document, pages=None):
+    """Prepare on-demand page images for a PDF (pages are rendered to disk when opened)."""
+    return document.renderer(pages)
+
+def extract_text_from_pdf(document, pages=None):
+    """Extract text from the selected PDF pages (each page is extracted once per document)."""
+    return document.text(pages)
+
+def select_pdf_pages(document):
+    """Let the user restrict a PDF to the pages that are actually needed (None = all pages)."""
+    page_count = document.page_count
+    if page_count <= 1:
+        return None
+    selection = st.text_input(
+        f"Seiten auswählen (1-{page_count}, z.B. 1-3, 7; leer = alle Seiten):",
+        key="pdf_page_selection"
+    )
+    try:
+        return tuple(parse_page_selection(selection, page_count))
+    except ValueError as e:
+        st.warning(f"{e}. All pages are used.")
+        return None
 
 def is_pdf_ocr(text):
     """Check if PDF contains OCR text."""
     return bool(text)
 
-def process_pdf(file):
-    text_content = extract_text_from_pdf(file)
+def recognise_pdf_text(document, pages=None):
+    """Run local OCR on scanned pages; returns (text of reliable pages, page numbers left for the vision model)."""
+    with st.spinner("Recognising text on the scanned pages (OCR)..."):
+        results = document.ocr(pages)
+    return split_by_confidence(results)
+
+def process_pdf(file, use_ocr=True):
+    # Cached by content hash: reruns and re-uploads of the same PDF do not parse it again
+    document = get_ingestion_cache().document(file.getvalue(), PDF_MIME_TYPE)
+    pages = select_pdf_pages(document)
+    text_content = extract_text_from_pdf(document, pages)
     
-    if not text_content or not is_pdf_ocr(text_content):
-        st.warning("This PDF is not OCRed. Text extraction failed. Please upload an OCRed PDF.")
-        return None, convert_pdf_to_images(file)
-    else:
+    if text_content and is_pdf_ocr(text_content):
         return text_content, None
+    if use_ocr and ocr_available():
+        text_content, unreliable_pages = recognise_pdf_text(document, pages)
+        if not unreliable_pages:
+            return text_content, None
+        if text_content:
+            st.info(f"Pages {', '.join(map(str, unreliable_pages))} could not be recognised reliably and are processed as images.")
+            return text_content, convert_pdf_to_images(document, unreliable_pages)
+    st.warning("This PDF is not OCRed. Text extraction failed. Please upload an OCRed PDF.")
+    return None, convert_pdf_to_images(document, pages)
 
 def main():
     """Main function for the Streamlit app."""
     st.title("OLAT Fragen Generator")
 
+    # Attribute all model calls of this browser session to one telemetry session
+    if "telemetry_session" not in st.session_state:
+        st.session_state.telemetry_session = uuid.uuid4().hex[:12]
+    set_session(st.session_state.telemetry_session)
+
     # Two-column layout
     col1, col2 = st.columns([1, 2])
 
@@ -431,7 +450,7 @@ def main():
             st.markdown('''
             <div class="custom-warning">
                 <ul>
-                    <li><strong>Überprüfen Sie immer, ob die Gesamtpunktzahl = Summe der Punkte der richtigen Antworten ist.</strong></li>
+                    <li><strong>Punktzahlen und Antwortzeilen werden automatisch geprüft; beachten Sie die angezeigten Hinweise zu Fragen, die nicht repariert werden konnten.</strong></li>
                     <li><strong>Überprüfen Sie immer den Inhalt der Antworten.</strong></li>
                 </ul>
             </div>
@@ -464,6 +483,85 @@ def main():
             index=0
         )
 
+        max_concurrency = st.slider(
+            "Parallele Anfragen (Fragetypen gleichzeitig generieren):",
+            min_value=1,
+            max_value=len(MESSAGE_TYPES),
+            value=MAX_CONCURRENT_REQUESTS
+        )
+
+        bypass_cache = st.checkbox(
+            "Cache umgehen (neu generieren)",
+            help="Gespeicherte Antworten ignorieren und die Fragen neu generieren lassen."
+        )
+        use_cache = not bypass_cache
+
+        stream = st.checkbox(
+            "Live-Ausgabe (Streaming)",
+            value=True,
+            help="Zeigt die Antworten bereits während der Generierung an."
+        )
+
+        structured = st.checkbox(
+            "Strukturierte Ausgabe (JSON-Schema)",
+            help="Das Modell liefert die Fragen als JSON nach dem Schema des Fragetyps; Punkte und OLAT-Format werden lokal erzeugt."
+        )
+
+        validate = st.checkbox(
+            "Ausgabe prüfen und fehlerhafte Fragen neu generieren",
+            value=True,
+            help="Prüft Punktzahlen, Anzahl Antworten und Trennzeichen jeder Frage und lässt nur fehlerhafte Fragen neu generieren."
+        )
+
+        use_ocr = st.checkbox(
+            "Gescannte PDFs lokal erkennen (OCR)",
+            value=ocr_available(),
+            disabled=not ocr_available(),
+            help="Erkennt den Text gescannter Seiten mit Tesseract. Nur unsicher erkannte Seiten werden als Bild an das Modell geschickt."
+        )
+
+        with st.expander("📊 Cache-Statistik"):
+            cache_stats = get_response_cache().stats()
+            st.markdown(
+                f"- Treffer: **{cache_stats['hits']}** / Fehlzugriffe: **{cache_stats['misses']}**\n"
+                f"- Eingesparte Tokens: **{cache_stats['saved_prompt_tokens']}** Input, "
+                f"**{cache_stats['saved_completion_tokens']}** Output\n"
+                f"- Gespeicherte Antworten: **{cache_stats['entries']}** "
+                f"({cache_stats['size_bytes'] / 1024:.0f} KB)"
+            )
+            usage = prompt_cache_stats()
+            if usage["prompt_tokens"]:
+                st.markdown(
+                    f"- Prompt-Cache von OpenAI: **{usage['cached_tokens']}** von **{usage['prompt_tokens']}** "
+                    f"Input-Tokens ({usage['cached_tokens'] / usage['prompt_tokens']:.0%})"
+                )
+
+        with st.expander("⏳ Anfrage-Warteschlange"):
+            scheduler_stats = get_request_scheduler().stats()
+            st.markdown(
+                f"- Wartende Anfragen: **{scheduler_stats['queue_depth']}** / laufend: **{scheduler_stats['in_flight']}**\n"
+                f"- Wartezeit: Ø **{scheduler_stats['average_wait_seconds']:.1f} s**, "
+                f"max. **{scheduler_stats['max_wait_seconds']:.1f} s**\n"
+                f"- Wiederholungen: **{scheduler_stats['retries']}** / Fehler: **{scheduler_stats['failures']}**"
+            )
+
+        with st.expander("📈 Nutzung in dieser Sitzung"):
+            usage_rows = get_metrics_store().summary(st.session_state.telemetry_session)
+            if usage_rows:
+                st.table([
+                    {
+                        "Fragetyp": row["label"] or "-",
+                        "Aufrufe": row["calls"],
+                        "Cache-Treffer": row["cache_hits"],
+                        "Tokens (Input/Output)": f"{row['prompt_tokens']} / {row['completion_tokens']}",
+                        "Ø Dauer (s)": f"{row['avg_latency_seconds'] or 0:.1f}",
+                        "Ø erste Antwort (s)": f"{row['avg_ttft_seconds'] or 0:.1f}",
+                    }
+                    for row in usage_rows
+                ])
+            else:
+                st.write("Noch keine Anfragen in dieser Sitzung.")
+
     with col2:
         # Video iframe filling the entire right column
         st.markdown("### Videoanleitung")
@@ -484,25 +582,23 @@ def main():
     text_content = ""
     image_content = None
     images = []
-
-    if uploaded_files:
-        st.cache_data.clear()
+    pdf_pages = None
 
     if uploaded_files:
         if len(uploaded_files) == 1:
             uploaded_file = uploaded_files[0]
-            if uploaded_file.type == "application/pdf":
-                text_content, images = process_pdf(uploaded_file)
+            if uploaded_file.type == PDF_MIME_TYPE:
+                text_content, pdf_pages = process_pdf(uploaded_file, use_ocr)
                 if text_content:
                     st.success("Text extracted from PDF. You can now edit it below.")
-                elif images:
+                if pdf_pages and not text_content:
                     st.success("PDF converted to images. You can now ask questions about each page.")
-            elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                text_content = extract_text_from_docx(uploaded_file)
+            elif uploaded_file.type == DOCX_MIME_TYPE:
+                text_content = get_ingestion_cache().document(uploaded_file.getvalue(), DOCX_MIME_TYPE).text()
                 st.success("Text extracted successfully. You can now edit it below.")
             elif uploaded_file.type.startswith('image/'):
-                image_content = Image.open(uploaded_file)
-                image_content.load()
+                # Keep the encoded bytes so the image pipeline can decode them in draft mode
+                image_content = uploaded_file.getvalue()
                 st.image(image_content, caption='Uploaded Image', use_column_width=True)
                 st.success("Image uploaded successfully. You can now ask questions about the image.")
             else:
@@ -515,14 +611,15 @@ def main():
                 if len(uploaded_files) > 6:
                     st.warning("You uploaded more than 6 images. Only the first 6 images will be used.")
                 for uploaded_image in uploaded_files[:6]:
-                    image = Image.open(uploaded_image)
-                    image.load()
-                    images.append(image)
+                    images.append(uploaded_image.getvalue())
                 st.success(f"{len(images)} images uploaded successfully. You can now ask questions about each image.")
 
+    if pdf_pages:
+        # Pages without usable text; with OCR only the pages that were not recognised reliably
+        process_pdf_pages(pdf_pages, selected_language, max_concurrency, use_cache, stream, structured, validate)
     if images:
-        process_images(images, selected_language)
-    else:
+        process_images(images, selected_language, max_concurrency, use_cache, stream, structured, validate)
+    elif text_content or not pdf_pages:
         user_input = st.text_area("Enter your text or question about the image:", value=text_content)
         learning_goals = st.text_area("Learning Goals (Optional):")
         selected_types = st.multiselect("Select question types to generate:", MESSAGE_TYPES)
@@ -582,7 +679,7 @@ def main():
 
         if st.button("Generate Questions"):
             if (user_input or image_content) and selected_types:
-                generate_questions_with_image(user_input, learning_goals, selected_types, image_content, selected_language)              
+                generate_questions_with_image(user_input, learning_goals, selected_types, image_content, selected_language, max_concurrency, use_cache, stream, structured, validate)              
             elif not user_input and not image_content:
                 st.warning("Please enter some text, upload a file, or upload an image.")
             elif not selected_types:
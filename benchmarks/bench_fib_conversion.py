@@ -0,0 +1,80 @@
+"""Micro-benchmark of the inline_fib to OLAT conversion on large synthetic batches.
+
+Compares convert_json_to_text_format with the previous implementation, which
+replaced every blank with str.replace (rescanning and copying the text per blank)
+and joined the options string once per gap.
+
+    python benchmarks/bench_fib_conversion.py                 # default scenarios
+    python benchmarks/bench_fib_conversion.py --items 2000 --blanks 8 --words 400
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fixtures import synthetic_items  # noqa: E402
+from olat_generator import convert_json_to_text_format  # noqa: E402
+
+# (questions, blanks per question, words per question text)
+SCENARIOS = [(20000, 3, 60), (2000, 8, 400), (300, 40, 4000)]
+
+
+def legacy_convert(data: List[Dict[str, Any]]):
+    fib_output = []
+    ic_output = []
+    for item in data:
+        text = item.get("text", "")
+        blanks = item.get("blanks", [])
+        wrong_substitutes = item.get("wrong_substitutes", [])
+        fib_lines = ["Type\tFIB", "Title\t-", f"Points\t{len(blanks)}"]
+        for blank in blanks:
+            text = text.replace(blank, "{blank}", 1)
+        parts = text.split("{blank}")
+        for index, part in enumerate(parts):
+            fib_lines.append(f"Text\t{part.strip()}")
+            if index < len(blanks):
+                fib_lines.append(f"1\t{blanks[index]}\t20")
+        fib_output.append("\n".join(fib_lines))
+        ic_lines = ["Type\tInlinechoice", "Title\t-", "Question\t-", f"Points\t{len(blanks)}"]
+        all_options = blanks + wrong_substitutes
+        random.shuffle(all_options)
+        for index, part in enumerate(parts):
+            ic_lines.append(f"Text\t{part.strip()}")
+            if index < len(blanks):
+                ic_lines.append(f"1\t{'|'.join(all_options)}\t{blanks[index]}\t|")
+        ic_output.append("\n".join(ic_lines))
+    return "\n\n".join(fib_output), "\n\n".join(ic_output)
+
+
+def best_of(function: Callable, data: List[Dict[str, Any]], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(data)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the inline_fib to OLAT text conversion.")
+    parser.add_argument("--items", type=int, help="Questions per batch (runs only this scenario)")
+    parser.add_argument("--blanks", type=int, default=8, help="Blanks per question")
+    parser.add_argument("--words", type=int, default=400, help="Words per question text")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    scenarios = [(args.items, args.blanks, args.words)] if args.items else SCENARIOS
+    print(f"{'questions':>9} {'blanks':>6} {'words':>6} {'legacy ms':>10} {'current ms':>10} {'speedup':>8}")
+    for items, blanks, words in scenarios:
+        data = synthetic_items(items, blanks, words)
+        legacy = best_of(legacy_convert, data, args.repeat)
+        current = best_of(convert_json_to_text_format, data, args.repeat)
+        print(f"{items:>9} {blanks:>6} {words:>6} {legacy * 1000:>10.1f} {current * 1000:>10.1f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
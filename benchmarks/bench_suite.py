@@ -0,0 +1,187 @@
+"""Micro-benchmark suite for the local hot paths, on a generated fixture corpus.
+
+Reports the best wall time of several runs and the peak Python memory (tracemalloc,
+one separate run) per case, and compares them with a stored baseline. Runs offline:
+no API key, no network (OLAT_OFFLINE=1) and a temporary cache directory.
+
+    python benchmarks/bench_suite.py                          # all cases
+    python benchmarks/bench_suite.py --quick -k pdf           # small corpus, cases matching "pdf"
+    python benchmarks/bench_suite.py --save-baseline base.json
+    python benchmarks/bench_suite.py --baseline base.json     # exit code 1 on a regression
+
+clean_json_string no longer exists; the inline_fib cases measure its replacement,
+parse_inline_fib. process_image in app.py is a thin wrapper around
+image_pipeline.prepare_image_payload (app.py needs Streamlit), which is measured
+instead. Cold cases clear the in-process caches before every run; warm cases
+measure the cached path the apps take on reruns.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "v2_app"))
+sys.path.insert(0, str(REPO_ROOT))
+# Must be set before the modules read them
+os.environ["OLAT_OFFLINE"] = "1"
+os.environ.setdefault("OLAT_CACHE_DIR", tempfile.mkdtemp(prefix="olat_bench_"))
+
+import image_pipeline  # noqa: E402
+import workflow  # noqa: E402
+from docx_tools import extract_docx_text  # noqa: E402
+from fixtures import (  # noqa: E402
+    docx_file,
+    image_bytes,
+    inline_fib_responses,
+    sharp_s_text,
+    source_text,
+    synthetic_items,
+    text_pdf,
+)
+from ingestion_cache import get_ingestion_cache  # noqa: E402
+from inline_fib_parser import parse_inline_fib  # noqa: E402
+from olat_generator import convert_json_to_text_format, replace_german_sharp_s  # noqa: E402
+from pdf_tools import extract_pdf_text  # noqa: E402
+
+# A case is slower than its baseline only beyond this factor (timings are noisy)
+DEFAULT_TOLERANCE = 1.25
+# Peak memory differences below this are ignored, however large the factor
+MIN_MEMORY_GROWTH = 64 * 1024
+
+
+@dataclass
+class Case:
+    name: str
+    run: Callable[[], Any]
+    # Called before every timed run, e.g. to clear caches for a cold measurement
+    reset: Optional[Callable[[], None]] = None
+
+
+def build_cases(quick: bool) -> List[Case]:
+    scale = 0.1 if quick else 1.0
+
+    def sized(value: int) -> int:
+        return max(1, int(value * scale))
+
+    cases: List[Case] = []
+
+    for items in (10, sized(200), sized(2000)):
+        for damage, response in inline_fib_responses(items).items():
+            cases.append(Case(f"parse_inline_fib[{damage},{items}]", lambda response=response: parse_inline_fib(response)))
+    for items, blanks, words in ((sized(2000), 8, 400), (sized(300), 40, 4000)):
+        data = synthetic_items(items, blanks, words)
+        cases.append(Case(f"convert_json_to_text_format[{items}x{blanks}x{words}]", lambda data=data: convert_json_to_text_format(data)))
+
+    for characters in (10_000, sized(10_000_000)):
+        text = sharp_s_text(characters)
+        cases.append(Case(f"replace_german_sharp_s[{characters}]", lambda text=text: replace_german_sharp_s(text)))
+    for language in ("de", "en"):
+        for characters in (1_000, sized(1_000_000)):
+            text = source_text(characters, language)
+            cases.append(Case(f"detect_language[{language},{characters}]", lambda text=text: workflow.detect_language(text)))
+
+    for width, height, image_format in ((1200, 900, "JPEG"), (sized(4000), sized(3000), "JPEG"), (2400, 1800, "PNG")):
+        data = image_bytes(width, height, image_format)
+        label = f"{image_format.lower()},{width}x{height}"
+        cases.append(Case(f"process_image[{label},cold]", lambda data=data: image_pipeline.prepare_image_payload(data), image_pipeline.clear_payload_cache))
+        cases.append(Case(f"encode_image_for_openai[{label},warm]", lambda data=data: workflow.encode_image_for_openai(data)))
+
+    for pages in (5, sized(200)):
+        pdf = text_pdf(pages)
+        cases.append(Case(f"extract_text_from_pdf_bytes[{pages}p,cold]", lambda pdf=pdf: extract_pdf_text(pdf)))
+        cases.append(Case(f"extract_text_from_pdf_bytes[{pages}p,warm]", lambda pdf=pdf: workflow.extract_text_from_pdf_bytes(pdf)))
+
+    for paragraphs, table_rows, media_bytes in ((50, 10, 0), (sized(20_000), sized(2_000), sized(20_000_000))):
+        document = docx_file(paragraphs, table_rows, media_bytes)
+        cases.append(Case(f"extract_docx_text[{paragraphs}p,{table_rows}rows,{media_bytes // 1_000_000}MB media]", lambda document=document: extract_docx_text(document)))
+
+    for step_key in ("A", "C", "H"):
+        cases.append(Case(f"build_instruction_payload[{step_key},cold]", lambda step_key=step_key: workflow.build_instruction_payload(step_key), workflow.clear_instruction_payloads))
+        cases.append(Case(f"build_instruction_payload[{step_key},warm]", lambda step_key=step_key: workflow.build_instruction_payload(step_key)))
+    return cases
+
+
+def measure(case: Case, repeat: int) -> Dict[str, float]:
+    # One untimed run fills the caches that warm cases are meant to hit
+    case.run()
+    timings = []
+    for _ in range(repeat):
+        if case.reset:
+            case.reset()
+        started = time.perf_counter()
+        case.run()
+        timings.append(time.perf_counter() - started)
+
+    if case.reset:
+        case.reset()
+    tracemalloc.start()
+    try:
+        case.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "peak_bytes": peak}
+
+
+def load_baseline(path: Optional[Path]) -> Dict[str, Dict[str, float]]:
+    if path is None:
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))["results"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the local hot paths on a generated corpus.")
+    parser.add_argument("--quick", action="store_true", help="Use a corpus about ten times smaller")
+    parser.add_argument("-k", "--filter", default="", help="Run only cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (the best one counts)")
+    parser.add_argument("--baseline", type=Path, help="Compare with results saved by --save-baseline")
+    parser.add_argument("--save-baseline", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Slowdown factor that counts as a regression")
+    args = parser.parse_args()
+
+    # Damaged fixtures make the parsers log a warning per run
+    logging.basicConfig(level=logging.ERROR)
+    baseline = load_baseline(args.baseline)
+    get_ingestion_cache().clear()
+    cases = [case for case in build_cases(args.quick) if args.filter in case.name]
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+
+    print(f"{'case':<62} {'ms':>10} {'peak MiB':>9} {'base ms':>10} {'ratio':>7}")
+    for case in cases:
+        result = measure(case, args.repeat)
+        results[case.name] = result
+        line = f"{case.name:<62} {result['seconds'] * 1000:>10.3f} {result['peak_bytes'] / 2**20:>9.2f}"
+        reference = baseline.get(case.name)
+        if reference:
+            ratio = result["seconds"] / reference["seconds"] if reference["seconds"] else 1.0
+            memory_growth = result["peak_bytes"] - reference["peak_bytes"]
+            memory_regressed = memory_growth > MIN_MEMORY_GROWTH and result["peak_bytes"] > reference["peak_bytes"] * args.tolerance
+            flag = ""
+            if ratio > args.tolerance or memory_regressed:
+                flag = "  REGRESSION"
+                regressions.append(case.name)
+            line += f" {reference['seconds'] * 1000:>10.3f} {ratio:>6.2f}x{flag}"
+        print(line, flush=True)
+
+    if args.save_baseline:
+        args.save_baseline.write_text(
+            json.dumps({"python": sys.version.split()[0], "quick": args.quick, "results": results}, indent=2),
+            encoding="utf-8",
+        )
+        print(f"Saved {len(results)} results to {args.save_baseline}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:g}x: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Generated fixture corpus for the benchmarks: PDFs, DOCX files, images, source texts
+and inline_fib model responses with typical damage.
+
+Everything is built in memory from a seed, so the benchmarks need no files, network
+or API key and produce the same inputs on every run.
+"""
+import io
+import json
+import random
+import zipfile
+from typing import Any, Dict, List
+
+from PIL import Image, ImageDraw
+
+WORDS = ("Zelle", "Energie", "Prozess", "Umwelt", "System", "Wasser", "Struktur", "Funktion", "Gesellschaft", "Markt")
+
+GERMAN_TEXT = (
+    "Die Zelle ist die kleinste Einheit des Lebens und der Stoffwechsel versorgt sie mit Energie. "
+    "Grosse Strassen führen durch die Stadt, und die Gesellschaft verändert sich nicht ohne Grund. "
+    "Die Frage nach dem Thema der Lektion ist für das Verständnis der Funktion wichtig. "
+)
+ENGLISH_TEXT = (
+    "The cell is the smallest unit of life and its metabolism supplies the energy it needs. "
+    "Large roads lead through the city, and society does not change without a reason. "
+    "The question about the topic of the lesson matters for understanding the function. "
+)
+
+
+def synthetic_items(count: int, blanks: int, words: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """inline_fib items: texts of `words` words with `blanks` unique blank words and as many wrong substitutes."""
+    rng = random.Random(seed)
+    items = []
+    for index in range(count):
+        tokens = [rng.choice(WORDS) for _ in range(words)]
+        # Unique blank words, spread evenly over the text
+        blank_words = [f"Begriff{index}x{number}" for number in range(blanks)]
+        step = max(1, words // (blanks + 1))
+        for number, word in enumerate(blank_words):
+            tokens[(number + 1) * step] = word
+        items.append({
+            "text": " ".join(tokens),
+            "blanks": blank_words,
+            "wrong_substitutes": [f"Falsch{number}" for number in range(blanks)],
+        })
+    return items
+
+
+def source_text(characters: int, language: str = "de") -> str:
+    base = GERMAN_TEXT if language == "de" else ENGLISH_TEXT
+    return (base * (characters // len(base) + 1))[:characters]
+
+
+def sharp_s_text(characters: int) -> str:
+    base = "Die Strasse ist gross. Der Fuß, das Maß und die Straße heißen gleich. "
+    return (base * (characters // len(base) + 1))[:characters]
+
+
+def _pdf_string(text: str) -> str:
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def text_pdf(pages: int, lines_per_page: int = 45, seed: int = 11) -> bytes:
+    """A PDF with a text layer: pages of Helvetica text lines built from WORDS."""
+    rng = random.Random(seed)
+    page_count = pages
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page
+    objects: List[bytes] = [b"", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(page_count):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 40 800 Td 16 TL " + " ".join(f"{_pdf_string(line)} Tj T*" for line in lines) + " ET"
+        content = f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode("latin-1")
+        page_number = len(objects) + 1
+        kids.append(f"{page_number} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {page_number + 1} 0 R >>".encode("latin-1")
+        )
+        objects.append(content)
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {page_count} >>".encode("latin-1")
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return output.getvalue()
+
+
+_W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+
+def _docx_paragraph(text: str) -> str:
+    return f"<w:p><w:r><w:t xml:space=\"preserve\">{text}</w:t></w:r></w:p>"
+
+
+def docx_file(paragraphs: int, table_rows: int = 0, media_bytes: int = 0, seed: int = 13) -> bytes:
+    """A DOCX with body paragraphs, a header, an optional table and an optional embedded image part."""
+    rng = random.Random(seed)
+    body = [_docx_paragraph(" ".join(rng.choice(WORDS) for _ in range(40))) for _ in range(paragraphs)]
+    if table_rows:
+        rows = "".join(
+            "<w:tr>" + "".join(f"<w:tc>{_docx_paragraph(rng.choice(WORDS))}</w:tc>" for _ in range(4)) + "</w:tr>"
+            for _ in range(table_rows)
+        )
+        body.append(f"<w:tbl>{rows}</w:tbl>")
+    document = f'<?xml version="1.0" encoding="UTF-8"?><w:document {_W}><w:body>{"".join(body)}</w:body></w:document>'
+    header = f'<?xml version="1.0" encoding="UTF-8"?><w:hdr {_W}>{_docx_paragraph("Kopfzeile")}</w:hdr>'
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        "</Types>"
+    )
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", content_types)
+        archive.writestr("word/document.xml", document)
+        archive.writestr("word/header1.xml", header)
+        if media_bytes:
+            # Incompressible, like a real photo
+            archive.writestr("word/media/image1.jpeg", rng.randbytes(media_bytes), zipfile.ZIP_STORED)
+    return output.getvalue()
+
+
+def image_bytes(width: int, height: int, image_format: str = "JPEG", seed: int = 17) -> bytes:
+    """A photo-like image: a gradient with random shapes, so it does not compress to nothing."""
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient))
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        size = rng.randrange(10, max(11, width // 8))
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x, y, x + size, y + size), fill=color)
+    output = io.BytesIO()
+    image.save(output, format=image_format)
+    return output.getvalue()
+
+
+def inline_fib_responses(items: int, seed: int = 19) -> Dict[str, str]:
+    """inline_fib responses of one size in the shapes the model actually returns, keyed by damage type."""
+    data = synthetic_items(items, blanks=4, words=60, seed=seed)
+    clean = json.dumps(data, ensure_ascii=False, indent=2)
+    fenced = f"Hier sind die Fragen:\n```json\n{clean}\n```\nViel Erfolg!"
+    # Raw line breaks inside strings (invalid JSON, accepted with strict=False)
+    raw_newlines = clean.replace(" Energie ", "\nEnergie\n")
+    # Output cut off by the token limit in the middle of the last object
+    truncated = clean[: int(len(clean) * 0.97)]
+    # Objects without the commas and brackets between them
+    loose = "\n".join(json.dumps(item, ensure_ascii=False) for item in data)
+    return {"clean": clean, "fenced": fenced, "raw_newlines": raw_newlines, "truncated": truncated, "loose": loose}
@@ -0,0 +1,77 @@
+"""Token-aware splitting of long source texts into chunks that fit a prompt budget.
+
+Texts are split on section boundaries (headings, page breaks) first, then on
+paragraphs, then on sentences; only a single sentence longer than the budget is cut
+hard. Consecutive pieces are packed greedily into chunks of at most max_tokens.
+"""
+import os
+import re
+from typing import List, Tuple
+
+from token_counter import CHARS_PER_TOKEN, count_tokens
+
+# Tokens of source material (plus instructions) sent in one request before it is split
+DEFAULT_INPUT_TOKEN_BUDGET = int(os.environ.get("OLAT_INPUT_TOKEN_BUDGET", 32000))
+# Chunks never get smaller than this, even if the instructions take up most of the budget
+MIN_CHUNK_TOKENS = 1000
+
+_SECTION_BREAK = re.compile(r"\n(?=#{1,6}\s)|\f|\n\s*\n\s*\n")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+
+def _fit(piece: str, max_tokens: int) -> List[str]:
+    # Halve a piece until the counter accepts it; dense or non-Latin text has fewer characters per token.
+    if len(piece) <= 1 or count_tokens(piece) <= max_tokens:
+        return [piece]
+    middle = len(piece) // 2
+    return _fit(piece[:middle], max_tokens) + _fit(piece[middle:], max_tokens)
+
+
+def _hard_split(text: str, max_tokens: int) -> List[str]:
+    # Cut a single oversized sentence at the average token length, then check every piece with the counter.
+    size = max(1, max_tokens * CHARS_PER_TOKEN)
+    return [part for i in range(0, len(text), size) for part in _fit(text[i:i + size], max_tokens)]
+
+
+def _pieces(text: str, max_tokens: int, splitters: List[re.Pattern], joiner: str = "\n\n") -> List[Tuple[str, str]]:
+    """Split text into (piece, joiner) pairs of at most max_tokens, using the coarsest boundary that works.
+
+    joiner is the separator that goes in front of the piece when pieces are packed together again.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [(text, joiner)]
+    if not splitters:
+        return [(part, joiner if i == 0 else "") for i, part in enumerate(_hard_split(text, max_tokens))]
+    inner_joiner = " " if splitters[0] is _SENTENCE_BREAK else "\n\n"
+    pieces: List[Tuple[str, str]] = []
+    for part in splitters[0].split(text):
+        if part.strip():
+            pieces.extend(_pieces(part.strip(), max_tokens, splitters[1:], inner_joiner if pieces else joiner))
+    return pieces
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """Return text unchanged as one chunk if it fits, otherwise as boundary-aligned chunks."""
+    text = text.strip()
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks: List[str] = []
+    current = ""
+    current_tokens = 0
+    for piece, joiner in _pieces(text, max_tokens, [_SECTION_BREAK, _PARAGRAPH_BREAK, _SENTENCE_BREAK]):
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current = f"{current}{joiner}{piece}" if current else piece
+        current_tokens += piece_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_budget(overhead_tokens: int, budget: int = DEFAULT_INPUT_TOKEN_BUDGET) -> int:
+    """Tokens left for source material once the fixed part of the prompt is accounted for."""
+    return max(MIN_CHUNK_TOKENS, budget - overhead_tokens)
@@ -0,0 +1,136 @@
+"""Streaming text extraction from DOCX files, shared by both apps.
+
+A DOCX file is a zip archive; the text lives in word/document.xml and the header
+parts (word/header1.xml, ...). Only these parts are read, straight from the zip
+with iterparse, so images and other media in the archive are never decompressed.
+Paragraphs and table rows are emitted in document order and every processed
+element is cleared, so memory grows with the largest paragraph or table row rather
+than with the document.
+
+Tables become one line per row with the cells separated by " | ". Text boxes are
+emitted where they are anchored; their legacy VML copy (mc:Fallback) is skipped so
+they are not read twice.
+"""
+import io
+import re
+import zipfile
+from typing import BinaryIO, Iterator, List, Union
+from xml.etree.ElementTree import ParseError, iterparse
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+DOCUMENT_PART = "word/document.xml"
+_HEADER_PART = re.compile(r"word/header(\d*)\.xml")
+CELL_SEPARATOR = " | "
+
+_P = W_NS + "p"
+_T = W_NS + "t"
+_TC = W_NS + "tc"
+_TR = W_NS + "tr"
+_BODY = W_NS + "body"
+_HDR = W_NS + "hdr"
+# Run content that separates words
+_SPACES = {W_NS + "tab", W_NS + "br", W_NS + "cr", W_NS + "noBreakHyphen"}
+
+DocxSource = Union[bytes, BinaryIO]
+
+
+def iter_part_blocks(part: BinaryIO) -> Iterator[str]:
+    """Yield the non-empty paragraphs and table rows of one WordprocessingML part in order."""
+    paragraphs: List[List[str]] = []
+    cells: List[List[str]] = []
+    rows: List[List[str]] = []
+    container = None
+    container_depth = depth = 0
+    fallback_depth = 0
+
+    def emit(text: str) -> Iterator[str]:
+        # Inside a table cell, paragraphs (and nested table rows) belong to the cell
+        if cells:
+            cells[-1].append(text)
+        else:
+            yield text
+
+    for event, element in iterparse(part, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            depth += 1
+            if tag == MC_FALLBACK:
+                fallback_depth += 1
+            elif fallback_depth:
+                continue
+            elif tag == _P:
+                paragraphs.append([])
+            elif tag == _TC:
+                cells.append([])
+            elif tag == _TR:
+                rows.append([])
+            elif tag in (_BODY, _HDR):
+                container, container_depth = element, depth
+            continue
+
+        depth -= 1
+        if tag == MC_FALLBACK:
+            fallback_depth -= 1
+        elif fallback_depth:
+            pass
+        elif tag == _T and paragraphs:
+            paragraphs[-1].append(element.text or "")
+        elif tag in _SPACES and paragraphs:
+            paragraphs[-1].append(" ")
+        elif tag == _P and paragraphs:
+            text = " ".join("".join(paragraphs.pop()).split())
+            if text:
+                yield from emit(text)
+            element.clear()
+        elif tag == _TC and cells:
+            text = " ".join(cells.pop())
+            if rows:
+                rows[-1].append(text)
+        elif tag == _TR and rows:
+            row = rows.pop()
+            if any(row):
+                yield from emit(CELL_SEPARATOR.join(row))
+            element.clear()
+        if container is not None and depth == container_depth:
+            # A top-level block is done; drop it from the tree
+            container.clear()
+
+
+def _open_archive(source: DocxSource) -> zipfile.ZipFile:
+    try:
+        return zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Not a DOCX file: {e}") from e
+
+
+def _header_number(name: str) -> int:
+    match = _HEADER_PART.fullmatch(name)
+    return int(match.group(1) or 0)
+
+
+def iter_docx_blocks(source: DocxSource) -> Iterator[str]:
+    """Yield the header texts (each distinct header once), then the body paragraphs and table rows."""
+    with _open_archive(source) as archive:
+        names = archive.namelist()
+        if DOCUMENT_PART not in names:
+            raise ValueError(f"Not a DOCX file: {DOCUMENT_PART} is missing")
+        headers = sorted((name for name in names if _HEADER_PART.fullmatch(name)), key=_header_number)
+        seen = set()
+        try:
+            for name in headers:
+                with archive.open(name) as part:
+                    # First, even and odd page headers often repeat the same text
+                    text = "\n".join(iter_part_blocks(part))
+                if text and text not in seen:
+                    seen.add(text)
+                    yield text
+            with archive.open(DOCUMENT_PART) as part:
+                yield from iter_part_blocks(part)
+        except ParseError as e:
+            raise ValueError(f"Damaged DOCX file: {e}") from e
+
+
+def extract_docx_text(source: DocxSource) -> str:
+    """Return the text of a DOCX file (bytes or file object), one paragraph or table row per line."""
+    return "\n".join(iter_docx_blocks(source)).strip()
@@ -0,0 +1,102 @@
+"""Single-pass image preparation for model input, shared by both apps.
+
+Every image is decoded (in JPEG draft mode where possible), downscaled and
+JPEG/base64-encoded once; the resulting payload is memoised by content hash so
+repeated requests for the same image reuse it.
+"""
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Union
+
+from PIL import Image
+
+# The model receives images with "low" detail, so larger inputs only cost time.
+MAX_IMAGE_SIDE = 1000
+PAYLOAD_CACHE_SIZE = 32
+
+ImageSource = Union[str, bytes, Path, BinaryIO, Image.Image]
+
+_payloads: "OrderedDict[str, str]" = OrderedDict()
+_payloads_lock = threading.Lock()
+
+
+def _source_bytes(source: ImageSource) -> bytes:
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, str):
+        # Strings are base64-encoded image data, as accepted by process_image.
+        return base64.b64decode(source)
+    if isinstance(source, Path):
+        return source.read_bytes()
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    position = source.tell()
+    data = source.read()
+    source.seek(position)
+    return data
+
+
+def _image_key(image: Image.Image, max_side: int) -> str:
+    digest = hashlib.sha256(image.tobytes())
+    digest.update(f"{image.mode}:{image.size}:{max_side}".encode())
+    return digest.hexdigest()
+
+
+def _encode(image: Image.Image, max_side: int) -> str:
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_side:
+        # thumbnail() reduces by an integer factor first and resamples only the remainder.
+        image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def _memoised(key: str, build) -> str:
+    with _payloads_lock:
+        payload = _payloads.get(key)
+        if payload is not None:
+            _payloads.move_to_end(key)
+            return payload
+
+    payload = build()
+    with _payloads_lock:
+        _payloads[key] = payload
+        _payloads.move_to_end(key)
+        while len(_payloads) > PAYLOAD_CACHE_SIZE:
+            _payloads.popitem(last=False)
+    return payload
+
+
+def clear_payload_cache() -> None:
+    """Forget the memoised payloads (e.g. to measure the uncached path)."""
+    with _payloads_lock:
+        _payloads.clear()
+
+
+def prepare_image_payload(source: ImageSource, max_side: int = MAX_IMAGE_SIDE) -> str:
+    """Return the base64 JPEG payload for an image, downscaled to max_side.
+
+    Encoded sources (bytes, base64 strings, paths, file objects) are keyed by the
+    hash of their bytes and decoded in draft mode, so JPEGs are decoded directly
+    at a reduced scale. Already decoded PIL images are keyed by their pixel data.
+    """
+    if isinstance(source, Image.Image):
+        # Work on a copy: thumbnail() would otherwise resize the caller's image in place.
+        return _memoised(_image_key(source, max_side), lambda: _encode(source.copy(), max_side))
+
+    data = _source_bytes(source)
+    key = hashlib.sha256(data).hexdigest() + f":{max_side}"
+
+    def build() -> str:
+        image = Image.open(io.BytesIO(data))
+        # Let the JPEG decoder scale down by up to 8x while decoding.
+        image.draft("RGB", (max_side, max_side))
+        return _encode(image, max_side)
+
+    return _memoised(key, build)
@@ -0,0 +1,184 @@
+"""Process-wide cache of parsed uploads, shared by both apps.
+
+Uploaded documents are keyed by the SHA-256 of their bytes. An entry keeps what
+was derived from the document: the page count, the text of every PDF page that has
+been extracted so far (or the DOCX text), the local OCR results of scanned pages
+and the page renderer with the references to the rasterised page images on disk.
+Streamlit reruns the script on every interaction and the same file may be uploaded
+again, by the same or another user; both find the entry and never parse the
+document a second time.
+
+The cache is bounded by the bytes it holds (uploaded bytes plus extracted text)
+and evicts the least recently used documents. The parsed PyPDF2 reader of a PDF is
+not counted: its object cache grows with the pages read, to about twice the file
+size for a text PDF read in full, so leave headroom below the host's memory limit. Rendered page images stay on disk
+until prune_rendered_pages removes them.
+
+Configuration: OLAT_INGESTION_CACHE_MAX_BYTES.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+from docx_tools import extract_docx_text
+from ocr_tools import OCR_IMAGE_SIDE, OcrResult, ocr_pdf_pages
+from pdf_tools import PdfPageRenderer, iter_pdf_pages_parallel, prune_rendered_pages
+from response_cache import hash_bytes
+
+PDF_MIME_TYPE = "application/pdf"
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+class IngestedDocument:
+    """One uploaded PDF or DOCX; text and page images are derived on first use and then kept."""
+
+    def __init__(self, digest: str, file_bytes: bytes, mime_type: str):
+        self.digest = digest
+        self.file_bytes = file_bytes
+        self.mime_type = mime_type
+        self.page_texts: Dict[int, str] = {}
+        self.page_ocr: Dict[int, OcrResult] = {}
+        self._docx_text: Optional[str] = None
+        self._renderer: Optional[PdfPageRenderer] = None
+        # Shared with the renderer and its selections, which read the same PdfReader
+        self._lock = threading.RLock()
+        if mime_type == PDF_MIME_TYPE:
+            # Parsed once; text extraction and rendering reuse the reader.
+            self._renderer = PdfPageRenderer(file_bytes, lock=self._lock)
+            self.page_count = self._renderer.page_count
+        else:
+            self.page_count = 1
+
+    @property
+    def is_pdf(self) -> bool:
+        return self._renderer is not None
+
+    @property
+    def size_bytes(self) -> int:
+        text_bytes = sum(len(text) for text in self.page_texts.values()) + len(self._docx_text or "")
+        text_bytes += sum(len(result.text) for result in self.page_ocr.values())
+        return len(self.file_bytes) + text_bytes
+
+    @property
+    def page_paths(self) -> Dict[int, Path]:
+        """Rasterised pages of a PDF so far, by page number."""
+        if not self._renderer:
+            return {}
+        with self._lock:
+            return dict(self._renderer.rendered)
+
+    def text(self, pages: Optional[Sequence[int]] = None) -> str:
+        """Return the text of the selected 1-based PDF pages (None = all) or the DOCX text.
+
+        Only pages that were not extracted before are read from the document; pages
+        without extractable text are skipped, as in pdf_tools.extract_pdf_text.
+        """
+        with self._lock:
+            if not self.is_pdf:
+                if self._docx_text is None:
+                    self._docx_text = extract_docx_text(self.file_bytes)
+                return self._docx_text
+            pages = list(pages) if pages else list(range(1, self.page_count + 1))
+            missing = [page_number for page_number in pages if page_number not in self.page_texts]
+            if missing:
+                self.page_texts.update(
+                    iter_pdf_pages_parallel(self.file_bytes, missing, reader=self._renderer.reader)
+                )
+            return "\n".join(
+                self.page_texts[page_number] for page_number in pages if self.page_texts[page_number].strip()
+            ).strip()
+
+    def ocr(self, pages: Optional[Sequence[int]] = None) -> Dict[int, OcrResult]:
+        """Recognise the selected PDF pages with local OCR (see ocr_tools), each page once per document."""
+        if not self.is_pdf:
+            raise ValueError(f"{self.mime_type} documents have no pages to recognise")
+        with self._lock:
+            pages = list(pages) if pages else list(range(1, self.page_count + 1))
+            missing = [page_number for page_number in pages if page_number not in self.page_ocr]
+            if missing:
+                renderer = self._renderer.select(missing, max_side=OCR_IMAGE_SIDE)
+                self.page_ocr.update(ocr_pdf_pages(renderer, missing))
+            return {page_number: self.page_ocr[page_number] for page_number in pages}
+
+    def renderer(self, pages: Optional[Sequence[int]] = None) -> PdfPageRenderer:
+        """Return the page renderer for the selected pages of a PDF (pages render on demand)."""
+        if not self.is_pdf:
+            raise ValueError(f"{self.mime_type} documents have no pages to render")
+        prune_rendered_pages()
+        return self._renderer.select(pages)
+
+
+class IngestionCache:
+    """In-memory LRU of IngestedDocument by content hash, bounded by size."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._documents: "OrderedDict[str, IngestedDocument]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def document(self, file_bytes: bytes, mime_type: str) -> IngestedDocument:
+        """Return the cached document for these bytes, registering it on first upload."""
+        digest = hash_bytes(file_bytes)
+        with self._lock:
+            document = self._documents.get(digest)
+            if document is not None:
+                self._documents.move_to_end(digest)
+                self.hits += 1
+                # Text extracted since the last lookup counts towards the budget from now on.
+                self._evict(keep=digest)
+                return document
+            self.misses += 1
+
+        document = IngestedDocument(digest, file_bytes, mime_type)
+        with self._lock:
+            # Another session may have registered the same upload meanwhile.
+            document = self._documents.setdefault(digest, document)
+            self._documents.move_to_end(digest)
+            self._evict(keep=digest)
+        return document
+
+    def _evict(self, keep: str) -> None:
+        total = sum(document.size_bytes for document in self._documents.values())
+        evicted = 0
+        # The document in use is kept even if it alone exceeds the budget.
+        while total > self.max_bytes and len(self._documents) > 1:
+            digest, document = next(iter(self._documents.items()))
+            if digest == keep:
+                break
+            del self._documents[digest]
+            total -= document.size_bytes
+            evicted += 1
+        if evicted:
+            logging.info(f"Ingestion cache evicted {evicted} documents")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._documents),
+                "size_bytes": sum(document.size_bytes for document in self._documents.values()),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents.clear()
+
+
+_cache: Optional[IngestionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_ingestion_cache() -> IngestionCache:
+    """Return the process-wide ingestion cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = IngestionCache(int(os.environ.get("OLAT_INGESTION_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
+        return _cache
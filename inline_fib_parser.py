@@ -0,0 +1,182 @@
+"""Incremental, tolerant parser for the JSON array of the inline_fib question type.
+
+The model is asked for a JSON array of {"text", "blanks", "wrong_substitutes"} objects,
+but responses often come wrapped in Markdown code fences, with raw line breaks inside
+strings or cut off after the last complete object. The parser scans the response once,
+ignores everything between top-level objects (fences, brackets, commas, prose) and
+decodes each object as soon as its closing brace arrives, so it can be fed stream
+deltas and yields the questions that are complete so far. An unfinished trailing
+object is dropped.
+
+FibItem holds one parsed question with its text split at the blanks, ready for the
+OLAT and QTI writers.
+"""
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Characters that change the parser state inside an object
+_SPECIAL = re.compile(r'[{}"\\]')
+
+
+class InlineFibParser:
+    def __init__(self):
+        self._parts: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.skipped = 0
+
+    @property
+    def pending(self) -> bool:
+        """True while an object has been opened but not yet closed."""
+        return self._depth > 0
+
+    def _decode(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            # strict=False accepts raw line breaks and tabs inside strings
+            item = json.loads(text, strict=False)
+        except json.JSONDecodeError as e:
+            logging.warning(f"Skipping malformed inline_fib object: {e}")
+            self.skipped += 1
+            return None
+        return item if isinstance(item, dict) else None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume the next piece of the response and return the objects completed by it."""
+        completed: List[Dict[str, Any]] = []
+        pos, end = 0, len(chunk)
+        segment_start: Optional[int] = 0 if self._depth else None
+        while pos < end:
+            if self._depth == 0:
+                start = chunk.find("{", pos)
+                if start < 0:
+                    break
+                self._depth = 1
+                segment_start = start
+                pos = start + 1
+                continue
+            if self._escaped:
+                self._escaped = False
+                pos += 1
+                continue
+            match = _SPECIAL.search(chunk, pos)
+            if match is None:
+                break
+            char = match.group()
+            pos = match.end()
+            if self._in_string:
+                if char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[segment_start:pos])
+                    item = self._decode("".join(self._parts))
+                    self._parts = []
+                    segment_start = None
+                    if item is not None:
+                        completed.append(item)
+        if self._depth and segment_start is not None:
+            self._parts.append(chunk[segment_start:])
+        return completed
+
+    def close(self) -> None:
+        """Finish the response; an unfinished trailing object is discarded."""
+        if self._depth:
+            logging.warning("Dropping truncated inline_fib object at the end of the response")
+            self.skipped += 1
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+
+def iter_inline_fib(chunks: Iterable[str]):
+    """Yield the inline_fib objects of a response given as an iterable of text pieces."""
+    parser = InlineFibParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    parser.close()
+
+
+def parse_inline_fib(response: str) -> List[Dict[str, Any]]:
+    """Return all complete inline_fib objects of a full response."""
+    return list(iter_inline_fib([response]))
+
+
+@dataclass
+class FibItem:
+    """An inline_fib question: segments[i] is the text before blanks[i], segments[-1] the text after the last blank."""
+    segments: List[str]
+    blanks: List[str]
+    wrong_substitutes: List[str] = field(default_factory=list)
+    # Blanks that do not occur in the text; they are left out of segments and blanks
+    unmatched: List[str] = field(default_factory=list)
+
+
+def _find_blank(
+    text: str, blank: str, start: int, claimed: Sequence[Tuple[int, int]] = ()
+) -> Optional[Tuple[int, int]]:
+    # Prefer a whole-word occurrence so "Bern" is not found inside "Bernstein"; skip claimed spans
+    first = None
+    index = text.find(blank, start)
+    check_before = blank[0].isalnum()
+    check_after = blank[-1].isalnum()
+    while index >= 0:
+        end = index + len(blank)
+        if not any(index < claimed_end and claimed_start < end for claimed_start, claimed_end in claimed):
+            if (not check_before or index == 0 or not text[index - 1].isalnum()) and (
+                not check_after or end == len(text) or not text[end].isalnum()
+            ):
+                return index, end
+            if first is None:
+                first = (index, end)
+        index = text.find(blank, index + 1)
+    return first
+
+
+def locate_blanks(item: Dict[str, Any]) -> FibItem:
+    """Split the text of an inline_fib object at its blanks, in text order.
+
+    Blanks are expected in reading order; each is searched after the previous one, so
+    the text is usually scanned once. A blank listed out of order is searched again
+    from the start of the text, outside the spans of the blanks found so far. A blank
+    that is not found is reported in unmatched.
+    """
+    text = str(item.get("text", ""))
+    if "\n" in text or "\t" in text or "\r" in text or "  " in text:
+        # OLAT lines are tab separated, so line breaks inside the question text become spaces
+        text = " ".join(text.split())
+    spans: List[Tuple[int, int, str]] = []
+    unmatched: List[str] = []
+    pos = 0
+    for blank in item.get("blanks", []):
+        blank = str(blank).strip()
+        found = _find_blank(text, blank, pos) if blank else None
+        if found is None and blank:
+            found = _find_blank(text, blank, 0, [(start, end) for start, end, _ in spans])
+        if found is None:
+            unmatched.append(blank)
+            continue
+        start, end = found
+        spans.append((start, end, blank))
+        pos = max(pos, end)
+    segments: List[str] = []
+    blanks: List[str] = []
+    pos = 0
+    for start, end, blank in sorted(spans):
+        segments.append(text[pos:start].strip())
+        blanks.append(blank)
+        pos = end
+    segments.append(text[pos:].strip())
+    wrong_substitutes = [str(option).strip() for option in item.get("wrong_substitutes", [])]
+    return FibItem(segments, blanks, wrong_substitutes, unmatched)
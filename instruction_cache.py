@@ -0,0 +1,177 @@
+"""On-disk cache for instruction files downloaded from the prompts repository.
+
+Downloaded files are kept under CACHE_DIR/instructions together with their ETag and
+Last-Modified headers. Fresh entries are served without a request; stale entries are
+served immediately and revalidated in the background with a conditional request
+(stale-while-revalidate). Files the server does not have are remembered as missing
+for the same period. In offline mode only cached files are served.
+
+Configuration: OLAT_INSTRUCTION_BASE_URL (download location), OLAT_INSTRUCTION_MAX_AGE
+(seconds an entry counts as fresh) and OLAT_OFFLINE=1.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from openai_clients import get_http_client
+from response_cache import CACHE_DIR, hash_text
+
+DEFAULT_BASE_URL = "https://raw.githubusercontent.com/aburossi/prompts/main/olatimport"
+DEFAULT_MAX_AGE_SECONDS = 60 * 60
+FETCH_TIMEOUT_SECONDS = 20.0
+PREFETCH_WORKERS = 8
+
+
+class InstructionCache:
+    def __init__(self, directory: Path, base_url: str, max_age_seconds: float, offline: bool = False):
+        self.directory = Path(directory)
+        self.base_url = base_url.rstrip("/")
+        self.max_age_seconds = max_age_seconds
+        self.offline = offline
+        self._executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="instructions")
+        self._refreshing: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def url(self, filename: str) -> str:
+        return f"{self.base_url}/{filename}"
+
+    def _paths(self, url: str):
+        stem = self.directory / hash_text(url)[:32]
+        return stem.with_suffix(".txt"), stem.with_suffix(".json")
+
+    def _read_meta(self, url: str) -> Optional[Dict]:
+        _, meta_path = self._paths(url)
+        try:
+            return json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, url: str, meta: Dict, content: Optional[str]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        content_path, meta_path = self._paths(url)
+        if content is not None:
+            tmp_path = content_path.with_suffix(".tmp")
+            tmp_path.write_text(content, encoding="utf-8")
+            os.replace(tmp_path, content_path)
+        tmp_path = meta_path.with_suffix(".jsontmp")
+        tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp_path, meta_path)
+
+    def _read_content(self, url: str) -> Optional[str]:
+        content_path, _ = self._paths(url)
+        try:
+            return content_path.read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+    def _revalidate(self, url: str) -> Optional[str]:
+        """Fetch url, conditionally if a cached copy exists; returns the current content or None."""
+        meta = self._read_meta(url) or {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = get_http_client().get(url, headers=headers, timeout=FETCH_TIMEOUT_SECONDS)
+        except Exception as exc:
+            logging.warning(f"Fetching {url} failed: {exc}")
+            # Keep serving whatever is cached; a failed request is not a missing file.
+            return None if meta.get("missing") else self._read_content(url)
+
+        meta["fetched_at"] = time.time()
+        if response.status_code == 304 and not meta.get("missing"):
+            self._write(url, meta, None)
+            return self._read_content(url)
+        if response.status_code == 200 and response.text.strip():
+            content = response.text.strip()
+            meta.update(
+                etag=response.headers.get("etag"),
+                last_modified=response.headers.get("last-modified"),
+                missing=False,
+            )
+            self._write(url, meta, content)
+            return content
+        if response.status_code in (200, 404, 410):
+            # Absent or empty: remember it as missing instead of asking again on every use.
+            meta.update(etag=None, last_modified=None, missing=True)
+            self._write(url, meta, None)
+            return None
+        logging.warning(f"Fetching {url} returned HTTP {response.status_code}")
+        return None if meta.get("missing") else self._read_content(url)
+
+    def _refresh_in_background(self, url: str) -> Future:
+        with self._lock:
+            future = self._refreshing.get(url)
+            if future is not None:
+                return future
+
+            def refresh() -> Optional[str]:
+                try:
+                    return self._revalidate(url)
+                finally:
+                    with self._lock:
+                        self._refreshing.pop(url, None)
+
+            future = self._executor.submit(refresh)
+            self._refreshing[url] = future
+            return future
+
+    def get(self, filename: str) -> Optional[str]:
+        """Return the file's content (None if it does not exist or is unavailable offline)."""
+        url = self.url(filename)
+        meta = self._read_meta(url)
+        if meta is None:
+            # Join a running prefetch of this file instead of downloading it twice.
+            return None if self.offline else self._refresh_in_background(url).result()
+
+        content = None if meta.get("missing") else self._read_content(url)
+        if self.offline:
+            return content
+        if meta.get("missing") is False and content is None:
+            return self._revalidate(url)
+        if time.time() - meta.get("fetched_at", 0) > self.max_age_seconds:
+            self._refresh_in_background(url)
+        return content
+
+    def stamp(self, filename: str) -> Optional[int]:
+        """Modification time of the cached copy (None if absent), to detect updated downloads."""
+        content_path, _ = self._paths(self.url(filename))
+        try:
+            return content_path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def prefetch(self, filenames: Iterable[str]) -> None:
+        """Download or revalidate the given files in parallel, in the background."""
+        if self.offline:
+            return
+        for filename in dict.fromkeys(filenames):
+            url = self.url(filename)
+            meta = self._read_meta(url)
+            if meta is None or time.time() - meta.get("fetched_at", 0) > self.max_age_seconds:
+                self._refresh_in_background(url)
+
+
+_cache: Optional[InstructionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_instruction_cache() -> InstructionCache:
+    """Return the process-wide instruction cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = InstructionCache(
+                CACHE_DIR / "instructions",
+                base_url=os.environ.get("OLAT_INSTRUCTION_BASE_URL", DEFAULT_BASE_URL),
+                max_age_seconds=float(os.environ.get("OLAT_INSTRUCTION_MAX_AGE", DEFAULT_MAX_AGE_SECONDS)),
+                offline=os.environ.get("OLAT_OFFLINE", "").lower() in ("1", "true", "yes"),
+            )
+        return _cache
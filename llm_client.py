@@ -0,0 +1,257 @@
+"""Shared chat completion layer for both OLAT apps (message building, response caching, streaming)."""
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from request_scheduler import get_request_scheduler
+from response_cache import get_response_cache, hash_text, make_cache_key
+from telemetry import CallMetrics, current_session, record_call
+
+# Rough size of a "low" detail image in prompt tokens
+IMAGE_PROMPT_TOKENS = 85
+
+
+def build_messages(
+    system_prompt: str,
+    user_prompt: str,
+    image_b64: Optional[str] = None,
+    image_detail: str = "low",
+    instructions: str = "",
+) -> List[Dict[str, Any]]:
+    """Build the chat messages with all static content first.
+
+    The system prompt and the instructions (question type template or step payload)
+    form a byte-identical prefix for every request of the same kind, so the provider
+    can serve it from its prompt cache; only the user message varies.
+    """
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": system_prompt}]
+    if instructions:
+        messages.append({"role": "system", "content": instructions})
+
+    if not image_b64:
+        messages.append({"role": "user", "content": user_prompt})
+        return messages
+
+    messages.append(
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": user_prompt},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{image_b64}",
+                        "detail": image_detail,
+                    },
+                },
+            ],
+        }
+    )
+    return messages
+
+
+@dataclass(frozen=True)
+class ChatRequest:
+    """One chat completion request, as sent directly or as a line of a Batch API file."""
+
+    model: str
+    system_prompt: str
+    user_prompt: str
+    temperature: float
+    max_completion_tokens: int
+    image_b64: Optional[str] = None
+    instructions: str = ""
+    # JSON-encoded response_format (structured output schema), kept as text so requests stay hashable
+    response_format: str = ""
+    # Question type or workflow step, for telemetry only
+    label: str = field(default="", compare=False)
+
+    def prefix_key(self) -> str:
+        """Identifies the static message prefix, so requests sharing it reach the same prompt cache."""
+        return hash_text(f"{self.model}\0{self.system_prompt}\0{self.instructions}")[:32]
+
+    def body(self) -> Dict[str, Any]:
+        body = {
+            "model": self.model,
+            "messages": build_messages(
+                self.system_prompt, self.user_prompt, self.image_b64, instructions=self.instructions
+            ),
+            "max_completion_tokens": self.max_completion_tokens,
+            "temperature": self.temperature,
+            "prompt_cache_key": self.prefix_key(),
+        }
+        if self.response_format:
+            body["response_format"] = json.loads(self.response_format)
+        return body
+
+    def estimated_tokens(self) -> int:
+        """Upper estimate of the tokens counted against the rate limit (as OpenAI does, incl. max tokens)."""
+        prompt_tokens = (len(self.system_prompt) + len(self.instructions) + len(self.user_prompt)) // 4
+        if self.image_b64:
+            prompt_tokens += IMAGE_PROMPT_TOKENS
+        return prompt_tokens + self.max_completion_tokens
+
+    def cache_key(self) -> str:
+        return make_cache_key(
+            self.model,
+            self.system_prompt,
+            self.user_prompt,
+            hash_text(self.image_b64) if self.image_b64 else None,
+            self.temperature,
+            self.max_completion_tokens,
+            instructions=self.instructions,
+            response_format=self.response_format,
+        )
+
+
+_usage_totals = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+
+def _record_usage(model: str, usage: Any) -> None:
+    if usage is None:
+        return
+    cached = cached_prompt_tokens(usage)
+    with _usage_lock:
+        _usage_totals["requests"] += 1
+        _usage_totals["prompt_tokens"] += usage.prompt_tokens or 0
+        _usage_totals["cached_tokens"] += cached
+        _usage_totals["completion_tokens"] += usage.completion_tokens or 0
+    logging.info(f"{model}: {cached} of {usage.prompt_tokens} prompt tokens served from the provider prompt cache")
+
+
+def prompt_cache_stats() -> Dict[str, int]:
+    """Token totals of all API calls in this process, including provider-cached prompt tokens."""
+    with _usage_lock:
+        return dict(_usage_totals)
+
+
+def _stream_chat_completion(
+    client: OpenAI,
+    on_delta: Callable[[str], None],
+    **request: Any,
+) -> Tuple[str, Any]:
+    """Consume a streamed completion, forwarding each text delta; returns (text, usage)."""
+    stream = client.chat.completions.create(
+        stream=True,
+        stream_options={"include_usage": True},
+        **request,
+    )
+    parts: List[str] = []
+    usage = None
+    for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return "".join(parts), usage
+
+
+def complete_request(
+    client: OpenAI,
+    chat_request: ChatRequest,
+    use_cache: bool = True,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """Run a prepared ChatRequest and return the completion text, served from the response cache when possible.
+
+    With use_cache=False the cache is bypassed for the lookup but the fresh
+    response still replaces the stored one, so "regenerate" refreshes it.
+    If on_delta is given the completion is streamed and every text delta is
+    passed to it as it arrives (a cache hit is delivered as a single delta).
+
+    Every call, including response cache hits and failures, is recorded in telemetry.
+    """
+    started = time.perf_counter()
+    metrics = CallMetrics(
+        model=chat_request.model,
+        label=chat_request.label,
+        session_id=current_session(),
+        streamed=on_delta is not None,
+    )
+    cache = get_response_cache()
+    key = chat_request.cache_key()
+
+    if use_cache:
+        try:
+            cached = cache.get(key)
+        except Exception as exc:
+            logging.warning(f"Response cache lookup failed: {exc}")
+            cached = None
+        if cached is not None:
+            if on_delta is not None:
+                on_delta(cached)
+            metrics.cache_hit = True
+            metrics.latency_seconds = time.perf_counter() - started
+            record_call(metrics)
+            return cached
+
+    request = chat_request.body()
+    streamed = {"any": False, "attempt_started": 0.0}
+
+    def forward_delta(delta: str) -> None:
+        if not streamed["any"]:
+            metrics.ttft_seconds = time.perf_counter() - streamed["attempt_started"]
+        streamed["any"] = True
+        on_delta(delta)
+
+    def call() -> Tuple[str, Any]:
+        streamed["attempt_started"] = time.perf_counter()
+        if on_delta is not None:
+            return _stream_chat_completion(client, forward_delta, **request)
+        response = client.chat.completions.create(**request)
+        return response.choices[0].message.content or "", response.usage
+
+    # Calls are queued by the shared scheduler until the rate limits allow them.
+    report: Dict[str, Any] = {}
+    try:
+        content, usage = get_request_scheduler().run(
+            call,
+            chat_request.estimated_tokens(),
+            used_tokens=lambda result: result[1].total_tokens if result[1] else None,
+            can_retry=lambda: not streamed["any"],
+            report=report,
+        )
+    except Exception as exc:
+        metrics.error = f"{exc.__class__.__name__}: {exc}"[:500]
+        raise
+    finally:
+        metrics.retries = report.get("retries", 0)
+        metrics.queue_seconds = report.get("queue_seconds", 0.0)
+        metrics.latency_seconds = time.perf_counter() - started
+        if metrics.error is not None:
+            record_call(metrics)
+
+    _record_usage(chat_request.model, usage)
+    if usage is not None:
+        metrics.prompt_tokens = usage.prompt_tokens or 0
+        metrics.completion_tokens = usage.completion_tokens or 0
+        metrics.cached_tokens = cached_prompt_tokens(usage)
+    record_call(metrics)
+
+    if content:
+        try:
+            cache.put(
+                key,
+                chat_request.model,
+                content,
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+            )
+        except Exception as exc:
+            logging.warning(f"Response cache store failed: {exc}")
+    return content
@@ -0,0 +1,151 @@
+"""Optional local OCR of scanned PDF pages with Tesseract, shared by both apps.
+
+Scanned PDFs have no text layer. Instead of sending every page image to the vision
+model (which reads little at "low" detail), the pages are rendered at OCR
+resolution and recognised by the tesseract command line tool, one subprocess per
+page, in parallel. Each page gets a confidence score (the mean word confidence
+reported by Tesseract, weighted by word length); pages below the threshold are
+left to the vision model. Results are cached on disk by the hash of the page image.
+
+OCR is used only if the tesseract binary is installed (packages.txt).
+Configuration: OLAT_OCR_LANGUAGES (Tesseract language codes, default "deu+eng"),
+OLAT_OCR_MIN_CONFIDENCE (0-100, default 70) and OLAT_OCR=0 to disable it.
+"""
+import csv
+import json
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pdf_tools import PdfPageRenderer
+from response_cache import CACHE_DIR, hash_bytes
+
+# Tesseract works best at about 300 DPI; pages are rendered up to this many pixels (MAX_RENDER_DPI caps it).
+OCR_IMAGE_SIDE = 3500
+DEFAULT_LANGUAGES = "deu+eng"
+DEFAULT_MIN_CONFIDENCE = 70.0
+OCR_TIMEOUT_SECONDS = 120
+OCR_CACHE_DIR = CACHE_DIR / "ocr"
+
+
+@dataclass(frozen=True)
+class OcrResult:
+    text: str
+    # Mean word confidence 0-100; 0 if nothing was recognised or Tesseract failed
+    confidence: float
+
+
+@lru_cache(maxsize=1)
+def ocr_available() -> bool:
+    if os.environ.get("OLAT_OCR", "1") == "0":
+        return False
+    return shutil.which("tesseract") is not None
+
+
+def ocr_languages() -> str:
+    return os.environ.get("OLAT_OCR_LANGUAGES", DEFAULT_LANGUAGES)
+
+
+def min_confidence() -> float:
+    return float(os.environ.get("OLAT_OCR_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE))
+
+
+def parse_tesseract_tsv(tsv: str) -> OcrResult:
+    """Rebuild the text (one line per recognised line) and the confidence from Tesseract's TSV output."""
+    lines: Dict[Tuple[str, str, str, str], List[str]] = {}
+    weighted = 0.0
+    characters = 0
+    for row in csv.DictReader(tsv.splitlines(), delimiter="\t", quoting=csv.QUOTE_NONE):
+        word = (row.get("text") or "").strip()
+        if row.get("level") != "5" or not word:
+            continue
+        try:
+            confidence = float(row["conf"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if confidence < 0:
+            continue
+        lines.setdefault((row["page_num"], row["block_num"], row["par_num"], row["line_num"]), []).append(word)
+        weighted += confidence * len(word)
+        characters += len(word)
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return OcrResult(text, weighted / characters if characters else 0.0)
+
+
+def _run_tesseract(image_path: Path, languages: str) -> OcrResult:
+    # One thread per process: pages are already recognised in parallel
+    env = dict(os.environ, OMP_THREAD_LIMIT="1")
+    try:
+        completed = subprocess.run(
+            ["tesseract", str(image_path), "stdout", "-l", languages, "tsv"],
+            capture_output=True,
+            text=True,
+            timeout=OCR_TIMEOUT_SECONDS,
+            env=env,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        stderr = getattr(e, "stderr", "") or ""
+        logging.warning(f"Tesseract failed for {image_path.name}: {e} {stderr.strip()}")
+        return OcrResult("", 0.0)
+    return parse_tesseract_tsv(completed.stdout)
+
+
+def ocr_image(image_path: Path, languages: Optional[str] = None) -> OcrResult:
+    """Recognise one page image; results are cached by the hash of the image and the languages."""
+    languages = languages or ocr_languages()
+    key = hash_bytes(image_path.read_bytes() + languages.encode("utf-8"))
+    cache_path = OCR_CACHE_DIR / f"{key}.json"
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        return OcrResult(cached["text"], float(cached["confidence"]))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    result = _run_tesseract(image_path, languages)
+    if result.text:
+        # Failures are not cached, so they are retried after e.g. installing a language pack
+        OCR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"text": result.text, "confidence": result.confidence}), encoding="utf-8")
+        os.replace(tmp_path, cache_path)
+    return result
+
+
+def ocr_pdf_pages(
+    renderer: PdfPageRenderer,
+    pages: Sequence[int],
+    max_workers: Optional[int] = None,
+) -> Dict[int, OcrResult]:
+    """Render the pages at OCR resolution and recognise them in parallel, by page number."""
+    if not pages:
+        return {}
+    # render_pages returns the image of each page at the position of its page number
+    paths = dict(zip(pages, renderer.render_pages(pages)))
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr") as executor:
+        # Each worker thread waits on its own tesseract process
+        futures = {page_number: executor.submit(ocr_image, path) for page_number, path in paths.items()}
+        return {page_number: future.result() for page_number, future in futures.items()}
+
+
+def split_by_confidence(
+    results: Dict[int, OcrResult], threshold: Optional[float] = None
+) -> Tuple[str, List[int]]:
+    """Return the text of the reliably recognised pages and the numbers of the other pages, in page order."""
+    threshold = min_confidence() if threshold is None else threshold
+    texts = []
+    unreliable = []
+    for page_number in sorted(results):
+        result = results[page_number]
+        if result.text.strip() and result.confidence >= threshold:
+            texts.append(result.text)
+        else:
+            unreliable.append(page_number)
+    return "\n".join(texts).strip(), unreliable
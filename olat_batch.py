@@ -0,0 +1,456 @@
+"""Headless batch generation of OLAT import files for a whole folder (or manifest) of documents.
+
+Examples:
+
+    python olat_batch.py course/ --types single_choice kprim inline_fib --output-dir out
+    python olat_batch.py --manifest files.txt --steps A E --workers 4
+
+Each input (PDF, DOCX, image, TXT or MD) produces one OLAT import text file in the
+output directory, plus a summary.json report for the whole run. The API key is taken
+from --api-key, the OPENAI_API_KEY environment variable or .streamlit/secrets.toml.
+With --qti (question types only) each result is also written as a QTI 2.1 zip package.
+
+With --batch-api all requests are sent as one OpenAI Batch API job instead
+(see openai_batch.py). The batch id is stored in batch.json in the output
+directory; if the run is interrupted, rerun the same command with --batch-id to
+collect the results. openai_batch_stub.py serves the batch endpoints locally for
+testing (--base-url http://127.0.0.1:8089/v1).
+"""
+import argparse
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+import tomllib
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from chunking import DEFAULT_INPUT_TOKEN_BUDGET
+from image_pipeline import prepare_image_payload
+from llm_client import ChatRequest, prompt_cache_stats
+from olat_generator import (
+    MAX_CONCURRENT_REQUESTS,
+    MESSAGE_TYPES,
+    build_generation_requests,
+    collect_type_responses,
+    fetch_responses_concurrently,
+    format_response,
+    order_message_types,
+    render_structured_responses,
+    repair_questions,
+    replace_german_sharp_s,
+)
+from olat_validator import normalize_olat_text, validate_olat_text
+from openai_clients import get_openai_client
+from openai_batch import DEFAULT_POLL_SECONDS, collect_batch_results, run_batch, wait_for_batch
+from qti_export import write_qti_package
+from request_scheduler import get_request_scheduler
+from telemetry import get_metrics_store, set_session
+from v2_app import workflow as v2_workflow
+
+REPO_ROOT = Path(__file__).resolve().parent
+
+SUPPORTED_SUFFIXES = {
+    ".pdf": "application/pdf",
+    ".docx": v2_workflow.DOCX_MIME_TYPE,
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+}
+
+
+@dataclass
+class DocumentResult:
+    input: str
+    output_file: Optional[str] = None
+    status: str = "failed"
+    generated: List[str] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
+    warnings: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def collect_inputs(paths: List[str], manifest: Optional[str]) -> List[Path]:
+    """Expand folders (recursively) and manifest entries into a sorted, de-duplicated file list."""
+    candidates: List[Path] = []
+    if manifest:
+        manifest_path = Path(manifest)
+        for line in manifest_path.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                entry = Path(line)
+                candidates.append(entry if entry.is_absolute() else manifest_path.parent / entry)
+    candidates.extend(Path(path) for path in paths)
+
+    files: List[Path] = []
+    for candidate in candidates:
+        if candidate.is_dir():
+            files.extend(
+                sorted(p for p in candidate.rglob("*") if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES)
+            )
+        elif candidate.is_file():
+            files.append(candidate)
+        else:
+            logging.warning(f"Skipping missing input: {candidate}")
+
+    unique: Dict[Path, None] = {}
+    for path in files:
+        unique.setdefault(path.resolve(), None)
+    return list(unique)
+
+
+def load_document(path: Path) -> Tuple[str, Optional[bytes], List[str]]:
+    """Return (text, image_bytes, warnings) using the same extraction as the V2 app."""
+    mime_type = SUPPORTED_SUFFIXES.get(path.suffix.lower())
+    if mime_type is None:
+        return "", None, [f"Unsupported file type: {path.suffix}"]
+    if mime_type.startswith("text/"):
+        return path.read_text(encoding="utf-8", errors="replace").strip(), None, []
+    return v2_workflow.process_file_bytes(path.read_bytes(), mime_type)
+
+
+def document_requests(
+    text: str, image: Optional[bytes], args: argparse.Namespace
+) -> Tuple[Dict[str, ChatRequest], Dict[str, str]]:
+    """Build the model requests for one document: one per workflow step, or per question type and chunk."""
+    requests: Dict[str, ChatRequest] = {}
+    failures: Dict[str, str] = {}
+    if args.steps:
+        language_hint = v2_workflow.LANG_HINT.get(v2_workflow.detect_language(text), "English")
+        for step_key in args.steps:
+            instruction_payload, _, missing = v2_workflow.build_instruction_payload(step_key)
+            if not instruction_payload.strip():
+                failures[step_key] = f"No instructions could be loaded (missing: {', '.join(missing)})"
+                continue
+            requests[step_key] = v2_workflow.build_model_request(
+                instruction_payload, text, language_hint, step_key, image
+            )
+    else:
+        base64_image = prepare_image_payload(image) if image else None
+        requests = build_generation_requests(
+            args.types, text, args.learning_goals, base64_image, args.token_budget, args.structured
+        )
+    return requests, failures
+
+
+def group_responses(
+    args: argparse.Namespace, responses: Dict[str, str], errors: Dict[str, str]
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Merge chunk responses per question type (steps are not chunked)."""
+    if args.steps:
+        return responses, errors
+    if args.structured:
+        responses, errors = render_structured_responses(responses, errors)
+    merged, failed = collect_type_responses(responses, errors)
+    return merged, {msg_type: str(error) for msg_type, error in failed.items()}
+
+
+def assemble_output(
+    args: argparse.Namespace, responses: Dict[str, str], failures: Dict[str, str]
+) -> Tuple[str, List[str], Dict[str, str]]:
+    """Convert the responses of one document into its OLAT import text, in selection order."""
+    keys = args.steps if args.steps else order_message_types(args.types)
+    blocks: List[str] = []
+    generated: List[str] = []
+    failures = dict(failures)
+    for key in keys:
+        response = (responses.get(key) or "").strip()
+        if key in failures:
+            continue
+        if not response:
+            failures[key] = "Empty response"
+            continue
+        try:
+            if args.steps:
+                blocks.append(v2_workflow.normalize_output_for_codebox(response) or response)
+            else:
+                blocks.append(format_response(key, response))
+            generated.append(key)
+        except Exception as exc:
+            failures[key] = f"Could not convert response: {exc}"
+
+    if args.steps:
+        return "\n\n".join(blocks), generated, failures
+    return replace_german_sharp_s("".join(f"{block}\n\n" for block in blocks)), generated, failures
+
+
+def output_name(path: Path, used: Dict[str, int]) -> str:
+    name = path.stem
+    used[name] = used.get(name, 0) + 1
+    if used[name] > 1:
+        name = f"{name}-{used[name]}"
+    return f"{name}.txt"
+
+
+def write_result(
+    result: DocumentResult, output_file: Path, output: str, generated: List[str], qti: bool = False
+) -> None:
+    result.generated = generated
+    if output.strip():
+        output_file.write_text(output, encoding="utf-8")
+        result.output_file = str(output_file)
+        if qti:
+            # Written item by item straight into the zip file
+            write_qti_package(str(output_file.with_suffix(".zip")), output)
+    result.status = "ok" if generated and not result.errors else ("partial" if generated else "failed")
+
+
+def process_document(path: Path, output_file: Path, args: argparse.Namespace, client: OpenAI) -> DocumentResult:
+    started = time.perf_counter()
+    result = DocumentResult(input=str(path))
+    try:
+        text, image, warnings = load_document(path)
+        result.warnings.extend(warnings)
+        if not text and image is None:
+            result.errors["input"] = "No text or image could be extracted"
+            return result
+
+        requests, failures = document_requests(text, image, args)
+        responses, errors = fetch_responses_concurrently(client, requests, args.type_workers, not args.no_cache)
+        responses, errors = group_responses(args, responses, {key: str(error) for key, error in errors.items()})
+        if args.types and not args.no_validate:
+            responses, unresolved = repair_questions(
+                client, responses, text, args.learning_goals, prepare_image_payload(image) if image else None,
+                not args.no_cache, args.structured, args.type_workers, args.token_budget,
+            )
+            result.warnings.extend(problem for problems in unresolved.values() for problem in problems)
+        output, generated, failures = assemble_output(args, responses, {**failures, **errors})
+        result.errors.update(failures)
+        write_result(result, output_file, output, generated, args.qti)
+    except Exception as exc:
+        logging.exception(f"Processing {path} failed")
+        result.errors["document"] = str(exc)
+    finally:
+        result.seconds = round(time.perf_counter() - started, 2)
+    return result
+
+
+def log_batch_status(batch) -> None:
+    counts = batch.request_counts
+    progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+    logging.info(f"Batch {batch.id}: {batch.status}{progress}")
+
+
+def _load_for_batch(path: Path, args: argparse.Namespace) -> Tuple[Dict[str, ChatRequest], Dict[str, str], List[str]]:
+    try:
+        text, image, warnings = load_document(path)
+    except Exception as exc:
+        return {}, {"input": str(exc)}, []
+    if not text and image is None:
+        return {}, {"input": "No text or image could be extracted"}, warnings
+    requests, failures = document_requests(text, image, args)
+    return requests, failures, warnings
+
+
+def process_documents_as_batch(
+    jobs: List[Tuple[Path, Path]], args: argparse.Namespace, client: OpenAI, output_dir: Path
+) -> List[DocumentResult]:
+    """Send the requests of all documents as one Batch API job and write the results per document."""
+    started = time.perf_counter()
+    results = [DocumentResult(input=str(path)) for path, _ in jobs]
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        loaded = list(executor.map(lambda job: _load_for_batch(job[0], args), jobs))
+
+    all_requests: Dict[str, ChatRequest] = {}
+    document_failures: List[Dict[str, str]] = []
+    for result, (path, output_file), (requests, failures, warnings) in zip(results, jobs, loaded):
+        result.warnings.extend(warnings)
+        document_failures.append(failures)
+        for key, chat_request in requests.items():
+            # custom_ids only depend on the inputs, so a rerun with --batch-id maps results back.
+            all_requests[f"{output_file.stem}|{key}"] = chat_request
+
+    def remember_batch(batch) -> None:
+        logging.info(f"Submitted batch {batch.id}; collect it later with --batch-id {batch.id}")
+        (output_dir / "batch.json").write_text(json.dumps({"batch_id": batch.id}), encoding="utf-8")
+
+    if args.batch_id:
+        batch = wait_for_batch(client, args.batch_id, args.poll_seconds, on_status=log_batch_status)
+        responses, errors = collect_batch_results(client, batch, all_requests)
+    else:
+        responses, errors = run_batch(
+            client,
+            all_requests,
+            output_dir,
+            use_cache=not args.no_cache,
+            poll_seconds=args.poll_seconds,
+            on_status=log_batch_status,
+            on_submitted=remember_batch,
+        )
+
+    seconds = round(time.perf_counter() - started, 2)
+    for result, (path, output_file), failures in zip(results, jobs, document_failures):
+        prefix = f"{output_file.stem}|"
+        document_responses = {cid[len(prefix):]: text for cid, text in responses.items() if cid.startswith(prefix)}
+        document_errors = {cid[len(prefix):]: error for cid, error in errors.items() if cid.startswith(prefix)}
+        result.seconds = seconds
+        if "input" in failures:
+            result.errors.update(failures)
+            continue
+        document_responses, document_errors = group_responses(args, document_responses, document_errors)
+        if args.types and not args.no_validate:
+            # Batch results are only checked; regenerating would need another batch round
+            result.warnings.extend(
+                f"{msg_type} question {check.index + 1}: {'; '.join(check.problems)}"
+                for msg_type, response in document_responses.items()
+                if msg_type != "inline_fib"
+                for check in validate_olat_text(normalize_olat_text(response))
+                if not check.valid
+            )
+        output, generated, failures = assemble_output(args, document_responses, {**failures, **document_errors})
+        result.errors.update(failures)
+        write_result(result, output_file, output, generated, args.qti)
+    return results
+
+
+def resolve_api_key(explicit: Optional[str]) -> Optional[str]:
+    if explicit:
+        return explicit
+    if os.environ.get("OPENAI_API_KEY"):
+        return os.environ["OPENAI_API_KEY"]
+    secrets_path = REPO_ROOT / ".streamlit" / "secrets.toml"
+    if secrets_path.exists():
+        with open(secrets_path, "rb") as file:
+            return tomllib.load(file).get("openai", {}).get("api_key")
+    return None
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate OLAT import files for many documents at once.")
+    parser.add_argument("inputs", nargs="*", help="Input files or folders (searched recursively)")
+    parser.add_argument("--manifest", help="Text file with one input path per line")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--types", nargs="+", choices=MESSAGE_TYPES, help="Question types of the main app")
+    mode.add_argument("--steps", nargs="+", choices=list(v2_workflow.STEP_FILES), help="V2 workflow steps")
+    parser.add_argument("--output-dir", default="olat_output", help="Folder for the generated files")
+    parser.add_argument("--learning-goals", default="", help="Learning goals added to every prompt (--types only)")
+    parser.add_argument("--workers", type=int, default=4, help="Documents processed in parallel")
+    parser.add_argument(
+        "--type-workers",
+        type=int,
+        default=MAX_CONCURRENT_REQUESTS,
+        help="Parallel requests per document",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        default=DEFAULT_INPUT_TOKEN_BUDGET,
+        help="Prompt tokens per request; longer sources are split into chunks (--types only)",
+    )
+    parser.add_argument(
+        "--structured",
+        action="store_true",
+        help="Request JSON following the schema of each question type and format it locally (--types only)",
+    )
+    parser.add_argument(
+        "--qti",
+        action="store_true",
+        help="Also write each result as a QTI 2.1 package (<name>.zip, --types only)",
+    )
+    parser.add_argument(
+        "--no-validate",
+        action="store_true",
+        help="Skip checking the OLAT output and regenerating invalid questions (--types only)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache and regenerate")
+    parser.add_argument("--api-key", help="OpenAI API key (defaults to OPENAI_API_KEY or .streamlit/secrets.toml)")
+    parser.add_argument("--base-url", help="Alternative API base URL, e.g. a local stub server")
+    parser.add_argument(
+        "--batch-api",
+        action="store_true",
+        help="Send all requests as one OpenAI Batch API job (cheaper, finishes within 24 h)",
+    )
+    parser.add_argument("--batch-id", help="Collect the results of an already submitted batch (implies --batch-api)")
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=DEFAULT_POLL_SECONDS,
+        help="Seconds between batch status checks",
+    )
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.manifest:
+        parser.error("provide input files/folders or --manifest")
+    if args.steps and (args.structured or args.qti):
+        parser.error("--structured and --qti only apply to --types")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    args = parse_args(argv)
+
+    inputs = collect_inputs(args.inputs, args.manifest)
+    if not inputs:
+        logging.error("No supported input files found.")
+        return 1
+
+    api_key = resolve_api_key(args.api_key)
+    if not api_key:
+        logging.error("No OpenAI API key found (use --api-key or OPENAI_API_KEY).")
+        return 1
+    client = get_openai_client(api_key, args.base_url)
+
+    if args.steps:
+        v2_workflow.prefetch_remote_instructions()
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    used_names: Dict[str, int] = {}
+    jobs = [(path, output_dir / output_name(path, used_names)) for path in inputs]
+
+    # All calls of this run are recorded in telemetry under one session id.
+    session_id = f"batch-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    set_session(session_id)
+    context = contextvars.copy_context()
+
+    started = time.perf_counter()
+    if args.batch_api or args.batch_id:
+        results = process_documents_as_batch(jobs, args, client, output_dir)
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            results = list(
+                executor.map(
+                    lambda job: context.copy().run(process_document, job[0], job[1], args, client),
+                    jobs,
+                )
+            )
+
+    summary = {
+        "mode": "steps" if args.steps else "types",
+        "batch_api": bool(args.batch_api or args.batch_id),
+        "selection": args.steps or order_message_types(args.types),
+        "documents": len(results),
+        "ok": sum(result.status == "ok" for result in results),
+        "partial": sum(result.status == "partial" for result in results),
+        "failed": sum(result.status == "failed" for result in results),
+        "seconds": round(time.perf_counter() - started, 2),
+        "scheduler": get_request_scheduler().stats(),
+        "usage": prompt_cache_stats(),
+        "telemetry_session": session_id,
+        "per_type": get_metrics_store().summary(session_id),
+        "results": [asdict(result) for result in results],
+    }
+    (output_dir / "summary.json").write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    for result in results:
+        print(f"{result.status:8} {result.seconds:7.1f}s  {result.input}")
+        for name, error in result.errors.items():
+            print(f"{'':18}{name}: {error}")
+    print(
+        f"{summary['ok']} ok, {summary['partial']} partial, {summary['failed']} failed "
+        f"in {summary['seconds']:.1f}s - summary written to {output_dir / 'summary.json'}"
+    )
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
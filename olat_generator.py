@@ -0,0 +1,449 @@
+"""Streamlit-free core of the OLAT question generator: prompts, model requests and output formatting.
+
+Shared by the Streamlit app (app.py) and the batch command line interface (olat_batch.py).
+"""
+import contextvars
+import json
+import logging
+import queue
+import random
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from pathlib import Path
+
+from chunking import DEFAULT_INPUT_TOKEN_BUDGET, chunk_budget, split_into_chunks
+from inline_fib_parser import locate_blanks, parse_inline_fib
+from llm_client import ChatRequest, complete_request
+from olat_validator import normalize_olat_text, split_questions, validate_olat_text, validate_question
+from question_schema import STRUCTURED_OUTPUT_NOTE, response_format, structured_response_to_olat
+from token_counter import count_tokens
+
+REPO_ROOT = Path(__file__).resolve().parent
+
+# List of available message types
+MESSAGE_TYPES = [
+    "single_choice",
+    "multiple_choice1",
+    "multiple_choice2",
+    "multiple_choice3",
+    "kprim",
+    "truefalse",
+    "draganddrop",
+    "inline_fib"
+]
+
+# Upper bound for parallel OpenAI requests in one generation run (one request per question type)
+MAX_CONCURRENT_REQUESTS = len(MESSAGE_TYPES)
+
+# How often streamed tokens are flushed into the page while requests are running
+STREAM_REFRESH_SECONDS = 0.2
+
+MODEL_NAME = "gpt-5.2"
+
+# System prompt shared by all question types
+SYSTEM_PROMPT = (
+    """
+    You are an expert educator specializing in generating test questions and answers across all topics, following Bloom’s Taxonomy. Your role is to create high-quality Q&A sets based on the material provided by the user, ensuring each question aligns with a specific level of Bloom’s Taxonomy: Remember, Understand, Apply, Analyze, Evaluate, and Create.
+
+    The user will provide input by either uploading a text or an image. Your tasks are as follows:
+
+    Input Analysis:
+    - Carefully analyze the content to understand the key concepts and important information.
+    - For Images: Analyze diagrams, charts, or infographics to derive educational content.
+
+    Question Generation by Bloom Level:
+    Based on the analyzed material (from text or image), generate questions across all six levels of Bloom’s Taxonomy:
+    - Remember: Simple recall-based questions.
+    - Understand: Questions that assess comprehension of the material.
+    - Apply: Questions requiring the use of knowledge in practical situations.
+    """
+)
+
+@lru_cache(maxsize=None)
+def read_prompt(msg_type):
+    """Read the prompt template of a question type from its markdown file."""
+    with open(REPO_ROOT / f"{msg_type}.md", "r", encoding="utf-8") as file:
+        return file.read()
+
+def build_prompt(user_input, learning_goals=""):
+    """Return the variable part of a request: the user's material and learning goals.
+
+    The question type template (read_prompt) is sent separately as instructions, ahead
+    of this text, so it forms a cacheable prompt prefix.
+    """
+    return f"User Input: {user_input}\n\nLearning Goals: {learning_goals}"
+
+def order_message_types(selected_types):
+    """Return the selected types in MESSAGE_TYPES order so outputs are assembled consistently."""
+    return [msg_type for msg_type in MESSAGE_TYPES if msg_type in selected_types]
+
+def replace_german_sharp_s(text):
+    """Replace all occurrences of 'ß' with 'ss'."""
+    return text.replace('ß', 'ss')
+
+FIB_TITLE = "✏✏Vervollständigen Sie die Lücken mit dem korrekten Begriff.✏✏"
+INLINECHOICE_TITLE = "Wörter einordnen"
+INLINECHOICE_QUESTION = "✏✏Wählen Sie die richtigen Wörter.✏✏"
+
+def build_fib_items(data):
+    """Locate the blanks of all inline_fib objects, logging blanks that do not occur in their text."""
+    fib_items = [locate_blanks(item) for item in data if isinstance(item, dict)]
+    for fib_item in fib_items:
+        if fib_item.unmatched:
+            logging.warning(f"Blanks not found in inline_fib text: {', '.join(fib_item.unmatched)}")
+    return fib_items
+
+def fib_items_to_text_format(fib_items):
+    """Render FibItems as (FIB blocks, Inlinechoice blocks), each built in one buffer and joined once."""
+    fib_lines = []
+    ic_lines = []
+    for fib_item in fib_items:
+        if fib_lines:
+            # An empty entry puts a blank line between two questions
+            fib_lines.append("")
+            ic_lines.append("")
+        points = len(fib_item.blanks)
+        fib_lines.append(f"Type\tFIB\nTitle\t{FIB_TITLE}\nPoints\t{points}")
+        ic_lines.append(f"Type\tInlinechoice\nTitle\t{INLINECHOICE_TITLE}\nQuestion\t{INLINECHOICE_QUESTION}\nPoints\t{points}")
+
+        all_options = fib_item.blanks + fib_item.wrong_substitutes
+        random.shuffle(all_options)
+        options = "|".join(all_options)
+
+        for segment, blank in zip(fib_item.segments, fib_item.blanks):
+            fib_lines.append(f"Text\t{segment}\n1\t{blank}\t20")
+            ic_lines.append(f"Text\t{segment}\n1\t{options}\t{blank}\t|")
+        fib_lines.append(f"Text\t{fib_item.segments[-1]}")
+        ic_lines.append(f"Text\t{fib_item.segments[-1]}")
+    return "\n".join(fib_lines), "\n".join(ic_lines)
+
+def convert_json_to_text_format(json_input):
+    if isinstance(json_input, str):
+        data = json.loads(json_input)
+    else:
+        data = json_input
+    return fib_items_to_text_format(build_fib_items(data))
+
+def fib_items_to_olat(fib_items):
+    """Render FibItems as Inlinechoice and FIB blocks, separated by '---'."""
+    fib_output, ic_output = fib_items_to_text_format(fib_items)
+    return f"{replace_german_sharp_s(ic_output)}\n---\n{replace_german_sharp_s(fib_output)}"
+
+def inline_fib_items_to_olat(items):
+    """Convert parsed inline_fib objects into Inlinechoice and FIB blocks, separated by '---'."""
+    return fib_items_to_olat(build_fib_items(items))
+
+def parse_fib_items(json_string):
+    """Parse an inline_fib response into FibItems (raises ValueError if it has no complete question)."""
+    fib_items = build_fib_items(parse_inline_fib(json_string))
+    if not fib_items:
+        raise ValueError("Response contains no complete inline_fib question")
+    return fib_items
+
+def inline_fib_to_olat(json_string):
+    """Convert an inline_fib JSON response into Inlinechoice and FIB blocks (raises ValueError if it has no complete question)."""
+    return fib_items_to_olat(parse_fib_items(json_string))
+
+def format_response(msg_type, response):
+    """Turn a raw model response into OLAT import text for its question type."""
+    if msg_type == "inline_fib":
+        return inline_fib_to_olat(response)
+    return response
+
+def build_chat_request(prompt, base64_image=None, instructions="", label="", response_format=None):
+    """Return the model request for one question type prompt (also used for Batch API files)."""
+    return ChatRequest(
+        model=MODEL_NAME,
+        system_prompt=SYSTEM_PROMPT,
+        user_prompt=prompt,
+        temperature=0.6,
+        max_completion_tokens=16000,
+        image_b64=base64_image,
+        instructions=instructions,
+        response_format=json.dumps(response_format, sort_keys=True) if response_format else "",
+        label=label
+    )
+
+def question_instructions(msg_type, structured=False):
+    """The type template; in structured mode with a note that the response schema defines the output."""
+    if structured:
+        return f"{read_prompt(msg_type)}\n\n{STRUCTURED_OUTPUT_NOTE}"
+    return read_prompt(msg_type)
+
+def build_question_request(msg_type, user_input, learning_goals="", base64_image=None, structured=False):
+    """Return the model request for one question type: template as instructions, material as prompt.
+
+    With structured=True the answer is constrained to the JSON schema of the type
+    and must be converted with render_structured_responses.
+    """
+    prompt = build_prompt(user_input, learning_goals)
+    return build_chat_request(
+        prompt,
+        base64_image,
+        question_instructions(msg_type, structured),
+        msg_type,
+        response_format(msg_type) if structured else None
+    )
+
+def _drain_stream_deltas(deltas, on_delta):
+    """Forward queued stream deltas to on_delta, merged per key to limit page updates."""
+    merged = {}
+    while True:
+        try:
+            key, delta = deltas.get_nowait()
+        except queue.Empty:
+            break
+        merged[key] = merged.get(key, "") + delta
+    for key, text in merged.items():
+        on_delta(key, text)
+
+def fetch_responses_concurrently(client, requests, max_concurrency=MAX_CONCURRENT_REQUESTS, use_cache=True, on_delta=None, on_done=None):
+    """Run all ChatRequests in parallel and return (responses, errors), both keyed like requests.
+
+    A failing request is recorded in errors and never cancels the others.
+    If on_delta is given, responses are streamed and on_delta(key, text) is called
+    with new text from the calling thread, so it may safely update Streamlit elements.
+    on_done(key) is called from the calling thread as well, once per finished request.
+    """
+    responses = {}
+    errors = {}
+    if not requests:
+        return responses, errors
+
+    deltas = queue.Queue()
+
+    def run(key, chat_request):
+        stream_callback = (lambda delta: deltas.put((key, delta))) if on_delta else None
+        return complete_request(client, chat_request, use_cache=use_cache, on_delta=stream_callback)
+
+    max_workers = max(1, min(max_concurrency, len(requests)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Copy the caller's context so telemetry attributes the calls to its session
+        futures = {
+            executor.submit(contextvars.copy_context().run, run, key, chat_request): key
+            for key, chat_request in requests.items()
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=STREAM_REFRESH_SECONDS, return_when=FIRST_COMPLETED)
+            if on_delta:
+                _drain_stream_deltas(deltas, on_delta)
+            for future in done:
+                key = futures[future]
+                try:
+                    responses[key] = future.result()
+                except Exception as e:
+                    logging.error(f"Error communicating with OpenAI API for {key}: {e}")
+                    errors[key] = e
+                if on_done:
+                    on_done(key)
+    return responses, errors
+
+def chunk_key(msg_type, index):
+    return f"{msg_type}#{index}"
+
+def split_chunk_key(key):
+    """Return (msg_type, chunk_index) of a chunk_key."""
+    msg_type, _, index = key.rpartition("#")
+    return msg_type, int(index)
+
+def source_chunks(msg_type, user_input, learning_goals="", budget=DEFAULT_INPUT_TOKEN_BUDGET, structured=False):
+    """Split user_input so that each chunk fits the token budget next to the fixed part of the prompt.
+
+    The fixed part (system prompt, template, learning goals) is measured first; source
+    text that does not fit next to it is split on section/paragraph boundaries.
+    """
+    overhead = count_tokens(SYSTEM_PROMPT) + count_tokens(question_instructions(msg_type, structured)) + count_tokens(build_prompt("", learning_goals))
+    return split_into_chunks(user_input, chunk_budget(overhead, budget)) if user_input.strip() else [user_input]
+
+def build_question_requests(msg_type, user_input, learning_goals="", base64_image=None, budget=DEFAULT_INPUT_TOKEN_BUDGET, structured=False):
+    """Return one request per chunk of user_input, so that each prompt fits the token budget."""
+    chunks = source_chunks(msg_type, user_input, learning_goals, budget, structured)
+    return [build_question_request(msg_type, chunk, learning_goals, base64_image, structured) for chunk in chunks]
+
+def build_generation_requests(msg_types, user_input, learning_goals="", base64_image=None, budget=DEFAULT_INPUT_TOKEN_BUDGET, structured=False):
+    """Return the requests for all selected types, keyed by chunk_key(msg_type, chunk_index)."""
+    requests = {}
+    for msg_type in order_message_types(msg_types):
+        for index, chat_request in enumerate(build_question_requests(msg_type, user_input, learning_goals, base64_image, budget, structured)):
+            requests[chunk_key(msg_type, index)] = chat_request
+    return requests
+
+def build_page_requests(base64_images, msg_types, user_input, learning_goals="", budget=DEFAULT_INPUT_TOKEN_BUDGET, structured=False):
+    """Return the requests for every (page, type) pair, keyed by (page_index, chunk_key).
+
+    All pages share the instructions, learning goals and question types; only the image differs.
+    """
+    requests = {}
+    for page_index, base64_image in enumerate(base64_images):
+        for key, chat_request in build_generation_requests(msg_types, user_input, learning_goals, base64_image, budget, structured).items():
+            requests[(page_index, key)] = chat_request
+    return requests
+
+def split_page_results(responses, errors):
+    """Split (responses, errors) keyed by (page_index, chunk_key) into {page_index: (responses, errors)}."""
+    pages = {}
+    for source, target in ((responses, 0), (errors, 1)):
+        for (page_index, key), value in source.items():
+            pages.setdefault(page_index, ({}, {}))[target][key] = value
+    return dict(sorted(pages.items()))
+
+def render_structured_responses(responses, errors):
+    """Convert structured chunk responses into OLAT text (inline_fib: its JSON array).
+
+    Returns (responses, errors) keyed like the input; a response that cannot be
+    converted moves to errors.
+    """
+    rendered = {}
+    errors = dict(errors)
+    for key, response in responses.items():
+        msg_type, _ = split_chunk_key(key)
+        try:
+            rendered[key] = structured_response_to_olat(msg_type, response)
+        except ValueError as e:
+            logging.error(f"Could not convert structured response for {key}: {e}")
+            errors[key] = e
+    return rendered, errors
+
+def _question_identity(text):
+    return re.sub(r"\W+", " ", text).strip().lower()
+
+def _merge_inline_fib(responses):
+    items = []
+    seen = set()
+    for response in responses:
+        for item in parse_inline_fib(response):
+            identity = _question_identity(item.get("text", ""))
+            if identity not in seen:
+                seen.add(identity)
+                items.append(item)
+    return json.dumps(items, ensure_ascii=False, indent=2)
+
+def _merge_question_blocks(responses):
+    blocks = []
+    seen = set()
+    for response in responses:
+        text = re.sub(r"^\s*```\w*\s*$", "", response, flags=re.MULTILINE).strip()
+        # Every question of the OLAT import format starts with its "Typ" line
+        for block in re.split(r"\n\s*(?=^(?:Typ|Type)\t)", text, flags=re.MULTILINE):
+            block = block.strip()
+            if not block:
+                continue
+            question = re.search(r"^Question\t(.*)$", block, flags=re.MULTILINE)
+            identity = _question_identity(question.group(1) if question else block)
+            if identity not in seen:
+                seen.add(identity)
+                blocks.append(block)
+    return "\n\n".join(blocks)
+
+def merge_chunk_responses(msg_type, responses):
+    """Merge the responses for the chunks of one type into one response, dropping duplicate questions."""
+    responses = [response for response in responses if response and response.strip()]
+    if len(responses) <= 1:
+        return responses[0] if responses else ""
+    if msg_type == "inline_fib":
+        return _merge_inline_fib(responses)
+    return _merge_question_blocks(responses)
+
+def collect_type_responses(responses, errors):
+    """Group chunk responses/errors by question type: returns ({msg_type: response}, {msg_type: error}).
+
+    A type fails only if none of its chunks produced a response.
+    """
+    chunk_responses = {}
+    chunk_errors = {}
+    for key in sorted(set(responses) | set(errors), key=split_chunk_key):
+        msg_type, _ = split_chunk_key(key)
+        if key in errors:
+            chunk_errors.setdefault(msg_type, []).append(errors[key])
+        else:
+            chunk_responses.setdefault(msg_type, []).append(responses[key])
+
+    merged = {}
+    failed = {}
+    for msg_type in order_message_types(set(chunk_responses) | set(chunk_errors)):
+        if msg_type in chunk_responses:
+            merged[msg_type] = merge_chunk_responses(msg_type, chunk_responses[msg_type])
+            if msg_type in chunk_errors:
+                logging.warning(f"{len(chunk_errors[msg_type])} chunk(s) of {msg_type} failed: {chunk_errors[msg_type][0]}")
+        else:
+            failed[msg_type] = chunk_errors[msg_type][0]
+    return merged, failed
+
+def _closest_chunk(chunks, question):
+    # The chunk sharing the most words with the broken question is most likely its source
+    words = set(re.findall(r"\w{4,}", question.lower()))
+    return max(chunks, key=lambda chunk: len(words & set(re.findall(r"\w{4,}", chunk.lower()))))
+
+def build_repair_request(msg_type, user_input, question, problems, learning_goals="", base64_image=None, budget=DEFAULT_INPUT_TOKEN_BUDGET, structured=False):
+    """Return a request for one replacement of a question that failed validation."""
+    source = _closest_chunk(source_chunks(msg_type, user_input, learning_goals, budget, structured), question)
+    problem_list = "\n".join(f"- {problem}" for problem in problems)
+    prompt = (
+        f"{build_prompt(source, learning_goals)}\n\n"
+        f"This generated question does not follow the import rules:\n{question}\n\n"
+        f"Problems:\n{problem_list}\n\n"
+        "Generate exactly ONE corrected replacement question on the same content. "
+        "Output only this question."
+    )
+    return build_chat_request(
+        prompt,
+        base64_image,
+        question_instructions(msg_type, structured),
+        f"{msg_type}_repair",
+        response_format(msg_type) if structured else None
+    )
+
+def repair_questions(client, responses, user_input, learning_goals="", base64_image=None, use_cache=True, structured=False, max_concurrency=MAX_CONCURRENT_REQUESTS, budget=DEFAULT_INPUT_TOKEN_BUDGET):
+    """Validate the OLAT text of each type and regenerate only the questions that fail.
+
+    responses maps msg_type to the merged response. Returns (responses, unresolved):
+    the normalised responses with repaired questions swapped in, and per type the
+    problems of questions that are still invalid after one repair attempt.
+    inline_fib is skipped; its OLAT text is generated locally.
+    """
+    repaired = dict(responses)
+    blocks = {}
+    requests = {}
+    unresolved = {}
+    for msg_type, response in responses.items():
+        if msg_type == "inline_fib" or not response:
+            continue
+        text = normalize_olat_text(response)
+        blocks[msg_type] = split_questions(text)
+        for check in validate_olat_text(text):
+            if check.valid:
+                continue
+            if not check.typ:
+                # Not a question block (no Typ line), so there is nothing to regenerate
+                unresolved.setdefault(msg_type, []).append(f"Text without a question type: {'; '.join(check.problems)}")
+                continue
+            requests[(msg_type, check.index)] = build_repair_request(
+                msg_type, user_input, check.text, check.problems, learning_goals, base64_image, budget, structured
+            )
+        # Re-joined from the blocks, so text before the first question is left out
+        repaired[msg_type] = "\n\n".join(blocks[msg_type])
+
+    replies, errors = fetch_responses_concurrently(client, requests, max_concurrency, use_cache) if requests else ({}, {})
+
+    for msg_type, index in requests:
+        original = validate_question(blocks[msg_type][index], index)
+        reply = replies.get((msg_type, index))
+        replacement = None
+        if reply:
+            try:
+                reply_text = structured_response_to_olat(msg_type, reply) if structured else reply
+                candidates = split_questions(normalize_olat_text(reply_text))
+                replacement = validate_question(candidates[0], index) if candidates else None
+            except ValueError as e:
+                logging.warning(f"Repair of {msg_type} question {index + 1} could not be converted: {e}")
+        if replacement is not None and replacement.valid:
+            logging.info(f"Regenerated invalid {msg_type} question {index + 1}")
+            blocks[msg_type][index] = replacement.text
+        else:
+            reason = errors.get((msg_type, index)) or "; ".join(replacement.problems if replacement else original.problems)
+            unresolved.setdefault(msg_type, []).append(f"Question {index + 1}: {'; '.join(original.problems)} (repair failed: {reason})")
+    for msg_type in {msg_type for msg_type, _ in requests}:
+        repaired[msg_type] = "\n\n".join(blocks[msg_type])
+    return repaired, unresolved
@@ -0,0 +1,266 @@
+"""Checks for generated OLAT import text.
+
+The model writes most question types directly in the tab-separated OLAT format.
+normalize_olat_text repairs what can be fixed locally (spaces or colons instead of
+tabs after a keyword, trailing tabs, space-separated true/false rows); validate_olat_text
+then checks every question block for its type's rules: required lines, answer counts,
+and that Points equals the sum of the points of the correct answers. Questions that
+fail can be regenerated one by one (see olat_generator.repair_questions).
+"""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+KEYWORDS = (
+    "Typ",
+    "Type",
+    "Level",
+    "Title",
+    "Question",
+    "Points",
+    "Max answers",
+    "Min answers",
+    "Feedback correct answer",
+    "Feedback wrong answer",
+)
+
+_KEYWORD = "|".join(re.escape(keyword) for keyword in KEYWORDS)
+# A keyword followed by a colon, several spaces or a tab with stray spaces instead of exactly one tab.
+# A single space is not enough: statements such as "Typ 2 Diabetes ..." start with a keyword too.
+_KEYWORD_LINE = re.compile(rf"^({_KEYWORD})(?:\s*:\s*|\t\s+| {{2,}})(.*)$")
+_KEYWORD_FIELD = re.compile(rf"^(?:{_KEYWORD})\t")
+_BLOCK_START = ("Typ", "Type")
+_NUMBER = r"-?\d+(?:[.,]\d+)?"
+_SPACED_ANSWER = re.compile(rf"^({_NUMBER}|[+-]) {{2,}}(\S.*)$")
+_SPACED_TRUEFALSE_ROW = re.compile(rf"^(\S.*?)\s{{2,}}(0)\s+({_NUMBER})\s+({_NUMBER})$")
+_QUESTION_START = re.compile(r"^(?:Typ|Type)\t", re.MULTILINE)
+_FENCE = re.compile(r"^\s*```\w*\s*$", re.MULTILINE)
+_TOLERANCE = 1e-6
+
+
+@dataclass
+class QuestionCheck:
+    """Result for one question block; valid if problems is empty."""
+    index: int
+    text: str
+    typ: str = ""
+    problems: List[str] = field(default_factory=list)
+
+    @property
+    def valid(self) -> bool:
+        return not self.problems
+
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value.strip().replace(",", "."))
+    except ValueError:
+        return None
+
+
+def normalize_olat_text(text: str) -> str:
+    """Fix separators that can be repaired without asking the model again.
+
+    Keyword lines are only rewritten in the header of a question (from its Typ/Type
+    line to the first answer or statement line), so answers are never taken for fields.
+    """
+    lines = []
+    in_header = True
+    for line in _FENCE.sub("", text).splitlines():
+        line = line.rstrip()
+        match = _KEYWORD_LINE.match(line)
+        if _QUESTION_START.match(line) or (match and match.group(1) in _BLOCK_START):
+            in_header = True
+        if match and in_header and "\t" not in line[: len(match.group(1)) + 1]:
+            line = f"{match.group(1)}\t{match.group(2)}"
+        elif match and in_header and line.startswith(match.group(1) + "\t"):
+            line = f"{match.group(1)}\t{match.group(2).strip()}"
+        elif line.split() == ["Unanswered", "Right", "Wrong"]:
+            line = "\tUnanswered\tRight\tWrong"
+        elif "\t" not in line:
+            spaced = _SPACED_ANSWER.match(line) or _SPACED_TRUEFALSE_ROW.match(line)
+            if spaced:
+                line = "\t".join(spaced.groups())
+        if line.strip() and not _KEYWORD_FIELD.match(line):
+            in_header = False
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def split_questions(text: str) -> List[str]:
+    """Split OLAT text into question blocks, each starting with its Typ/Type line.
+
+    Text before the first question (e.g. a preamble of the model) is not a question
+    and is dropped. Text without any Typ/Type line is returned as a single block.
+    """
+    starts = [match.start() for match in _QUESTION_START.finditer(text)]
+    if not starts:
+        return [text.strip()] if text.strip() else []
+    if text[: starts[0]].strip():
+        logging.info(f"Dropping text before the first question: {text[: starts[0]].strip()[:80]!r}")
+    return [text[start:end].strip() for start, end in zip(starts, starts[1:] + [len(text)])]
+
+
+def _parse_block(block: str) -> Tuple[Dict[str, str], List[List[str]]]:
+    fields: Dict[str, str] = {}
+    rows: List[List[str]] = []
+    for line in block.splitlines():
+        if not line.strip():
+            continue
+        keyword, _, value = line.partition("\t")
+        if keyword in KEYWORDS and keyword not in fields:
+            fields[keyword] = value.strip()
+        else:
+            rows.append(line.split("\t"))
+    return fields, rows
+
+
+def _check_points(fields: Dict[str, str], expected: float, problems: List[str]) -> None:
+    points = _number(fields.get("Points", ""))
+    if points is None:
+        problems.append("Points line is missing or not a number")
+    elif abs(points - expected) > _TOLERANCE:
+        problems.append(f"Points is {fields['Points']} but the correct answers sum to {expected:g}")
+
+
+def _scored_answers(rows: List[List[str]], problems: List[str]) -> List[Tuple[float, str]]:
+    answers = []
+    for row in rows:
+        score = _number(row[0]) if len(row) == 2 else None
+        if score is None or not row[1].strip():
+            problems.append(f"Answer line is not '<points><TAB><answer>': {' | '.join(row)}")
+            continue
+        answers.append((score, row[1].strip()))
+    return answers
+
+
+def _check_single_choice(fields, rows, problems) -> None:
+    answers = _scored_answers(rows, problems)
+    correct = [score for score, _ in answers if score > 0]
+    if len(answers) < 2:
+        problems.append(f"expected at least 2 answers, found {len(answers)}")
+    if len(correct) != 1:
+        problems.append(f"expected exactly 1 correct answer, found {len(correct)}")
+    _check_points(fields, sum(correct), problems)
+
+
+def _check_multiple_choice(fields, rows, problems) -> None:
+    answers = _scored_answers(rows, problems)
+    correct = [score for score, _ in answers if score > 0]
+    if len(answers) < 2:
+        problems.append(f"expected at least 2 answers, found {len(answers)}")
+    if not correct:
+        problems.append("no correct answer")
+    max_answers = _number(fields.get("Max answers", ""))
+    if max_answers is None or _number(fields.get("Min answers", "")) is None:
+        problems.append("Max answers / Min answers lines are missing")
+    elif int(max_answers) != len(answers):
+        problems.append(f"Max answers is {fields['Max answers']} but there are {len(answers)} answers")
+    _check_points(fields, sum(correct), problems)
+
+
+def _check_kprim(fields, rows, problems) -> None:
+    statements = [row for row in rows if len(row) == 2 and row[0] in ("+", "-") and row[1].strip()]
+    if len(statements) != len(rows):
+        problems.append("statement lines must be '+<TAB>text' or '-<TAB>text'")
+    if len(statements) != 4:
+        problems.append(f"expected 4 statements, found {len(statements)}")
+    if _number(fields.get("Points", "")) is None:
+        problems.append("Points line is missing or not a number")
+
+
+def _check_truefalse(fields, rows, problems) -> None:
+    if not rows or [cell.strip() for cell in rows[0]] != ["", "Unanswered", "Right", "Wrong"]:
+        problems.append("header line '<TAB>Unanswered<TAB>Right<TAB>Wrong' is missing")
+    else:
+        rows = rows[1:]
+    total = 0.0
+    for row in rows:
+        scores = [_number(cell) for cell in row[1:]]
+        if len(row) != 4 or None in scores or not row[0].strip():
+            problems.append(f"statement line is not '<text><TAB>0<TAB><right><TAB><wrong>': {' | '.join(row)}")
+            continue
+        positive = [score for score in scores[1:] if score > 0]
+        if len(positive) != 1:
+            problems.append(f"statement must be either right or wrong: {row[0].strip()}")
+        total += sum(positive)
+    if not rows:
+        problems.append("no statements")
+    _check_points(fields, total, problems)
+
+
+def _check_dragdrop(fields, rows, problems) -> None:
+    if not rows or rows[0][0].strip():
+        problems.append("header line with the categories (starting with a TAB) is missing")
+        return
+    categories = [cell for cell in rows[0][1:] if cell.strip()]
+    if len(categories) < 2:
+        problems.append(f"expected at least 2 categories, found {len(categories)}")
+    total = 0.0
+    for row in rows[1:]:
+        scores = [_number(cell) for cell in row[1:1 + len(categories)]]
+        if len(scores) != len(categories) or None in scores or not row[0].strip():
+            problems.append(f"item line needs one score per category: {' | '.join(row)}")
+            continue
+        positive = [score for score in scores if score > 0]
+        if len(positive) != 1:
+            problems.append(f"item must belong to exactly one category: {row[0].strip()}")
+        total += sum(positive)
+    if len(rows) < 2:
+        problems.append("no items")
+    _check_points(fields, total, problems)
+
+
+def _check_gaps(fields, rows, problems, inline_choice: bool) -> None:
+    gaps = [row for row in rows if row[0] != "Text"]
+    for row in gaps:
+        if inline_choice:
+            if len(row) != 4 or row[2] not in row[1].split("|"):
+                problems.append(f"choice gap is not '1<TAB>options<TAB>correct<TAB>|' with the correct option listed: {' | '.join(row)}")
+        elif len(row) != 3 or not row[1].strip():
+            problems.append(f"gap is not '1<TAB>answer<TAB>size': {' | '.join(row)}")
+    if not gaps:
+        problems.append("no gaps")
+    _check_points(fields, float(len(gaps)), problems)
+
+
+_CHECKS = {
+    "SC": _check_single_choice,
+    "MC": _check_multiple_choice,
+    "KPRIM": _check_kprim,
+    "Truefalse": _check_truefalse,
+    "Drag&drop": _check_dragdrop,
+    "FIB": lambda fields, rows, problems: _check_gaps(fields, rows, problems, inline_choice=False),
+    "Inlinechoice": lambda fields, rows, problems: _check_gaps(fields, rows, problems, inline_choice=True),
+}
+# The question text is part of the Text lines for FIB
+_NEEDS_QUESTION = {"SC", "MC", "KPRIM", "Truefalse", "Drag&drop", "Inlinechoice"}
+
+
+def parse_question_block(block: str) -> Tuple[Optional[str], Dict[str, str], List[List[str]]]:
+    """Return (canonical type or None, keyword fields, other lines split at tabs) of a question block."""
+    fields, rows = _parse_block(block)
+    typ = fields.get("Typ") or fields.get("Type") or ""
+    # Type names are matched case-insensitively ("Drag&Drop" in the template, "Drag&drop" in examples)
+    return next((name for name in _CHECKS if name.lower() == typ.lower()), None), fields, rows
+
+
+def validate_question(block: str, index: int = 0) -> QuestionCheck:
+    canonical, fields, rows = parse_question_block(block)
+    typ = fields.get("Typ") or fields.get("Type") or ""
+    check = QuestionCheck(index, block, typ)
+    if canonical is None:
+        check.problems.append(f"unknown or missing question type: {typ or block.splitlines()[0][:60]}")
+        return check
+    if not fields.get("Title"):
+        check.problems.append("Title line is missing")
+    if canonical in _NEEDS_QUESTION and not fields.get("Question"):
+        check.problems.append("Question line is missing")
+    _CHECKS[canonical](fields, rows, check.problems)
+    return check
+
+
+def validate_olat_text(text: str) -> List[QuestionCheck]:
+    """Validate every question block of (normalised) OLAT text."""
+    return [validate_question(block, index) for index, block in enumerate(split_questions(text))]
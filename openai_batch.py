@@ -0,0 +1,185 @@
+"""Offline generation through the OpenAI Batch API.
+
+Pending chat requests are written to a JSONL batch file, uploaded and submitted as
+one batch, polled until the batch has finished and mapped back by custom_id.
+Batch requests are billed at a discount and do not count against the per-minute
+rate limits, at the price of a completion window of up to 24 hours.
+"""
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from openai import OpenAI
+
+from llm_client import ChatRequest
+from response_cache import get_response_cache
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+DEFAULT_POLL_SECONDS = 30.0
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def batch_line(custom_id: str, chat_request: ChatRequest) -> Dict[str, Any]:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": chat_request.body(),
+    }
+
+
+def write_batch_file(requests: Dict[str, ChatRequest], path: Path) -> Path:
+    """Write one JSONL line per request, keyed by its custom_id."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        for custom_id, chat_request in requests.items():
+            file.write(json.dumps(batch_line(custom_id, chat_request), ensure_ascii=False) + "\n")
+    return path
+
+
+def submit_batch(client: OpenAI, batch_file: Path, metadata: Optional[Dict[str, str]] = None):
+    """Upload the batch file and create the batch; returns the Batch object."""
+    with open(batch_file, "rb") as file:
+        uploaded = client.files.create(file=file, purpose="batch")
+    return client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata=metadata,
+    )
+
+
+def wait_for_batch(
+    client: OpenAI,
+    batch_id: str,
+    poll_seconds: float = DEFAULT_POLL_SECONDS,
+    timeout_seconds: Optional[float] = None,
+    on_status: Optional[Callable[[Any], None]] = None,
+):
+    """Poll the batch until it reaches a terminal status and return it.
+
+    Raises TimeoutError if timeout_seconds elapse first; the batch keeps running
+    on the server and can be collected later with the same batch id.
+    """
+    started = time.monotonic()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if on_status is not None:
+            on_status(batch)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if timeout_seconds is not None and time.monotonic() - started >= timeout_seconds:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout_seconds:.0f} s")
+        time.sleep(poll_seconds)
+
+
+def parse_batch_output(text: str) -> Tuple[Dict[str, Tuple[str, Any]], Dict[str, str]]:
+    """Parse an output or error file into ({custom_id: (content, usage)}, {custom_id: error})."""
+    results: Dict[str, Tuple[str, Any]] = {}
+    errors: Dict[str, str] = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        custom_id = record.get("custom_id")
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if record.get("error"):
+            errors[custom_id] = str(record["error"].get("message", record["error"]))
+        elif response.get("status_code") != 200:
+            errors[custom_id] = str((body.get("error") or {}).get("message", f"HTTP {response.get('status_code')}"))
+        else:
+            try:
+                content = body["choices"][0]["message"]["content"] or ""
+            except (KeyError, IndexError, TypeError):
+                errors[custom_id] = "Malformed batch response"
+                continue
+            results[custom_id] = (content, body.get("usage") or {})
+    return results, errors
+
+
+def collect_batch_results(
+    client: OpenAI,
+    batch,
+    requests: Optional[Dict[str, ChatRequest]] = None,
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Download the results of a finished batch as ({custom_id: content}, {custom_id: error}).
+
+    If the original requests are given, successful responses are also stored in
+    the response cache, so later interactive runs with the same input reuse them.
+    """
+    results: Dict[str, Tuple[str, Any]] = {}
+    errors: Dict[str, str] = {}
+    if batch.output_file_id:
+        results, errors = parse_batch_output(client.files.content(batch.output_file_id).text)
+    if batch.error_file_id:
+        _, failed = parse_batch_output(client.files.content(batch.error_file_id).text)
+        errors.update(failed)
+    if batch.status != "completed":
+        for custom_id in requests or {}:
+            if custom_id not in results:
+                errors.setdefault(custom_id, f"Batch {batch.status}")
+
+    if requests:
+        cache = get_response_cache()
+        for custom_id, (content, usage) in results.items():
+            chat_request = requests.get(custom_id)
+            if chat_request is None or not content:
+                continue
+            try:
+                cache.put(
+                    chat_request.cache_key(),
+                    chat_request.model,
+                    content,
+                    prompt_tokens=usage.get("prompt_tokens"),
+                    completion_tokens=usage.get("completion_tokens"),
+                )
+            except Exception as exc:
+                logging.warning(f"Response cache store failed: {exc}")
+
+    return {custom_id: content for custom_id, (content, _) in results.items()}, errors
+
+
+def run_batch(
+    client: OpenAI,
+    requests: Dict[str, ChatRequest],
+    work_dir: Path,
+    use_cache: bool = True,
+    poll_seconds: float = DEFAULT_POLL_SECONDS,
+    timeout_seconds: Optional[float] = None,
+    on_status: Optional[Callable[[Any], None]] = None,
+    on_submitted: Optional[Callable[[Any], None]] = None,
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Serve what the response cache already has, send the rest as one batch and wait for it.
+
+    Returns ({custom_id: content}, {custom_id: error}) covering all requests.
+    """
+    responses: Dict[str, str] = {}
+    pending: Dict[str, ChatRequest] = {}
+    cache = get_response_cache()
+    for custom_id, chat_request in requests.items():
+        cached = None
+        if use_cache:
+            try:
+                cached = cache.get(chat_request.cache_key())
+            except Exception as exc:
+                logging.warning(f"Response cache lookup failed: {exc}")
+        if cached is not None:
+            responses[custom_id] = cached
+        else:
+            pending[custom_id] = chat_request
+
+    if not pending:
+        return responses, {}
+
+    batch_file = write_batch_file(pending, work_dir / "batch_input.jsonl")
+    batch = submit_batch(client, batch_file)
+    if on_submitted is not None:
+        on_submitted(batch)
+    batch = wait_for_batch(client, batch.id, poll_seconds, timeout_seconds, on_status)
+    results, errors = collect_batch_results(client, batch, pending)
+    responses.update(results)
+    return responses, errors
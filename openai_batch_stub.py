@@ -0,0 +1,199 @@
+"""Local stand-in for the OpenAI file and batch endpoints, for testing the batch mode offline.
+
+    python openai_batch_stub.py --port 8089 --reply-file reply.txt
+    python olat_batch.py docs/ --types kprim --batch-api --base-url http://127.0.0.1:8089/v1 \
+        --api-key test --poll-seconds 1
+
+Batches move from "validating" via "in_progress" to "completed" on successive
+status requests. Every chat request is answered with the same reply text; requests
+whose user prompt contains FAIL_MARKER end up in the error file instead.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+FAIL_MARKER = "[stub:fail]"
+
+
+class StubState:
+    def __init__(self, reply: str, polls_until_done: int):
+        self.reply = reply
+        self.polls_until_done = polls_until_done
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.polls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, content: bytes) -> str:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        self.files[file_id] = content
+        return file_id
+
+    def run_batch(self, batch: Dict[str, Any]) -> None:
+        outputs: List[str] = []
+        errors: List[str] = []
+        for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            request_id = f"req-{uuid.uuid4().hex[:12]}"
+            prompt = json.dumps(request["body"].get("messages", []))
+            if FAIL_MARKER in prompt:
+                errors.append(json.dumps({
+                    "id": request_id,
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 400, "body": {"error": {"message": "Stub failure"}}},
+                    "error": None,
+                }))
+                continue
+            outputs.append(json.dumps({
+                "id": request_id,
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": request_id,
+                    "body": {
+                        "id": f"chatcmpl-{request_id}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request["body"].get("model"),
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": self.reply},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(self.reply) // 4},
+                    },
+                },
+                "error": None,
+            }))
+        batch["output_file_id"] = self.add_file("\n".join(outputs).encode("utf-8")) if outputs else None
+        batch["error_file_id"] = self.add_file("\n".join(errors).encode("utf-8")) if errors else None
+        batch["request_counts"] = {
+            "total": len(outputs) + len(errors),
+            "completed": len(outputs),
+            "failed": len(errors),
+        }
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload: Any = None, raw: bytes = None) -> None:
+            body = raw if raw is not None else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_POST(self) -> None:
+            with state.lock:
+                if self.path == "/v1/files":
+                    header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                    message = BytesParser(policy=HTTP).parsebytes(header + self._body())
+                    content = next(
+                        (part.get_payload(decode=True) for part in message.iter_parts() if part.get_filename()),
+                        b"",
+                    )
+                    file_id = state.add_file(content)
+                    self._send(200, {
+                        "id": file_id,
+                        "object": "file",
+                        "bytes": len(content),
+                        "created_at": int(time.time()),
+                        "filename": "batch_input.jsonl",
+                        "purpose": "batch",
+                        "status": "processed",
+                    })
+                elif self.path == "/v1/batches":
+                    request = json.loads(self._body() or b"{}")
+                    if request.get("input_file_id") not in state.files:
+                        self._send(404, {"error": {"message": "Unknown input file"}})
+                        return
+                    batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+                    state.batches[batch_id] = {
+                        "id": batch_id,
+                        "object": "batch",
+                        "endpoint": request.get("endpoint"),
+                        "input_file_id": request["input_file_id"],
+                        "completion_window": request.get("completion_window"),
+                        "status": "validating",
+                        "output_file_id": None,
+                        "error_file_id": None,
+                        "created_at": int(time.time()),
+                        "metadata": request.get("metadata"),
+                        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                    }
+                    state.polls[batch_id] = 0
+                    self._send(200, state.batches[batch_id])
+                else:
+                    self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+        def do_GET(self) -> None:
+            with state.lock:
+                parts = self.path.strip("/").split("/")
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in state.batches:
+                    batch = state.batches[parts[2]]
+                    state.polls[batch["id"]] += 1
+                    if batch["status"] != "completed":
+                        if state.polls[batch["id"]] >= state.polls_until_done:
+                            state.run_batch(batch)
+                        else:
+                            batch["status"] = "in_progress"
+                    self._send(200, batch)
+                elif parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content":
+                    if parts[2] not in state.files:
+                        self._send(404, {"error": {"message": "Unknown file"}})
+                        return
+                    self._send(200, raw=state.files[parts[2]])
+                else:
+                    self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def serve(host: str, port: int, reply: str, polls_until_done: int = 2) -> ThreadingHTTPServer:
+    """Start the stub server in a background thread and return it (call shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), make_handler(StubState(reply, polls_until_done)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve stub OpenAI file and batch endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--reply", default="Stub response", help="Reply text for every request")
+    parser.add_argument("--reply-file", help="Read the reply text from a file")
+    parser.add_argument("--polls", type=int, default=2, help="Status requests until a batch completes")
+    args = parser.parse_args()
+
+    reply = args.reply
+    if args.reply_file:
+        with open(args.reply_file, encoding="utf-8") as file:
+            reply = file.read()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubState(reply, args.polls)))
+    print(f"Stub batch API listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Process-wide HTTP connection pool and OpenAI clients, shared by all sessions of both apps.
+
+Streamlit re-executes the app scripts on every interaction, so clients created there
+would open new TCP/TLS connections for every run. The clients here are created once
+per process, keep connections alive between runs and are closed at interpreter exit.
+"""
+import atexit
+import importlib.util
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import OpenAI
+
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+KEEPALIVE_EXPIRY_SECONDS = 120.0
+CONNECT_TIMEOUT_SECONDS = 10.0
+REQUEST_TIMEOUT_SECONDS = 600.0
+
+# HTTP/2 multiplexes parallel requests over one connection; it needs the optional h2 package.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_http_client: Optional[httpx.Client] = None
+_openai_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+_lock = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """Return the shared pooled httpx client (also used for plain downloads)."""
+    global _http_client
+    with _lock:
+        if _http_client is None or _http_client.is_closed:
+            # OpenAI clients bound to a closed pool cannot be reused either.
+            _openai_clients.clear()
+            _http_client = httpx.Client(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+                ),
+                timeout=httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+                # Proxy variables are ignored, as the apps removed them before.
+                trust_env=False,
+            )
+        return _http_client
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """Return the OpenAI client for this key/base URL, created once on the shared connection pool."""
+    http_client = get_http_client()
+    with _lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=http_client,
+                # Retries are handled by the shared request scheduler.
+                max_retries=0,
+            )
+            _openai_clients[(api_key, base_url)] = client
+        return client
+
+
+@atexit.register
+def close_clients() -> None:
+    global _http_client
+    with _lock:
+        _openai_clients.clear()
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
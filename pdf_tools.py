@@ -0,0 +1,264 @@
+"""PDF helpers shared by both apps: page selection, lazy page-parallel text extraction
+and on-demand rasterisation of single pages."""
+import copy
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import PyPDF2
+from pdf2image import convert_from_bytes
+
+from image_pipeline import MAX_IMAGE_SIDE
+
+# Selections with at least this many pages are fanned out over a process pool
+PARALLEL_PAGE_THRESHOLD = 32
+PAGES_PER_TASK = 16
+
+# Page images are downscaled to MAX_IMAGE_SIDE before they are sent to the model,
+# so rendering at a higher resolution only wastes time and memory.
+MAX_RENDER_DPI = 200
+MAX_RENDER_THREADS = 4
+RENDER_DIR = Path(tempfile.gettempdir()) / "olat_pdf_pages"
+RENDER_MAX_AGE_SECONDS = 24 * 60 * 60
+# pdftoppm names its output <prefix>-<page number>.<ext>
+_RENDERED_PAGE = re.compile(r"-(\d+)\.\w+$")
+
+_worker_reader: Optional[PyPDF2.PdfReader] = None
+
+
+def pdf_page_count(file_bytes: bytes) -> int:
+    return len(PyPDF2.PdfReader(io.BytesIO(file_bytes)).pages)
+
+
+def parse_page_selection(selection: str, page_count: int) -> List[int]:
+    """Parse a selection like "1-3, 7" into sorted 1-based page numbers (empty means all pages)."""
+    if not selection or not selection.strip():
+        return list(range(1, page_count + 1))
+
+    pages = set()
+    for token in re.split(r"[,;\s]+", selection.strip()):
+        if not token:
+            continue
+        match = re.fullmatch(r"(\d+)(?:-(\d*))?", token)
+        if not match:
+            raise ValueError(f"Invalid page selection: {token!r}")
+        start = int(match.group(1))
+        if match.group(2) is None:
+            end = start
+        else:
+            end = int(match.group(2)) if match.group(2) else page_count
+        if start < 1 or end > page_count or start > end:
+            raise ValueError(f"Page range {token!r} is outside 1-{page_count}")
+        pages.update(range(start, end + 1))
+    return sorted(pages)
+
+
+def _iter_reader_pages(reader: PyPDF2.PdfReader, pages: Sequence[int]) -> Iterator[Tuple[int, str]]:
+    for page_number in pages:
+        yield page_number, reader.pages[page_number - 1].extract_text() or ""
+
+
+def iter_pdf_pages(file_bytes: bytes, pages: Optional[Sequence[int]] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) lazily, one page at a time, for the selected 1-based pages."""
+    reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+    if pages is None:
+        pages = range(1, len(reader.pages) + 1)
+    yield from _iter_reader_pages(reader, pages)
+
+
+def _init_worker(file_bytes: bytes) -> None:
+    # Parse the document once per worker process instead of once per page range.
+    global _worker_reader
+    _worker_reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+
+
+def _extract_page_range(pages: Sequence[int]) -> List[Tuple[int, str]]:
+    return list(_iter_reader_pages(_worker_reader, pages))
+
+
+def iter_pdf_pages_parallel(
+    file_bytes: bytes,
+    pages: Optional[Sequence[int]] = None,
+    max_workers: Optional[int] = None,
+    reader: Optional[PyPDF2.PdfReader] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Like iter_pdf_pages, but extracts page ranges on a process pool for large selections.
+
+    Pages are still yielded in order, as soon as their range has been extracted.
+    Falls back to sequential extraction if the process pool cannot be used. An
+    already parsed reader of the document is reused for sequential extraction.
+    """
+    if pages is None:
+        pages = range(1, (len(reader.pages) if reader else pdf_page_count(file_bytes)) + 1)
+    pages = list(pages)
+    workers = max_workers or min(os.cpu_count() or 1, 8)
+    if len(pages) < PARALLEL_PAGE_THRESHOLD or workers < 2:
+        yield from (_iter_reader_pages(reader, pages) if reader else iter_pdf_pages(file_bytes, pages))
+        return
+
+    ranges = [pages[i:i + PAGES_PER_TASK] for i in range(0, len(pages), PAGES_PER_TASK)]
+    yielded = 0
+    try:
+        # Spawned, not forked: the apps call this from a multi-threaded process, and a forked
+        # child can deadlock on a lock another thread held at fork time.
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(file_bytes,),
+        ) as executor:
+            for page_texts in executor.map(_extract_page_range, ranges):
+                for page_text in page_texts:
+                    yield page_text
+                    yielded += 1
+    except Exception as exc:
+        # Fall back to extracting the pages that are still missing in this process.
+        logging.warning(f"Parallel PDF extraction failed, continuing sequentially: {exc}")
+        yield from iter_pdf_pages(file_bytes, pages[yielded:])
+
+
+def extract_pdf_text(
+    file_bytes: bytes,
+    pages: Optional[Sequence[int]] = None,
+    max_workers: Optional[int] = None,
+) -> str:
+    """Return the text of the selected pages, skipping pages without extractable text."""
+    return "\n".join(
+        page_text
+        for _, page_text in iter_pdf_pages_parallel(file_bytes, pages, max_workers)
+        if page_text.strip()
+    ).strip()
+
+
+def render_dpi(page: PyPDF2.PageObject, max_side: int = MAX_IMAGE_SIDE) -> int:
+    """Return the DPI at which the longer side of the page is rendered with max_side pixels."""
+    longest_points = max(float(page.mediabox.width), float(page.mediabox.height))
+    if longest_points <= 0:
+        return MAX_RENDER_DPI
+    return max(1, min(MAX_RENDER_DPI, int(max_side * 72 / longest_points)))
+
+
+def _contiguous_runs(pages: Sequence[int]) -> List[List[int]]:
+    runs: List[List[int]] = []
+    for page_number in sorted(set(pages)):
+        if runs and page_number == runs[-1][-1] + 1:
+            runs[-1].append(page_number)
+        else:
+            runs.append([page_number])
+    return runs
+
+
+def prune_rendered_pages(max_age_seconds: float = RENDER_MAX_AGE_SECONDS) -> None:
+    """Remove rendered page directories of documents that were not used recently."""
+    if not RENDER_DIR.exists():
+        return
+    cutoff = time.time() - max_age_seconds
+    for document_dir in RENDER_DIR.iterdir():
+        try:
+            if document_dir.stat().st_mtime < cutoff:
+                shutil.rmtree(document_dir, ignore_errors=True)
+        except OSError:
+            continue
+
+
+def _rendered_page_number(path: str) -> int:
+    match = _RENDERED_PAGE.search(os.path.basename(path))
+    if not match:
+        raise RuntimeError(f"Unexpected pdftoppm output file: {path}")
+    return int(match.group(1))
+
+
+class PdfPageRenderer:
+    """Rasterises pages of one PDF on demand into JPEG files instead of in-memory images.
+
+    Only the requested pages are rendered (via first_page/last_page), at a DPI capped
+    to MAX_IMAGE_SIDE, and each rendered page is kept on disk and reused, so memory use
+    does not grow with the page count. PyPDF2 readers are not thread-safe: the reader
+    and the rendered pages are only touched under `lock`, which selections share.
+    """
+
+    def __init__(
+        self,
+        file_bytes: bytes,
+        pages: Optional[Sequence[int]] = None,
+        max_side: int = MAX_IMAGE_SIDE,
+        lock: Optional[threading.RLock] = None,
+    ):
+        self.file_bytes = file_bytes
+        # Reentrant, so an owner that passes its own lock can hold it while rendering
+        self.lock = lock or threading.RLock()
+        self.max_side = max_side
+        self.digest = hashlib.sha256(file_bytes).hexdigest()
+        self.reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+        self.page_count = len(self.reader.pages)
+        self.pages = list(pages) if pages else list(range(1, self.page_count + 1))
+        self.output_dir = RENDER_DIR / self.digest[:32]
+        # Pages rendered through this renderer (or a selection of it), by page number
+        self.rendered: Dict[int, Path] = {}
+
+    def select(self, pages: Optional[Sequence[int]], max_side: Optional[int] = None) -> "PdfPageRenderer":
+        """Return a renderer for another page selection (or size) that shares the parsed document.
+
+        Selections at the same size also share the rendered pages.
+        """
+        selection = copy.copy(self)
+        selection.pages = list(pages) if pages else list(range(1, self.page_count + 1))
+        if max_side is not None and max_side != self.max_side:
+            selection.max_side = max_side
+            selection.rendered = {}
+        return selection
+
+    def _target(self, page_number: int) -> Path:
+        return self.output_dir / f"page-{page_number:05d}-{self.max_side}.jpg"
+
+    def page_path(self, page_number: int) -> Path:
+        """Return the path of the rendered page, rendering it first if necessary."""
+        return self.render_pages([page_number])[0]
+
+    def render_pages(self, pages: Sequence[int]) -> List[Path]:
+        """Render the given pages (contiguous runs share one pdftoppm call) and return their paths."""
+        missing = [page_number for page_number in pages if not self._target(page_number).exists()]
+        if missing:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            for run in _contiguous_runs(missing):
+                self._render_run(run)
+        if self.output_dir.exists():
+            # Mark the document as recently used so prune_rendered_pages keeps it.
+            os.utime(self.output_dir)
+        paths = [self._target(page_number) for page_number in pages]
+        with self.lock:
+            self.rendered.update(zip(pages, paths))
+        return paths
+
+    def _render_run(self, run: List[int]) -> None:
+        # Pages of one run share a DPI; mixed page sizes are capped by the largest page.
+        with self.lock:
+            dpi = min(render_dpi(self.reader.pages[page_number - 1], self.max_side) for page_number in run)
+        with tempfile.TemporaryDirectory(dir=self.output_dir) as tmp_dir:
+            paths = convert_from_bytes(
+                self.file_bytes,
+                dpi=dpi,
+                first_page=run[0],
+                last_page=run[-1],
+                fmt="jpeg",
+                output_folder=tmp_dir,
+                paths_only=True,
+                thread_count=min(MAX_RENDER_THREADS, len(run)),
+            )
+            # With several threads every thread gets its own random file prefix, so the
+            # names do not sort by page; the page number is taken from the name instead.
+            rendered = {_rendered_page_number(path): path for path in paths}
+            if sorted(rendered) != run:
+                raise RuntimeError(f"pdftoppm rendered pages {sorted(rendered)} instead of {run[0]}-{run[-1]}")
+            for page_number in run:
+                os.replace(rendered[page_number], self._target(page_number))
@@ -0,0 +1,293 @@
+"""Export of generated questions as a QTI 2.1 content package (zip with items and manifest).
+
+QtiPackageWriter streams every item straight into its zip entry (zipfile's
+ZipFile.open(name, "w")), so a bank of hundreds of questions is never held in
+memory as XML documents; only the identifiers for imsmanifest.xml are kept, and the
+manifest is written last.
+
+Questions come either as OLAT import text (every type of the generator, parsed with
+olat_validator) or as FibItems from the inline_fib conversion, which become a
+text-entry (FIB) and an inline-choice item each, like in the OLAT output.
+"""
+import io
+import time
+import zipfile
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
+
+from inline_fib_parser import FibItem
+from olat_validator import normalize_olat_text, parse_question_block, split_questions
+
+QTI_NAMESPACE = "http://www.imsglobal.org/xsd/imsqti_v2p1"
+QTI_SCHEMA = "http://www.imsglobal.org/xsd/qti/qtiv2p1/imsqti_v2p1.xsd"
+MAP_RESPONSE = "http://www.imsglobal.org/question/qti_v2p1/rptemplates/map_response"
+FIB_TITLE = "Lückentext"
+INLINECHOICE_TITLE = "Wörter einordnen"
+
+Target = Union[str, BinaryIO]
+
+
+def _number(value: str) -> float:
+    try:
+        return float(value.strip().replace(",", "."))
+    except ValueError:
+        return 0.0
+
+
+def _score(value: float) -> str:
+    return f"{value:g}"
+
+
+def _item_start(identifier: str, title: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<assessmentItem xmlns="{QTI_NAMESPACE}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        f'xsi:schemaLocation="{QTI_NAMESPACE} {QTI_SCHEMA}" identifier="{identifier}" '
+        f'title={quoteattr(title)} adaptive="false" timeDependent="false">\n'
+    )
+
+
+def _outcomes(max_score: float) -> str:
+    return (
+        '<outcomeDeclaration identifier="SCORE" cardinality="single" baseType="float">'
+        '<defaultValue><value>0</value></defaultValue></outcomeDeclaration>\n'
+        '<outcomeDeclaration identifier="MAXSCORE" cardinality="single" baseType="float">'
+        f'<defaultValue><value>{_score(max_score)}</value></defaultValue></outcomeDeclaration>\n'
+    )
+
+
+def _mapped_declaration(cardinality: str, base_type: str, correct: List[str], mapping: List[Tuple[str, float]], upper: float) -> str:
+    values = "".join(f"<value>{value}</value>" for value in correct)
+    entries = "".join(f'<mapEntry mapKey="{key}" mappedValue="{_score(score)}"/>' for key, score in mapping)
+    return (
+        f'<responseDeclaration identifier="RESPONSE" cardinality="{cardinality}" baseType="{base_type}">'
+        f"<correctResponse>{values}</correctResponse>"
+        f'<mapping lowerBound="0" upperBound="{_score(upper)}" defaultValue="0">{entries}</mapping>'
+        "</responseDeclaration>\n"
+    )
+
+
+def _choice_item(fields, rows, multiple: bool) -> Iterator[str]:
+    answers = [(_number(row[0]), row[1].strip()) for row in rows if len(row) >= 2]
+    points = _number(fields.get("Points", "0"))
+    choices = [(f"choice_{index}", score, text) for index, (score, text) in enumerate(answers, 1)]
+    yield _mapped_declaration(
+        "multiple" if multiple else "single",
+        "identifier",
+        [identifier for identifier, score, _ in choices if score > 0],
+        [(identifier, score) for identifier, score, _ in choices],
+        points,
+    )
+    yield _outcomes(points)
+    yield f"<itemBody><p>{escape(fields.get('Question', ''))}</p>\n"
+    yield f'<choiceInteraction responseIdentifier="RESPONSE" shuffle="true" maxChoices="{0 if multiple else 1}">\n'
+    for identifier, _, text in choices:
+        yield f'<simpleChoice identifier="{identifier}">{escape(text)}</simpleChoice>\n'
+    yield "</choiceInteraction></itemBody>\n"
+    yield f'<responseProcessing template="{MAP_RESPONSE}"/>\n'
+
+
+def _match_item(question: str, points: float, sources: List[str], targets: List[str], scores: List[List[float]]) -> Iterator[str]:
+    """Statements/items (sources) matched to targets; scores[i][j] is the score of source i on target j."""
+    pairs = [
+        (f"source_{i} target_{j}", score)
+        for i, row in enumerate(scores, 1)
+        for j, score in enumerate(row, 1)
+    ]
+    yield _mapped_declaration(
+        "multiple", "directedPair", [pair for pair, score in pairs if score > 0], pairs, points
+    )
+    yield _outcomes(points)
+    yield f"<itemBody><p>{escape(question)}</p>\n"
+    yield f'<matchInteraction responseIdentifier="RESPONSE" shuffle="false" maxAssociations="{len(sources)}">\n'
+    yield "<simpleMatchSet>\n"
+    for index, text in enumerate(sources, 1):
+        yield f'<simpleAssociableChoice identifier="source_{index}" matchMax="1">{escape(text)}</simpleAssociableChoice>\n'
+    yield "</simpleMatchSet>\n<simpleMatchSet>\n"
+    for index, text in enumerate(targets, 1):
+        yield f'<simpleAssociableChoice identifier="target_{index}" matchMax="{len(sources)}">{escape(text)}</simpleAssociableChoice>\n'
+    yield "</simpleMatchSet>\n</matchInteraction></itemBody>\n"
+    yield f'<responseProcessing template="{MAP_RESPONSE}"/>\n'
+
+
+def _kprim_item(fields, rows) -> Iterator[str]:
+    statements = [(row[0].strip() == "+", row[1].strip()) for row in rows if len(row) >= 2]
+    points = _number(fields.get("Points", "0"))
+    # Each statement judged correctly earns an equal share of the points
+    share = points / len(statements) if statements else 0.0
+    scores = [[share, 0.0] if correct else [0.0, share] for correct, _ in statements]
+    return _match_item(fields.get("Question", ""), points, [text for _, text in statements], ["richtig", "falsch"], scores)
+
+
+def _truefalse_item(fields, rows) -> Iterator[str]:
+    statements = [row for row in rows if len(row) >= 4 and row[0].strip()]
+    scores = [[_number(row[2]), _number(row[3])] for row in statements]
+    return _match_item(
+        fields.get("Question", ""),
+        _number(fields.get("Points", "0")),
+        [row[0].strip() for row in statements],
+        ["richtig", "falsch"],
+        scores,
+    )
+
+
+def _dragdrop_item(fields, rows) -> Iterator[str]:
+    categories = [cell.strip() for cell in rows[0][1:] if cell.strip()] if rows else []
+    items = [row for row in rows[1:] if row[0].strip()]
+    scores = [[_number(cell) for cell in row[1:1 + len(categories)]] for row in items]
+    return _match_item(
+        fields.get("Question", ""), _number(fields.get("Points", "0")), [row[0].strip() for row in items], categories, scores
+    )
+
+
+def _gap_item(fib_item: FibItem, inline_choice: bool) -> Iterator[str]:
+    count = len(fib_item.blanks)
+    options = fib_item.blanks + fib_item.wrong_substitutes
+    for index, blank in enumerate(fib_item.blanks, 1):
+        if inline_choice:
+            correct = f"option_{options.index(blank) + 1}"
+            yield f'<responseDeclaration identifier="RESPONSE_{index}" cardinality="single" baseType="identifier">'
+        else:
+            correct = escape(blank)
+            yield f'<responseDeclaration identifier="RESPONSE_{index}" cardinality="single" baseType="string">'
+        yield f"<correctResponse><value>{correct}</value></correctResponse></responseDeclaration>\n"
+    yield _outcomes(count)
+    yield "<itemBody><p>"
+    for index, (segment, _) in enumerate(zip(fib_item.segments, fib_item.blanks), 1):
+        if segment:
+            yield f"{escape(segment)} "
+        if inline_choice:
+            yield f'<inlineChoiceInteraction responseIdentifier="RESPONSE_{index}" shuffle="true">'
+            yield "".join(
+                f'<inlineChoice identifier="option_{number}">{escape(option)}</inlineChoice>'
+                for number, option in enumerate(options, 1)
+            )
+            yield "</inlineChoiceInteraction> "
+        else:
+            yield f'<textEntryInteraction responseIdentifier="RESPONSE_{index}" expectedLength="20"/> '
+    yield f"{escape(fib_item.segments[-1])}</p></itemBody>\n<responseProcessing>\n"
+    # One point per correctly filled gap
+    for index in range(1, count + 1):
+        yield (
+            f'<responseCondition><responseIf><match><variable identifier="RESPONSE_{index}"/>'
+            f'<correct identifier="RESPONSE_{index}"/></match>'
+            '<setOutcomeValue identifier="SCORE"><sum><variable identifier="SCORE"/>'
+            '<baseValue baseType="float">1</baseValue></sum></setOutcomeValue></responseIf></responseCondition>\n'
+        )
+    yield "</responseProcessing>\n"
+
+
+def _fib_item_from_rows(rows: List[List[str]]) -> FibItem:
+    # OLAT FIB/Inlinechoice blocks alternate Text lines and gap lines
+    segments: List[str] = []
+    blanks: List[str] = []
+    options: List[str] = []
+    pending = ""
+    for row in rows:
+        if row[0] == "Text":
+            pending = f"{pending} {row[1].strip()}".strip() if len(row) > 1 else pending
+            continue
+        if len(row) >= 4:  # Inlinechoice gap: 1, options, correct, |
+            blanks.append(row[2].strip())
+            options = row[1].split("|")
+        elif len(row) >= 2:  # FIB gap: 1, answer, size
+            blanks.append(row[1].strip())
+        else:
+            continue
+        segments.append(pending)
+        pending = ""
+    segments.append(pending)
+    wrong_substitutes = [option for option in options if option not in blanks]
+    return FibItem(segments, blanks, wrong_substitutes)
+
+
+class QtiPackageWriter:
+    """Writes QTI 2.1 items into a zip one at a time; call close() (or use with) to add the manifest."""
+
+    def __init__(self, target: Target):
+        self._zip = zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED)
+        self._items: List[Tuple[str, str]] = []
+
+    def __enter__(self) -> "QtiPackageWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def item_count(self) -> int:
+        return len(self._items)
+
+    def _open_entry(self, name: str) -> io.TextIOWrapper:
+        # A ZipInfo instead of a bare name, so entries get the current time instead of 1980
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return io.TextIOWrapper(self._zip.open(info, "w"), encoding="utf-8")
+
+    def _write_item(self, title: str, body: Iterable[str]) -> str:
+        identifier = f"item_{len(self._items) + 1:04d}"
+        href = f"items/{identifier}.xml"
+        with self._open_entry(href) as stream:
+            stream.write(_item_start(identifier, title))
+            for piece in body:
+                stream.write(piece)
+            stream.write("</assessmentItem>\n")
+        self._items.append((identifier, href))
+        return identifier
+
+    def add_fib_item(self, fib_item: FibItem, inline_choice: bool = False) -> Optional[str]:
+        """Add a gap text as text-entry (FIB) or inline-choice item; items without gaps are skipped."""
+        if not fib_item.blanks:
+            return None
+        return self._write_item(INLINECHOICE_TITLE if inline_choice else FIB_TITLE, _gap_item(fib_item, inline_choice))
+
+    def add_olat_question(self, block: str) -> Optional[str]:
+        """Add one question given as an OLAT import block; unknown blocks are skipped."""
+        typ, fields, rows = parse_question_block(block)
+        title = fields.get("Title") or fields.get("Question") or typ or ""
+        if typ in ("SC", "MC"):
+            return self._write_item(title, _choice_item(fields, rows, multiple=typ == "MC"))
+        if typ == "KPRIM":
+            return self._write_item(title, _kprim_item(fields, rows))
+        if typ == "Truefalse":
+            return self._write_item(title, _truefalse_item(fields, rows))
+        if typ == "Drag&drop":
+            return self._write_item(title, _dragdrop_item(fields, rows))
+        if typ in ("FIB", "Inlinechoice"):
+            return self.add_fib_item(_fib_item_from_rows(rows), inline_choice=typ == "Inlinechoice")
+        return None
+
+    def close(self) -> None:
+        if self._zip.fp is None:
+            return
+        with self._open_entry("imsmanifest.xml") as stream:
+            stream.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" identifier="olat_questions" '
+                'xsi:schemaLocation="http://www.imsglobal.org/xsd/imscp_v1p1 '
+                'http://www.imsglobal.org/xsd/qti/qtiv2p1/qtiv2p1_imscpv1p2_v1p0.xsd">\n'
+                "<organizations/>\n<resources>\n"
+            )
+            for identifier, href in self._items:
+                stream.write(
+                    f'<resource identifier="{identifier}" type="imsqti_item_xmlv2p1" href="{href}">'
+                    f'<file href="{href}"/></resource>\n'
+                )
+            stream.write("</resources>\n</manifest>\n")
+        self._zip.close()
+
+
+def write_qti_package(target: Target, olat_text: str = "", fib_items: Iterable[FibItem] = ()) -> int:
+    """Write all questions of olat_text and the given FibItems as a QTI 2.1 package; returns the item count.
+
+    FibItems are exported as a FIB and an inline-choice item each. Pass the inline_fib
+    output either as FibItems or inside olat_text, not both.
+    """
+    with QtiPackageWriter(target) as writer:
+        for block in split_questions(normalize_olat_text(olat_text.replace("\n---\n", "\n\n"))):
+            writer.add_olat_question(block)
+        for fib_item in fib_items:
+            writer.add_fib_item(fib_item, inline_choice=True)
+            writer.add_fib_item(fib_item)
+        return writer.item_count
@@ -0,0 +1,292 @@
+"""Structured output for the question types: JSON schemas, models and OLAT serialisation.
+
+In structured mode the model answers with JSON constrained by the schema of the
+question type (OpenAI structured outputs, strict JSON schema). The JSON is parsed
+into the dataclasses below and written in the tab-separated OLAT import format
+locally, so points, answer counts and separators no longer depend on the model
+copying the template correctly.
+
+inline_fib keeps its JSON array as the response; it is converted by the existing
+inline_fib path (olat_generator.inline_fib_to_olat).
+"""
+import json
+import logging
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+BLOOM_LEVELS = ["Wissen", "Verstehen", "Anwenden", "Analyse"]
+
+# Added to the type template in structured mode; the template describes content, the schema the shape
+STRUCTURED_OUTPUT_NOTE = (
+    "Return the questions as JSON matching the provided response schema instead of the tab-separated "
+    "template. Mark each answer or statement as correct or not; points and formatting are added automatically."
+)
+
+WRONG_ANSWER_POINTS = -0.5
+MC_POINTS = 3
+# Correct answers each multiple choice variant asks for (see multiple_choice1.md etc.)
+MC_CORRECT_ANSWERS = {"multiple_choice1": 1, "multiple_choice2": 2, "multiple_choice3": 3}
+KPRIM_POINTS = 5
+
+
+@dataclass
+class Answer:
+    text: str
+    correct: bool
+
+
+@dataclass
+class ChoiceQuestion:
+    """Single or multiple choice question with feedback texts."""
+    level: str
+    title: str
+    question: str
+    feedback_correct: str
+    feedback_wrong: str
+    answers: List[Answer]
+
+
+@dataclass
+class StatementQuestion:
+    """KPRIM or true/false question: statements that are each right or wrong."""
+    level: str
+    title: str
+    question: str
+    statements: List[Answer]
+
+
+@dataclass
+class DragItem:
+    text: str
+    category: str
+
+
+@dataclass
+class DragDropQuestion:
+    level: str
+    title: str
+    question: str
+    categories: List[str]
+    items: List[DragItem]
+
+
+def _object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    # Strict structured outputs require every property to be listed and no extra keys
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+_STRING = {"type": "string"}
+_LEVEL = {"type": "string", "enum": BLOOM_LEVELS}
+_ANSWER = _object({"text": _STRING, "correct": {"type": "boolean"}})
+_HEADER = {"level": _LEVEL, "title": _STRING, "question": _STRING}
+
+CHOICE_SCHEMA = _object({
+    **_HEADER,
+    "feedback_correct": _STRING,
+    "feedback_wrong": _STRING,
+    "answers": {"type": "array", "items": _ANSWER},
+})
+
+
+def _multiple_choice_schema(correct_answers: int) -> Dict[str, Any]:
+    # Strict mode cannot count booleans, so the count is stated here and checked when converting
+    answers = {"type": "array", "items": _ANSWER, "description": f"Exactly {correct_answers} of the answers are correct."}
+    return {**CHOICE_SCHEMA, "properties": {**CHOICE_SCHEMA["properties"], "answers": answers}}
+
+
+STATEMENT_SCHEMA = _object({**_HEADER, "statements": {"type": "array", "items": _ANSWER}})
+DRAGDROP_SCHEMA = _object({
+    **_HEADER,
+    "categories": {"type": "array", "items": _STRING},
+    "items": {"type": "array", "items": _object({"text": _STRING, "category": _STRING})},
+})
+INLINE_FIB_SCHEMA = _object({
+    "text": _STRING,
+    "blanks": {"type": "array", "items": _STRING},
+    "wrong_substitutes": {"type": "array", "items": _STRING},
+})
+
+
+def _score(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _choice_from_json(data: Dict[str, Any]) -> ChoiceQuestion:
+    answers = [Answer(answer["text"], bool(answer["correct"])) for answer in data["answers"]]
+    return ChoiceQuestion(
+        data["level"], data["title"], data["question"], data["feedback_correct"], data["feedback_wrong"], answers
+    )
+
+
+def _statements_from_json(data: Dict[str, Any]) -> StatementQuestion:
+    statements = [Answer(statement["text"], bool(statement["correct"])) for statement in data["statements"]]
+    return StatementQuestion(data["level"], data["title"], data["question"], statements)
+
+
+def _dragdrop_from_json(data: Dict[str, Any]) -> DragDropQuestion:
+    items = [DragItem(item["text"], item["category"]) for item in data["items"]]
+    return DragDropQuestion(data["level"], data["title"], data["question"], list(data["categories"]), items)
+
+
+def _clean(text: str) -> str:
+    # A tab or line break inside a field would break the OLAT line structure
+    return " ".join(str(text).split())
+
+
+def _header_lines(typ: str, question) -> List[str]:
+    return [f"Typ\t{typ}", f"Level\t{question.level}"]
+
+
+def _single_choice_to_olat(question: ChoiceQuestion) -> str:
+    correct = [answer for answer in question.answers if answer.correct]
+    if len(correct) != 1:
+        raise ValueError(f"single choice question needs exactly 1 correct answer, got {len(correct)}")
+    lines = _header_lines("SC", question) + [
+        f"Feedback correct answer\t{_clean(question.feedback_correct)}",
+        f"Feedback wrong answer\t{_clean(question.feedback_wrong)}",
+        f"Title\t{_clean(question.title)}",
+        f"Question\t{_clean(question.question)}",
+        "Points\t1",
+    ]
+    lines += [f"{1 if answer.correct else _score(WRONG_ANSWER_POINTS)}\t{_clean(answer.text)}" for answer in question.answers]
+    return "\n".join(lines)
+
+
+def _multiple_choice_to_olat(question: ChoiceQuestion, correct_answers: int) -> str:
+    correct = [answer for answer in question.answers if answer.correct]
+    if len(correct) != correct_answers:
+        raise ValueError(f"multiple choice question needs exactly {correct_answers} correct answers, got {len(correct)}")
+    # The points of the question are split evenly among its correct answers; Points is the
+    # sum of the rounded scores, so it always matches the answers (see olat_validator)
+    correct_score = round(MC_POINTS / correct_answers, 2)
+    correct_points = _score(correct_score)
+    lines = _header_lines("MC", question) + [
+        f"Feedback correct answer\t{_clean(question.feedback_correct)}",
+        f"Feedback wrong answer\t{_clean(question.feedback_wrong)}",
+        f"Title\t{_clean(question.title)}",
+        f"Question\t{_clean(question.question)}",
+        f"Max answers\t{len(question.answers)}",
+        "Min answers\t0",
+        f"Points\t{_score(round(correct_score * correct_answers, 2))}",
+    ]
+    lines += [
+        f"{correct_points if answer.correct else _score(WRONG_ANSWER_POINTS)}\t{_clean(answer.text)}"
+        for answer in question.answers
+    ]
+    return "\n".join(lines)
+
+
+def _kprim_to_olat(question: StatementQuestion) -> str:
+    if len(question.statements) != 4:
+        raise ValueError(f"KPRIM question needs 4 statements, got {len(question.statements)}")
+    lines = _header_lines("KPRIM", question) + [
+        f"Title\t{_clean(question.title)}",
+        f"Question\t{_clean(question.question)}",
+        f"Points\t{KPRIM_POINTS}",
+    ]
+    lines += [f"{'+' if statement.correct else '-'}\t{_clean(statement.text)}" for statement in question.statements]
+    return "\n".join(lines)
+
+
+def _truefalse_to_olat(question: StatementQuestion) -> str:
+    if not question.statements:
+        raise ValueError("true/false question has no statements")
+    wrong = _score(WRONG_ANSWER_POINTS)
+    lines = _header_lines("Truefalse", question) + [
+        f"Title\t{_clean(question.title)}",
+        f"Question\t{_clean(question.question)}",
+        f"Points\t{len(question.statements)}",
+        "\tUnanswered\tRight\tWrong",
+    ]
+    lines += [
+        f"{_clean(statement.text)}\t0\t{1 if statement.correct else wrong}\t{wrong if statement.correct else 1}"
+        for statement in question.statements
+    ]
+    return "\n".join(lines)
+
+
+def _dragdrop_to_olat(question: DragDropQuestion) -> str:
+    categories = [_clean(category) for category in question.categories]
+    if len(categories) < 2:
+        raise ValueError("drag and drop question needs at least 2 categories")
+    unknown = [item.category for item in question.items if _clean(item.category) not in categories]
+    if unknown or not question.items:
+        raise ValueError(f"drag and drop items without a valid category: {unknown or 'no items'}")
+    wrong = _score(WRONG_ANSWER_POINTS)
+    lines = _header_lines("Drag&drop", question) + [
+        f"Title\t{_clean(question.title)}",
+        f"Question\t{_clean(question.question)}",
+        f"Points\t{len(question.items)}",
+        "\t" + "\t".join(categories),
+    ]
+    for item in question.items:
+        cells = ["1" if _clean(item.category) == category else wrong for category in categories]
+        lines.append("\t".join([_clean(item.text)] + cells))
+    return "\n".join(lines)
+
+
+@dataclass(frozen=True)
+class QuestionSpec:
+    """Schema and converters of one question type."""
+    item_schema: Dict[str, Any]
+    from_json: Callable[[Dict[str, Any]], Any]
+    # None for inline_fib, whose objects are converted by the inline_fib path
+    to_olat: Optional[Callable[[Any], str]]
+
+
+QUESTION_SPECS: Dict[str, QuestionSpec] = {
+    "single_choice": QuestionSpec(CHOICE_SCHEMA, _choice_from_json, _single_choice_to_olat),
+    **{
+        msg_type: QuestionSpec(
+            _multiple_choice_schema(correct_answers),
+            _choice_from_json,
+            partial(_multiple_choice_to_olat, correct_answers=correct_answers),
+        )
+        for msg_type, correct_answers in MC_CORRECT_ANSWERS.items()
+    },
+    "kprim": QuestionSpec(STATEMENT_SCHEMA, _statements_from_json, _kprim_to_olat),
+    "truefalse": QuestionSpec(STATEMENT_SCHEMA, _statements_from_json, _truefalse_to_olat),
+    "draganddrop": QuestionSpec(DRAGDROP_SCHEMA, _dragdrop_from_json, _dragdrop_to_olat),
+    "inline_fib": QuestionSpec(INLINE_FIB_SCHEMA, dict, None),
+}
+
+
+def response_format(msg_type: str) -> Dict[str, Any]:
+    """The response_format parameter that constrains the answer to the schema of msg_type."""
+    schema = _object({"questions": {"type": "array", "items": QUESTION_SPECS[msg_type].item_schema}})
+    return {"type": "json_schema", "json_schema": {"name": f"olat_{msg_type}", "strict": True, "schema": schema}}
+
+
+def parse_questions(msg_type: str, content: str) -> List[Any]:
+    """Parse a structured response into question models (raises ValueError if it is not valid JSON)."""
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Structured {msg_type} response is not valid JSON: {e}") from e
+    spec = QUESTION_SPECS[msg_type]
+    try:
+        return [spec.from_json(item) for item in data["questions"]]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Structured {msg_type} response does not match the schema: {e!r}") from e
+
+
+def questions_to_olat(msg_type: str, questions: List[Any]) -> str:
+    """Serialise question models to OLAT import text; questions that break the type's rules are skipped."""
+    to_olat = QUESTION_SPECS[msg_type].to_olat
+    if to_olat is None:
+        return json.dumps(questions, ensure_ascii=False, indent=2)
+    blocks = []
+    for question in questions:
+        try:
+            blocks.append(to_olat(question))
+        except ValueError as e:
+            logging.warning(f"Skipping invalid {msg_type} question '{question.title}': {e}")
+    if not blocks:
+        raise ValueError(f"Structured {msg_type} response contains no valid question")
+    return "\n\n".join(blocks)
+
+
+def structured_response_to_olat(msg_type: str, content: str) -> str:
+    """Convert a structured response into the text the unstructured mode would have produced."""
+    return questions_to_olat(msg_type, parse_questions(msg_type, content))
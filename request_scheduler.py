@@ -0,0 +1,210 @@
+"""Rate-limit-aware scheduling of OpenAI calls, shared by both apps and all sessions of a process.
+
+Calls wait for request and token budgets (token buckets refilled per minute)
+instead of failing, and 429/5xx/connection errors are retried with jittered
+exponential backoff that honours the server's Retry-After header.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import openai
+
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 500_000
+DEFAULT_MAX_RETRIES = 6
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Budget of `capacity` units that refills continuously at `capacity` per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill(now)
+        # A single call larger than the whole budget waits for a full bucket instead of forever.
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self.available = min(self.capacity, self.available + amount)
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Return the delay requested by the server via retry-after-ms / Retry-After, if any."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, openai.RateLimitError):
+        # An exhausted quota does not recover by waiting.
+        return getattr(exc, "code", None) != "insufficient_quota"
+    return isinstance(exc, (openai.APIConnectionError, openai.InternalServerError))
+
+
+class RequestScheduler:
+    """Queues calls until request/token budgets allow them and retries transient failures."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self._condition = threading.Condition()
+        self._paused_until = 0.0
+        self._queued = 0
+        self._in_flight = 0
+        self._stats = {
+            "calls": 0,
+            "retries": 0,
+            "failures": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _acquire(self, estimated_tokens: int) -> float:
+        """Block until the budgets allow one call of estimated_tokens; returns the time waited."""
+        started = time.monotonic()
+        with self._condition:
+            self._queued += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = max(
+                        self._paused_until - now,
+                        self.requests.wait_time(1, now),
+                        self.tokens.wait_time(estimated_tokens, now),
+                    )
+                    if delay <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(estimated_tokens)
+                        self._in_flight += 1
+                        break
+                    self._condition.wait(delay)
+            finally:
+                self._queued -= 1
+        return time.monotonic() - started
+
+    def _release(self, estimated_tokens: int, used_tokens: Optional[int]) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if used_tokens is not None and used_tokens < estimated_tokens:
+                # The estimate includes the full completion limit; refund what was not used.
+                self.tokens.give_back(estimated_tokens - used_tokens)
+            self._condition.notify_all()
+
+    def _pause(self, seconds: float) -> None:
+        # A 429 applies to the whole organisation, so hold back every queued call.
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def run(
+        self,
+        call: Callable[[], T],
+        estimated_tokens: int,
+        used_tokens: Optional[Callable[[T], Optional[int]]] = None,
+        can_retry: Optional[Callable[[], bool]] = None,
+        report: Optional[Dict[str, Any]] = None,
+    ) -> T:
+        """Run call() once the budgets allow it, retrying transient API errors.
+
+        used_tokens extracts the actual token usage from the result so unused budget
+        is refunded; can_retry is checked before each retry (e.g. a stream that has
+        already delivered output must not be restarted). If report is given, the
+        number of retries and the total queue wait are written into it.
+        """
+        attempt = 0
+        if report is not None:
+            report.update(retries=0, queue_seconds=0.0)
+        while True:
+            waited = self._acquire(estimated_tokens)
+            if report is not None:
+                report.update(retries=attempt, queue_seconds=report["queue_seconds"] + waited)
+            with self._condition:
+                self._stats["calls"] += 1
+                self._stats["total_wait_seconds"] += waited
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+            try:
+                result = call()
+            except Exception as exc:
+                if attempt >= self.max_retries or not is_retryable(exc) or (can_retry and not can_retry()):
+                    self._release(estimated_tokens, None)
+                    with self._condition:
+                        self._stats["failures"] += 1
+                    raise
+                server_delay = retry_after_seconds(exc)
+                backoff = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt)
+                delay = server_delay if server_delay is not None else random.uniform(backoff / 2, backoff)
+                if isinstance(exc, openai.RateLimitError):
+                    self._pause(delay)
+                self._release(estimated_tokens, None)
+                attempt += 1
+                with self._condition:
+                    self._stats["retries"] += 1
+                logging.warning(f"OpenAI call failed ({exc.__class__.__name__}), retry {attempt} in {delay:.1f} s")
+                time.sleep(delay)
+                continue
+            self._release(estimated_tokens, used_tokens(result) if used_tokens else None)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._queued
+            stats["in_flight"] = self._in_flight
+            stats["average_wait_seconds"] = stats["total_wait_seconds"] / stats["calls"] if stats["calls"] else 0.0
+            stats["paused_for_seconds"] = max(0.0, self._paused_until - time.monotonic())
+        return stats
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_request_scheduler() -> RequestScheduler:
+    """Return the process-wide scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                requests_per_minute=float(os.environ.get("OLAT_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)),
+                tokens_per_minute=float(os.environ.get("OLAT_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)),
+                max_retries=int(os.environ.get("OLAT_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+            )
+        return _scheduler
@@ -0,0 +1,194 @@
+"""Persistent, content-addressed cache for LLM responses shared by both apps."""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent
+CACHE_DIR = Path(os.environ.get("OLAT_CACHE_DIR", REPO_ROOT / ".cache"))
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 14 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+STAT_NAMES = ["hits", "misses", "saved_prompt_tokens", "saved_completion_tokens"]
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text: str) -> str:
+    return hash_bytes(text.encode("utf-8"))
+
+
+def make_cache_key(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    image_hash: Optional[str],
+    temperature: float,
+    max_tokens: int,
+    instructions: str = "",
+    response_format: str = "",
+) -> str:
+    """Hash every input that influences the completion into a stable cache key."""
+    fields = {
+        "model": model,
+        "system": system_prompt,
+        "user": user_prompt,
+        "image": image_hash,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if instructions:
+        fields["instructions"] = instructions
+    if response_format:
+        fields["response_format"] = response_format
+    material = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+    return hash_text(material)
+
+
+class ResponseCache:
+    """SQLite-backed response store with TTL expiry and size-based LRU eviction."""
+
+    def __init__(
+        self,
+        path: Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    ):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def _bump(self, name: str, amount: int = 1) -> None:
+        self._conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at, prompt_tokens, completion_tokens FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._bump("misses")
+                self._conn.commit()
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._bump("hits")
+            self._bump("saved_prompt_tokens", row[2] or 0)
+            self._bump("saved_completion_tokens", row[3] or 0)
+            self._conn.commit()
+            return row[0]
+
+    def put(
+        self,
+        key: str,
+        model: str,
+        response: str,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+    ) -> None:
+        now = time.time()
+        size_bytes = len(response.encode("utf-8"))
+        if size_bytes > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model, response, size_bytes, prompt_tokens, completion_tokens, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, response, size_bytes, prompt_tokens, completion_tokens, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until the cache is back under its budget.
+        to_delete = []
+        for key, size_bytes in self._conn.execute(
+            "SELECT key, size_bytes FROM responses ORDER BY last_access ASC"
+        ):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size_bytes
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+        logging.info(f"Response cache evicted {len(to_delete)} entries")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            values = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses"
+            ).fetchone()
+        result = {name: int(values.get(name, 0)) for name in STAT_NAMES}
+        result["entries"] = entries
+        result["size_bytes"] = size_bytes
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM stats")
+            self._conn.commit()
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                CACHE_DIR / "responses.sqlite",
+                max_bytes=int(os.environ.get("OLAT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+                ttl_seconds=float(os.environ.get("OLAT_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+            )
+        return _cache
@@ -0,0 +1,235 @@
+"""Per-call metrics of all model requests, stored in a local SQLite sink.
+
+Every call records model, label (question type or workflow step), session, token
+usage (prompt, completion, provider-cached), time to first token, total latency,
+queue wait, retries and response cache hits. The data can be aggregated per session
+and label, or exported in the Prometheus text format:
+
+    python telemetry.py report [--session ID]
+    python telemetry.py serve --port 9109      # Prometheus endpoint at /metrics
+"""
+import argparse
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from response_cache import CACHE_DIR
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    session_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    ttft_seconds REAL,
+    latency_seconds REAL NOT NULL,
+    queue_seconds REAL NOT NULL,
+    retries INTEGER NOT NULL,
+    cache_hit INTEGER NOT NULL,
+    streamed INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS calls_session ON calls (session_id, label);
+"""
+
+DEFAULT_SESSION = "default"
+
+_session: contextvars.ContextVar[str] = contextvars.ContextVar("telemetry_session", default=DEFAULT_SESSION)
+
+
+def set_session(session_id: str) -> None:
+    """Attribute the calls of the current thread (and contexts copied from it) to session_id."""
+    _session.set(session_id)
+
+
+def current_session() -> str:
+    return _session.get()
+
+
+@dataclass
+class CallMetrics:
+    model: str
+    label: str = ""
+    session_id: str = DEFAULT_SESSION
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    ttft_seconds: Optional[float] = None
+    latency_seconds: float = 0.0
+    queue_seconds: float = 0.0
+    retries: int = 0
+    cache_hit: bool = False
+    streamed: bool = False
+    error: Optional[str] = None
+
+
+class MetricsStore:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def record(self, metrics: CallMetrics) -> None:
+        row = asdict(metrics)
+        row["created_at"] = time.time()
+        row["cache_hit"] = int(metrics.cache_hit)
+        row["streamed"] = int(metrics.streamed)
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{name}" for name in row)
+        with self._lock:
+            self._conn.execute(f"INSERT INTO calls ({columns}) VALUES ({placeholders})", row)
+
+    def summary(self, session_id: Optional[str] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Aggregate calls per label (question type/step), optionally for one session or time window."""
+        conditions, params = [], []
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+            SELECT label,
+                   COUNT(*) AS calls,
+                   SUM(cache_hit) AS cache_hits,
+                   SUM(error IS NOT NULL) AS errors,
+                   SUM(retries) AS retries,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(cached_tokens) AS cached_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   AVG(CASE WHEN cache_hit = 0 AND error IS NULL THEN latency_seconds END) AS avg_latency_seconds,
+                   MAX(CASE WHEN cache_hit = 0 THEN latency_seconds END) AS max_latency_seconds,
+                   AVG(CASE WHEN cache_hit = 0 THEN ttft_seconds END) AS avg_ttft_seconds,
+                   AVG(queue_seconds) AS avg_queue_seconds
+            FROM calls {where}
+            GROUP BY label
+            ORDER BY avg_latency_seconds DESC
+        """
+        with self._lock:
+            cursor = self._conn.execute(query, params)
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def prometheus_text(self) -> str:
+        """Render totals per model and label in the Prometheus text exposition format."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT model, label, COUNT(*), SUM(cache_hit), SUM(error IS NOT NULL), SUM(retries),
+                       SUM(prompt_tokens), SUM(cached_tokens), SUM(completion_tokens),
+                       SUM(CASE WHEN cache_hit = 0 THEN latency_seconds ELSE 0 END),
+                       SUM(CASE WHEN cache_hit = 0 THEN 1 ELSE 0 END),
+                       SUM(COALESCE(ttft_seconds, 0)), SUM(ttft_seconds IS NOT NULL)
+                FROM calls GROUP BY model, label
+                """
+            ).fetchall()
+
+        metrics = [
+            ("olat_llm_calls_total", "counter", "Model calls, including response cache hits", 2),
+            ("olat_llm_cache_hits_total", "counter", "Calls answered from the response cache", 3),
+            ("olat_llm_errors_total", "counter", "Calls that failed", 4),
+            ("olat_llm_retries_total", "counter", "Retries after rate limit or transient errors", 5),
+            ("olat_llm_prompt_tokens_total", "counter", "Prompt tokens sent", 6),
+            ("olat_llm_cached_prompt_tokens_total", "counter", "Prompt tokens served from the provider cache", 7),
+            ("olat_llm_completion_tokens_total", "counter", "Completion tokens received", 8),
+            ("olat_llm_latency_seconds_sum", "counter", "Total latency of API calls", 9),
+            ("olat_llm_latency_seconds_count", "counter", "Number of API calls with measured latency", 10),
+            ("olat_llm_ttft_seconds_sum", "counter", "Total time to first token of streamed calls", 11),
+            ("olat_llm_ttft_seconds_count", "counter", "Number of streamed calls", 12),
+        ]
+        lines: List[str] = []
+        for name, kind, description, index in metrics:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for row in rows:
+                labels = f'model="{_escape(row[0])}",label="{_escape(row[1])}"'
+                lines.append(f"{name}{{{labels}}} {row[index] or 0}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_store: Optional[MetricsStore] = None
+_store_lock = threading.Lock()
+
+
+def get_metrics_store() -> MetricsStore:
+    """Return the process-wide metrics store, creating it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MetricsStore(Path(os.environ.get("OLAT_METRICS_DB", CACHE_DIR / "metrics.sqlite")))
+        return _store
+
+
+def record_call(metrics: CallMetrics) -> None:
+    """Store the metrics of one call; telemetry failures never affect the call itself."""
+    try:
+        get_metrics_store().record(metrics)
+    except Exception as exc:
+        logging.warning(f"Recording call metrics failed: {exc}")
+
+
+def _serve(port: int) -> None:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = get_metrics_store().prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f"Serving metrics on http://0.0.0.0:{port}/metrics")
+    ThreadingHTTPServer(("0.0.0.0", port), Handler).serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Report or export the recorded model call metrics.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="Print a summary per question type/step")
+    report.add_argument("--session", help="Only calls of this session")
+    report.add_argument("--hours", type=float, help="Only calls of the last N hours")
+    serve = subparsers.add_parser("serve", help="Serve the Prometheus text format at /metrics")
+    serve.add_argument("--port", type=int, default=9109)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        _serve(args.port)
+        return
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    rows = get_metrics_store().summary(args.session, since)
+    print(f"{'label':20} {'calls':>6} {'hits':>5} {'errs':>5} {'retry':>5} {'prompt':>9} {'cached':>9} "
+          f"{'output':>8} {'avg s':>7} {'max s':>7} {'ttft s':>7}")
+    for row in rows:
+        print(
+            f"{row['label'] or '-':20} {row['calls']:>6} {row['cache_hits']:>5} {row['errors']:>5} "
+            f"{row['retries']:>5} {row['prompt_tokens']:>9} {row['cached_tokens']:>9} {row['completion_tokens']:>8} "
+            f"{row['avg_latency_seconds'] or 0:>7.1f} {row['max_latency_seconds'] or 0:>7.1f} "
+            f"{row['avg_ttft_seconds'] or 0:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
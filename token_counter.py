@@ -0,0 +1,37 @@
+"""Local token counting for cost display, rate limiting and input budgeting.
+
+Uses tiktoken's o200k_base encoding (the encoding of the GPT-4o/GPT-5 model family)
+when tiktoken is installed, and otherwise estimates about four characters per token.
+"""
+import logging
+from functools import lru_cache
+
+CHARS_PER_TOKEN = 4
+ENCODING_NAME = "o200k_base"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as exc:
+        # The encoding file is downloaded on first use and may be unavailable offline.
+        logging.warning(f"tiktoken encoding {ENCODING_NAME} unavailable, estimating tokens: {exc}")
+        return None
+
+
+def tokenizer_available() -> bool:
+    return _encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
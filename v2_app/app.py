@@ -1,17 +1,38 @@
-﻿import base64
-import io
 import logging
 import os
+import sys
+import time
+import uuid
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import List, Optional
 
-import docx
-import httpx
-import PyPDF2
 import streamlit as st
 from openai import OpenAI
-from pdf2image import convert_from_bytes
-from PIL import Image
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# Shared modules (response cache, OpenAI call layer) live at the repository root.
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from ingestion_cache import PDF_MIME_TYPE, get_ingestion_cache  # noqa: E402
+from llm_client import prompt_cache_stats  # noqa: E402
+from openai_clients import get_openai_client  # noqa: E402
+from pdf_tools import parse_page_selection  # noqa: E402
+from request_scheduler import get_request_scheduler  # noqa: E402
+from response_cache import get_response_cache  # noqa: E402
+from telemetry import get_metrics_store, set_session  # noqa: E402
+from workflow import (  # noqa: E402
+    LANG_HINT,
+    STEP_FILES,
+    STEP_LABELS,
+    build_instruction_payload,
+    call_model,
+    compile_instruction_payloads,
+    detect_language,
+    normalize_output_for_codebox,
+    prefetch_remote_instructions,
+    process_uploaded_file,
+)
 
 
 st.set_page_config(
@@ -26,323 +47,47 @@ logging.basicConfig(level=logging.INFO)
 for env_var in ["HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy"]:
     os.environ.pop(env_var, None)
 
-REPO_ROOT = Path(__file__).resolve().parents[1]
-LOCAL_V2_DIR = REPO_ROOT / "v2_files"
-RAW_BASE_URL = "https://raw.githubusercontent.com/aburossi/prompts/main/olatimport"
-MODEL_NAME = "gpt-4o"
-
-STEP_FILES: Dict[str, List[str]] = {
-    "A": ["step_closed_questions.txt"],
-    "B": ["step_open_questions.txt"],
-    "C": ["step_closed_questions.txt", "step_open_questions.txt"],
-    "D": ["step_dragthewords.txt"],
-    "E": ["step_filltheblanks.txt"],
-    "F": ["step_html_page.txt"],
-    "G": ["step_mindmap.txt"],
-    "H": [
-        "step_full_course.txt",
-        "step_mindmap.txt",
-        "step_html_page.txt",
-        "step_closed_questions.txt",
-        "step_open_questions.txt",
-        "step_dragthewords.txt",
-        "step_filltheblanks.txt",
-    ],
-}
-
-STEP_LABELS = {
-    "en": {
-        "A": "A) Closed questions",
-        "B": "B) Open questions",
-        "C": "C) Mixed closed and open questions",
-        "D": "D) Drag the words",
-        "E": "E) Fill in the blanks",
-        "F": "F) Educational HTML page",
-        "G": "G) Mindmap in HTML",
-        "H": "H) Full course workflow",
-    },
-    "de": {
-        "A": "A) Geschlossene Fragen",
-        "B": "B) Offene Fragen",
-        "C": "C) Mischung aus geschlossenen und offenen Fragen",
-        "D": "D) Drag the words",
-        "E": "E) Lueckentexte",
-        "F": "F) HTML-Lernseite",
-        "G": "G) Mindmap in HTML",
-        "H": "H) Vollstaendiger Kursablauf",
-    },
-    "fr": {
-        "A": "A) Questions fermees",
-        "B": "B) Questions ouvertes",
-        "C": "C) Melange questions fermees et ouvertes",
-        "D": "D) Drag the words",
-        "E": "E) Texte a trous",
-        "F": "F) Page HTML educative",
-        "G": "G) Mindmap en HTML",
-        "H": "H) Workflow cours complet",
-    },
-    "it": {
-        "A": "A) Domande chiuse",
-        "B": "B) Domande aperte",
-        "C": "C) Mix domande chiuse e aperte",
-        "D": "D) Drag the words",
-        "E": "E) Fill in the blanks",
-        "F": "F) Pagina HTML educativa",
-        "G": "G) Mindmap in HTML",
-        "H": "H) Workflow corso completo",
-    },
-    "es": {
-        "A": "A) Preguntas cerradas",
-        "B": "B) Preguntas abiertas",
-        "C": "C) Mezcla de preguntas cerradas y abiertas",
-        "D": "D) Drag the words",
-        "E": "E) Rellenar huecos",
-        "F": "F) Pagina HTML educativa",
-        "G": "G) Mindmap en HTML",
-        "H": "H) Flujo curso completo",
-    },
-}
-
-LANG_HINT = {
-    "en": "English",
-    "de": "German",
-    "fr": "French",
-    "it": "Italian",
-    "es": "Spanish",
-}
-
-
-@st.cache_data(show_spinner=False)
-def read_text_file(path: Path) -> Optional[str]:
-    if not path.exists():
-        return None
-    return path.read_text(encoding="utf-8", errors="replace").strip()
-
-
-def detect_language(text: str) -> str:
-    lowered = text.lower()
-    if not lowered.strip():
-        return "en"
-
-    # Lightweight heuristic for UI labels and language hinting only.
-    if any(char in lowered for char in ["ae", "oe", "ue", "ss"]):
-        if any(token in lowered for token in ["und", "oder", "nicht", "frage", "thema"]):
-            return "de"
-
-    scores = {
-        "de": sum(token in lowered for token in [" und ", " der ", " die ", " das ", "nicht", "frage"]),
-        "fr": sum(token in lowered for token in [" le ", " la ", " les ", "des", "et", "question"]),
-        "it": sum(token in lowered for token in [" il ", " lo ", " gli ", "che", "domanda", "testo"]),
-        "es": sum(token in lowered for token in [" el ", " la ", " los ", "las", "que", "pregunta"]),
-        "en": sum(token in lowered for token in [" the ", " and ", "what", "question", "text"]),
-    }
-
-    return max(scores, key=scores.get) if max(scores.values()) > 0 else "en"
-
-
-def encode_image_for_openai(image: Image.Image) -> str:
-    buffer = io.BytesIO()
-    image.convert("RGB").save(buffer, format="JPEG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-
-def extract_text_from_pdf_bytes(file_bytes: bytes) -> str:
-    reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
-    chunks: List[str] = []
-    for page in reader.pages:
-        page_text = page.extract_text() or ""
-        if page_text.strip():
-            chunks.append(page_text)
-    return "\n".join(chunks).strip()
-
-
-def process_uploaded_file(uploaded_file) -> Tuple[str, Optional[Image.Image], List[str]]:
-    warnings: List[str] = []
-    file_bytes = uploaded_file.getvalue()
-
-    if uploaded_file.type == "application/pdf":
-        text = extract_text_from_pdf_bytes(file_bytes)
-        if text:
-            return text, None, warnings
-        try:
-            images = convert_from_bytes(file_bytes, first_page=1, last_page=1)
-            if images:
-                warnings.append("No OCR text found in PDF. Using first page as image input.")
-                return "", images[0], warnings
-        except Exception as exc:
-            warnings.append(f"PDF to image conversion failed: {exc}")
-        return "", None, warnings
-
-    if uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        doc = docx.Document(io.BytesIO(file_bytes))
-        text = "\n".join(paragraph.text for paragraph in doc.paragraphs).strip()
-        return text, None, warnings
-
-    if uploaded_file.type.startswith("image/"):
-        image = Image.open(io.BytesIO(file_bytes))
-        return "", image, warnings
-
-    warnings.append("Unsupported file type. Upload PDF, DOCX, JPG, JPEG, or PNG.")
-    return "", None, warnings
-
-
-def fetch_remote_text(path_name: str) -> Optional[str]:
-    candidates = [path_name]
-    if path_name == "step_dragthewords.txt":
-        candidates.append("step_dragthewords.txt.txt")
-
-    with httpx.Client(timeout=20.0) as client:
-        for candidate in candidates:
-            url = f"{RAW_BASE_URL}/{candidate}"
-            try:
-                response = client.get(url)
-                if response.status_code == 200 and response.text.strip():
-                    return response.text.strip()
-            except Exception:
-                continue
-    return None
-
+STREAM_REFRESH_SECONDS = 0.2
 
-def load_instruction_file(filename: str) -> Tuple[Optional[str], str]:
-    local_candidates = [
-        LOCAL_V2_DIR / filename,
-        REPO_ROOT / filename,
-    ]
+# Download missing step files in the background so Generate does not wait for them.
+prefetch_remote_instructions()
 
-    for local_path in local_candidates:
-        content = read_text_file(local_path)
-        if content:
-            return content, f"local:{local_path}"
 
-    remote_content = fetch_remote_text(filename)
-    if remote_content:
-        return remote_content, f"remote:{RAW_BASE_URL}/{filename}"
+def select_pdf_pages(file_bytes: bytes) -> Optional[List[int]]:
+    try:
+        # Cached by content hash, so the PDF is parsed once and not on every rerun.
+        page_count = get_ingestion_cache().document(file_bytes, PDF_MIME_TYPE).page_count
+    except Exception:
+        return None
+    if page_count <= 1:
+        return None
 
-    return None, "missing"
+    selection = st.text_input(
+        f"Pages to use (1-{page_count}, e.g. 1-3, 7; empty = all pages)",
+        key="pdf_page_selection",
+    )
+    try:
+        return parse_page_selection(selection, page_count)
+    except ValueError as exc:
+        st.warning(f"{exc}. Using all pages.")
+        return None
 
 
-def get_openai_client() -> Optional[OpenAI]:
+def get_client() -> Optional[OpenAI]:
     try:
-        api_key = st.secrets["openai"]["api_key"]
-        http_client = httpx.Client(timeout=60.0)
-        return OpenAI(api_key=api_key, http_client=http_client)
+        return get_openai_client(st.secrets["openai"]["api_key"])
     except Exception as exc:
         st.error(f"OpenAI client initialization failed: {exc}")
         return None
 
 
-def build_instruction_payload(step_key: str) -> Tuple[str, List[str], List[str]]:
-    sources: List[str] = []
-    missing: List[str] = []
-
-    prompt_v2 = read_text_file(REPO_ROOT / "prompt_v2.md")
-    readme_v2 = read_text_file(LOCAL_V2_DIR / "README.txt")
-
-    if prompt_v2:
-        sources.append("local:prompt_v2.md")
-    else:
-        missing.append("prompt_v2.md")
-
-    if readme_v2:
-        sources.append("local:v2_files/README.txt")
-    else:
-        missing.append("v2_files/README.txt")
-
-    selected_files = STEP_FILES[step_key]
-    step_blocks: List[str] = []
-
-    for filename in selected_files:
-        content, source = load_instruction_file(filename)
-        if content:
-            sources.append(source)
-            step_blocks.append(f"FILE {filename}\n{content}")
-        else:
-            missing.append(filename)
-
-    parts = []
-    if prompt_v2:
-        parts.append(f"GLOBAL PROMPT V2\n{prompt_v2}")
-    if readme_v2:
-        parts.append(f"GLOBAL README V2\n{readme_v2}")
-    parts.extend(step_blocks)
-
-    return "\n\n".join(parts), sources, missing
-
-
-def call_model(
-    client: OpenAI,
-    instruction_payload: str,
-    user_input: str,
-    language_hint: str,
-    step_key: str,
-    image: Optional[Image.Image],
-) -> str:
-    system_prompt = (
-        "You are an educational content generator for OpenOLAT imports. "
-        "Follow the provided instruction files exactly. "
-        "If instructions conflict, prioritize selected step files, then v2 README, then prompt_v2. "
-        "Respect required output format and separators. "
-        "Output in the same language as the user input unless a step explicitly says otherwise."
-    )
-
-    user_prompt = (
-        f"Selected step: {step_key}\n"
-        f"Language hint: {language_hint}\n\n"
-        "INSTRUCTIONS START\n"
-        f"{instruction_payload}\n"
-        "INSTRUCTIONS END\n\n"
-        "USER CONTENT START\n"
-        f"{user_input.strip()}\n"
-        "USER CONTENT END"
-    )
-
-    if image is not None:
-        image_data = encode_image_for_openai(image)
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": user_prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_data}",
-                            "detail": "low",
-                        },
-                    },
-                ],
-            },
-        ]
-    else:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
-
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=messages,
-        temperature=0.4,
-        max_completion_tokens=8000,
-    )
-    return (response.choices[0].message.content or "").strip()
-
-
-def normalize_output_for_codebox(output: str) -> str:
-    text = output.strip()
-    if not text:
-        return ""
-
-    if text.startswith("```") and text.endswith("```"):
-        lines = text.splitlines()
-        if len(lines) >= 3:
-            return "\n".join(lines[1:-1]).strip()
-    return text
-
-
 def main() -> None:
     st.title("OLAT Workflow V2")
+
+    # Attribute all model calls of this browser session to one telemetry session.
+    if "telemetry_session" not in st.session_state:
+        st.session_state.telemetry_session = uuid.uuid4().hex[:12]
+    set_session(st.session_state.telemetry_session)
     st.caption(
         "Step-based generator using prompt_v2 and v2_files instructions. "
         "Upload text material or provide a topic, then choose workflow A-H."
@@ -354,10 +99,11 @@ def main() -> None:
     )
 
     extracted_text = ""
-    uploaded_image: Optional[Image.Image] = None
+    uploaded_image: Optional[bytes] = None
 
     if uploaded_file is not None:
-        extracted_text, uploaded_image, warnings = process_uploaded_file(uploaded_file)
+        pages = select_pdf_pages(uploaded_file.getvalue()) if uploaded_file.type == PDF_MIME_TYPE else None
+        extracted_text, uploaded_image, warnings = process_uploaded_file(uploaded_file, pages)
         for warning in warnings:
             st.warning(warning)
         if extracted_text:
@@ -376,19 +122,64 @@ def main() -> None:
     localized_labels = STEP_LABELS.get(detected_lang, STEP_LABELS["en"])
 
     st.markdown(f"Detected input language: `{LANG_HINT.get(detected_lang, 'English')}`")
+    # Compiled once and reused until an instruction file changes.
+    payloads = compile_instruction_payloads()
     selected_step = st.radio(
-        "Choose the workflow step",
+        "Choose the workflow step (instruction size in tokens)",
         options=list(STEP_FILES.keys()),
-        format_func=lambda key: localized_labels.get(key, key),
+        format_func=lambda key: f"{localized_labels.get(key, key)} - ~{payloads[key].token_count:,} tokens",
         horizontal=False,
     )
 
+    bypass_cache = st.checkbox(
+        "Bypass cache / regenerate",
+        help="Ignore stored responses for identical input and request a fresh generation.",
+    )
+
+    stream_output = st.checkbox(
+        "Stream output while generating",
+        value=True,
+        help="Show the response as it is generated instead of waiting for the complete answer.",
+    )
+
+    with st.sidebar.expander("Response cache"):
+        cache_stats = get_response_cache().stats()
+        st.write(f"Hits: {cache_stats['hits']} / misses: {cache_stats['misses']}")
+        st.write(
+            f"Tokens saved: {cache_stats['saved_prompt_tokens']} input, "
+            f"{cache_stats['saved_completion_tokens']} output"
+        )
+        st.write(f"Entries: {cache_stats['entries']} ({cache_stats['size_bytes'] / 1024:.0f} KB)")
+        usage = prompt_cache_stats()
+        if usage["prompt_tokens"]:
+            st.write(
+                f"Provider prompt cache: {usage['cached_tokens']} of {usage['prompt_tokens']} input tokens "
+                f"({usage['cached_tokens'] / usage['prompt_tokens']:.0%})"
+            )
+
+    with st.sidebar.expander("Request queue"):
+        scheduler_stats = get_request_scheduler().stats()
+        st.write(f"Waiting: {scheduler_stats['queue_depth']} / running: {scheduler_stats['in_flight']}")
+        st.write(
+            f"Wait time: {scheduler_stats['average_wait_seconds']:.1f} s average, "
+            f"{scheduler_stats['max_wait_seconds']:.1f} s max"
+        )
+        st.write(f"Retries: {scheduler_stats['retries']} / failures: {scheduler_stats['failures']}")
+
+    with st.sidebar.expander("Usage this session"):
+        for row in get_metrics_store().summary(st.session_state.telemetry_session):
+            st.write(
+                f"{row['label'] or '-'}: {row['calls']} calls ({row['cache_hits']} cached), "
+                f"{row['prompt_tokens']} in / {row['completion_tokens']} out tokens, "
+                f"{row['avg_latency_seconds'] or 0:.1f} s average"
+            )
+
     if st.button("Generate", type="primary"):
         if not user_input.strip() and uploaded_image is None:
             st.warning("Please provide text/topic or upload an image.")
             st.stop()
 
-        client = get_openai_client()
+        client = get_client()
         if client is None:
             st.stop()
 
@@ -397,6 +188,23 @@ def main() -> None:
             st.error("No instructions could be loaded for the selected step.")
             st.stop()
 
+        stream_status = st.empty()
+        stream_view = st.empty()
+        started = time.perf_counter()
+        live = {"text": "", "first_token": None, "rendered_at": 0.0}
+
+        def show_delta(delta: str) -> None:
+            now = time.perf_counter()
+            if live["first_token"] is None:
+                live["first_token"] = now - started
+            live["text"] += delta
+            if now - live["rendered_at"] >= STREAM_REFRESH_SECONDS:
+                live["rendered_at"] = now
+                stream_status.caption(
+                    f"First token after {live['first_token']:.1f} s - {len(live['text'])} characters received"
+                )
+                stream_view.code(live["text"], language="text")
+
         with st.spinner("Generating content..."):
             try:
                 raw_output = call_model(
@@ -406,12 +214,21 @@ def main() -> None:
                     language_hint=LANG_HINT.get(detected_lang, "English"),
                     step_key=selected_step,
                     image=uploaded_image,
+                    use_cache=not bypass_cache,
+                    on_delta=show_delta if stream_output else None,
                 )
             except Exception as exc:
                 st.error(f"Generation failed: {exc}")
                 logging.exception("Generation failure")
                 st.stop()
 
+        stream_view.empty()
+        if live["first_token"] is not None:
+            stream_status.caption(
+                f"First token after {live['first_token']:.1f} s, "
+                f"complete after {time.perf_counter() - started:.1f} s"
+            )
+
         cleaned_output = normalize_output_for_codebox(raw_output)
         st.subheader("Generated Output")
         st.code(cleaned_output if cleaned_output else raw_output, language="text")
@@ -0,0 +1,421 @@
+"""Streamlit-free core of the V2 workflow: instruction loading, input extraction and model calls.
+
+Shared by v2_app/app.py and the batch command line interface (olat_batch.py).
+"""
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from image_pipeline import prepare_image_payload
+from ingestion_cache import DOCX_MIME_TYPE, PDF_MIME_TYPE, get_ingestion_cache
+from llm_client import ChatRequest, complete_request
+from ocr_tools import ocr_available, split_by_confidence
+from instruction_cache import get_instruction_cache
+from token_counter import count_tokens
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+LOCAL_V2_DIR = REPO_ROOT / "v2_files"
+MODEL_NAME = "gpt-4o"
+SYSTEM_PROMPT = (
+    "You are an educational content generator for OpenOLAT imports. "
+    "Follow the provided instruction files exactly. "
+    "If instructions conflict, prioritize selected step files, then v2 README, then prompt_v2. "
+    "Respect required output format and separators. "
+    "Output in the same language as the user input unless a step explicitly says otherwise."
+)
+
+STEP_FILES: Dict[str, List[str]] = {
+    "A": ["step_closed_questions.txt"],
+    "B": ["step_open_questions.txt"],
+    "C": ["step_closed_questions.txt", "step_open_questions.txt"],
+    "D": ["step_dragthewords.txt"],
+    "E": ["step_filltheblanks.txt"],
+    "F": ["step_html_page.txt"],
+    "G": ["step_mindmap.txt"],
+    "H": [
+        "step_full_course.txt",
+        "step_mindmap.txt",
+        "step_html_page.txt",
+        "step_closed_questions.txt",
+        "step_open_questions.txt",
+        "step_dragthewords.txt",
+        "step_filltheblanks.txt",
+    ],
+}
+
+STEP_LABELS = {
+    "en": {
+        "A": "A) Closed questions",
+        "B": "B) Open questions",
+        "C": "C) Mixed closed and open questions",
+        "D": "D) Drag the words",
+        "E": "E) Fill in the blanks",
+        "F": "F) Educational HTML page",
+        "G": "G) Mindmap in HTML",
+        "H": "H) Full course workflow",
+    },
+    "de": {
+        "A": "A) Geschlossene Fragen",
+        "B": "B) Offene Fragen",
+        "C": "C) Mischung aus geschlossenen und offenen Fragen",
+        "D": "D) Drag the words",
+        "E": "E) Lueckentexte",
+        "F": "F) HTML-Lernseite",
+        "G": "G) Mindmap in HTML",
+        "H": "H) Vollstaendiger Kursablauf",
+    },
+    "fr": {
+        "A": "A) Questions fermees",
+        "B": "B) Questions ouvertes",
+        "C": "C) Melange questions fermees et ouvertes",
+        "D": "D) Drag the words",
+        "E": "E) Texte a trous",
+        "F": "F) Page HTML educative",
+        "G": "G) Mindmap en HTML",
+        "H": "H) Workflow cours complet",
+    },
+    "it": {
+        "A": "A) Domande chiuse",
+        "B": "B) Domande aperte",
+        "C": "C) Mix domande chiuse e aperte",
+        "D": "D) Drag the words",
+        "E": "E) Fill in the blanks",
+        "F": "F) Pagina HTML educativa",
+        "G": "G) Mindmap in HTML",
+        "H": "H) Workflow corso completo",
+    },
+    "es": {
+        "A": "A) Preguntas cerradas",
+        "B": "B) Preguntas abiertas",
+        "C": "C) Mezcla de preguntas cerradas y abiertas",
+        "D": "D) Drag the words",
+        "E": "E) Rellenar huecos",
+        "F": "F) Pagina HTML educativa",
+        "G": "G) Mindmap en HTML",
+        "H": "H) Flujo curso completo",
+    },
+}
+
+LANG_HINT = {
+    "en": "English",
+    "de": "German",
+    "fr": "French",
+    "it": "Italian",
+    "es": "Spanish",
+}
+
+
+def file_stamp(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=128)
+def _read_text_file(path: Path, stamp: Optional[int]) -> Optional[str]:
+    if stamp is None:
+        return None
+    return path.read_text(encoding="utf-8", errors="replace").strip()
+
+
+def read_text_file(path: Path) -> Optional[str]:
+    # Keyed by modification time, so edited instruction files are picked up without a restart.
+    return _read_text_file(path, file_stamp(path))
+
+
+def detect_language(text: str) -> str:
+    lowered = text.lower()
+    if not lowered.strip():
+        return "en"
+
+    # Lightweight heuristic for UI labels and language hinting only.
+    if any(char in lowered for char in ["ae", "oe", "ue", "ss"]):
+        if any(token in lowered for token in ["und", "oder", "nicht", "frage", "thema"]):
+            return "de"
+
+    scores = {
+        "de": sum(token in lowered for token in [" und ", " der ", " die ", " das ", "nicht", "frage"]),
+        "fr": sum(token in lowered for token in [" le ", " la ", " les ", "des", "et", "question"]),
+        "it": sum(token in lowered for token in [" il ", " lo ", " gli ", "che", "domanda", "testo"]),
+        "es": sum(token in lowered for token in [" el ", " la ", " los ", "las", "que", "pregunta"]),
+        "en": sum(token in lowered for token in [" the ", " and ", "what", "question", "text"]),
+    }
+
+    return max(scores, key=scores.get) if max(scores.values()) > 0 else "en"
+
+
+def encode_image_for_openai(image: bytes) -> str:
+    # Images are sent with "low" detail, so downscale before encoding (memoised per image).
+    return prepare_image_payload(image)
+
+
+def extract_text_from_pdf_bytes(file_bytes: bytes, pages: Optional[List[int]] = None) -> str:
+    return get_ingestion_cache().document(file_bytes, PDF_MIME_TYPE).text(pages)
+
+
+def process_file_bytes(
+    file_bytes: bytes, mime_type: str, pages: Optional[List[int]] = None
+) -> Tuple[str, Optional[bytes], List[str]]:
+    warnings: List[str] = []
+
+    if mime_type == PDF_MIME_TYPE:
+        # Parsed once per distinct upload; reruns and re-uploads reuse the cached text and pages.
+        document = get_ingestion_cache().document(file_bytes, mime_type)
+        text = document.text(pages)
+        if text:
+            return text, None, warnings
+        unreliable_pages = []
+        if ocr_available():
+            # Scanned PDF: use local OCR; pages it cannot read reliably go to the model as an image
+            text, unreliable_pages = split_by_confidence(document.ocr(pages))
+            if text and not unreliable_pages:
+                return text, None, warnings
+        first_page = unreliable_pages[0] if unreliable_pages else (pages[0] if pages else 1)
+        try:
+            # Render only the needed page, at the resolution the model input is reduced to anyway.
+            page_path = document.renderer(pages).page_path(first_page)
+            if text:
+                warnings.append(
+                    f"Pages {', '.join(map(str, unreliable_pages))} could not be recognised reliably (OCR). "
+                    f"Using the OCR text and page {first_page} as image input."
+                )
+            else:
+                warnings.append(f"No OCR text found in PDF. Using page {first_page} as image input.")
+            return text, page_path.read_bytes(), warnings
+        except Exception as exc:
+            warnings.append(f"PDF to image conversion failed: {exc}")
+        return text, None, warnings
+
+    if mime_type == DOCX_MIME_TYPE:
+        return get_ingestion_cache().document(file_bytes, mime_type).text(), None, warnings
+
+    if mime_type.startswith("image/"):
+        return "", file_bytes, warnings
+
+    warnings.append("Unsupported file type. Upload PDF, DOCX, JPG, JPEG, or PNG.")
+    return "", None, warnings
+
+
+def process_uploaded_file(
+    uploaded_file, pages: Optional[List[int]] = None
+) -> Tuple[str, Optional[bytes], List[str]]:
+    return process_file_bytes(uploaded_file.getvalue(), uploaded_file.type, pages)
+
+
+def remote_candidates(path_name: str) -> List[str]:
+    candidates = [path_name]
+    if path_name == "step_dragthewords.txt":
+        candidates.append("step_dragthewords.txt.txt")
+    return candidates
+
+
+def fetch_remote_text(path_name: str) -> Tuple[Optional[str], str]:
+    """Return (content, url) of a remote instruction file, served from the on-disk instruction cache."""
+    cache = get_instruction_cache()
+    for candidate in remote_candidates(path_name):
+        content = cache.get(candidate)
+        if content and content.strip():
+            return content.strip(), cache.url(candidate)
+    return None, cache.url(path_name)
+
+
+def prefetch_remote_instructions() -> None:
+    """Start downloading/revalidating, in parallel, all step files that are not available locally."""
+    remote_files = [
+        filename
+        for filenames in STEP_FILES.values()
+        for filename in filenames
+        if not any(read_text_file(path) for path in (LOCAL_V2_DIR / filename, REPO_ROOT / filename))
+    ]
+    get_instruction_cache().prefetch(
+        candidate for filename in remote_files for candidate in remote_candidates(filename)
+    )
+
+
+def load_instruction_file(filename: str) -> Tuple[Optional[str], str]:
+    local_candidates = [
+        LOCAL_V2_DIR / filename,
+        REPO_ROOT / filename,
+    ]
+
+    for local_path in local_candidates:
+        content = read_text_file(local_path)
+        if content:
+            return content, f"local:{local_path}"
+
+    remote_content, url = fetch_remote_text(filename)
+    if remote_content:
+        return remote_content, f"remote:{url}"
+
+    return None, "missing"
+
+
+@dataclass(frozen=True)
+class InstructionPayload:
+    step_key: str
+    text: str
+    sources: Tuple[str, ...]
+    missing: Tuple[str, ...]
+    token_count: int
+    fingerprint: Tuple
+
+
+_payloads: Dict[str, InstructionPayload] = {}
+_payloads_lock = threading.Lock()
+
+
+def _payload_fingerprint(step_key: str) -> Tuple:
+    """Modification times of every file a step's payload can be built from."""
+    stamps: List[Optional[int]] = [
+        file_stamp(REPO_ROOT / "prompt_v2.md"),
+        file_stamp(LOCAL_V2_DIR / "README.txt"),
+    ]
+    cache = get_instruction_cache()
+    for filename in STEP_FILES[step_key]:
+        stamps.append(file_stamp(LOCAL_V2_DIR / filename))
+        stamps.append(file_stamp(REPO_ROOT / filename))
+        stamps.extend(cache.stamp(candidate) for candidate in remote_candidates(filename))
+    return tuple(stamps)
+
+
+def get_instruction_payload(step_key: str) -> InstructionPayload:
+    """Return the compiled payload of a step, recompiling it only when one of its files changed."""
+    fingerprint = _payload_fingerprint(step_key)
+    with _payloads_lock:
+        payload = _payloads.get(step_key)
+    if payload is not None and payload.fingerprint == fingerprint:
+        return payload
+
+    text, sources, missing = compile_instruction_payload(step_key)
+    # Downloads made while compiling change the fingerprint; store the state after compiling.
+    payload = InstructionPayload(
+        step_key=step_key,
+        text=text,
+        sources=tuple(sources),
+        missing=tuple(missing),
+        token_count=count_tokens(text),
+        fingerprint=_payload_fingerprint(step_key),
+    )
+    with _payloads_lock:
+        _payloads[step_key] = payload
+    return payload
+
+
+def clear_instruction_payloads() -> None:
+    """Forget the compiled payloads and the text files read for them, so the next build starts cold."""
+    with _payloads_lock:
+        _payloads.clear()
+    _read_text_file.cache_clear()
+
+
+def compile_instruction_payloads() -> Dict[str, InstructionPayload]:
+    """Compile (or validate) the payloads of all steps, e.g. at startup."""
+    return {step_key: get_instruction_payload(step_key) for step_key in STEP_FILES}
+
+
+def build_instruction_payload(step_key: str) -> Tuple[str, List[str], List[str]]:
+    payload = get_instruction_payload(step_key)
+    return payload.text, list(payload.sources), list(payload.missing)
+
+
+def compile_instruction_payload(step_key: str) -> Tuple[str, List[str], List[str]]:
+    sources: List[str] = []
+    missing: List[str] = []
+
+    prompt_v2 = read_text_file(REPO_ROOT / "prompt_v2.md")
+    readme_v2 = read_text_file(LOCAL_V2_DIR / "README.txt")
+
+    if prompt_v2:
+        sources.append("local:prompt_v2.md")
+    else:
+        missing.append("prompt_v2.md")
+
+    if readme_v2:
+        sources.append("local:v2_files/README.txt")
+    else:
+        missing.append("v2_files/README.txt")
+
+    selected_files = STEP_FILES[step_key]
+    step_blocks: List[str] = []
+
+    for filename in selected_files:
+        content, source = load_instruction_file(filename)
+        if content:
+            sources.append(source)
+            step_blocks.append(f"FILE {filename}\n{content}")
+        else:
+            missing.append(filename)
+
+    parts = []
+    if prompt_v2:
+        parts.append(f"GLOBAL PROMPT V2\n{prompt_v2}")
+    if readme_v2:
+        parts.append(f"GLOBAL README V2\n{readme_v2}")
+    parts.extend(step_blocks)
+
+    return "\n\n".join(parts), sources, missing
+
+
+def build_model_request(
+    instruction_payload: str,
+    user_input: str,
+    language_hint: str,
+    step_key: str,
+    image: Optional[bytes],
+) -> ChatRequest:
+    # Static per step: sent ahead of the user content so it forms a cacheable prompt prefix.
+    instructions = (
+        f"Selected step: {step_key}\n\n"
+        "INSTRUCTIONS START\n"
+        f"{instruction_payload}\n"
+        "INSTRUCTIONS END"
+    )
+
+    user_prompt = (
+        f"Language hint: {language_hint}\n\n"
+        "USER CONTENT START\n"
+        f"{user_input.strip()}\n"
+        "USER CONTENT END"
+    )
+
+    return ChatRequest(
+        model=MODEL_NAME,
+        system_prompt=SYSTEM_PROMPT,
+        user_prompt=user_prompt,
+        temperature=0.4,
+        max_completion_tokens=8000,
+        image_b64=encode_image_for_openai(image) if image is not None else None,
+        instructions=instructions,
+        label=f"step_{step_key}",
+    )
+
+
+def call_model(
+    client: OpenAI,
+    instruction_payload: str,
+    user_input: str,
+    language_hint: str,
+    step_key: str,
+    image: Optional[bytes],
+    use_cache: bool = True,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    chat_request = build_model_request(instruction_payload, user_input, language_hint, step_key, image)
+    return complete_request(client, chat_request, use_cache=use_cache, on_delta=on_delta).strip()
+
+
+def normalize_output_for_codebox(output: str) -> str:
+    text = output.strip()
+    if not text:
+        return ""
+
+    if text.startswith("```") and text.endswith("```"):
+        lines = text.splitlines()
+        if len(lines) >= 3:
+            return "\n".join(lines[1:-1]).strip()
+    return text